@@ -0,0 +1,778 @@
+"""Offline benchmark of the API router and inference worker Lambdas.
+
+Both handlers run in process against moto (S3, DynamoDB, SQS) and a simulated
+Bedrock runtime with configurable latency, output size, truncation and
+throttling. Results are printed as a table and written as JSON so that runs
+can be compared across commits:
+
+    python benchmarks/bench.py --output bench.json
+    python benchmarks/bench.py --compare bench.json
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import math
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import uuid
+import warnings
+from typing import Any, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROUTER_PATH = os.path.join(ROOT, "lambdas", "api_router", "index.py")
+WORKER_PATH = os.path.join(ROOT, "lambdas", "inference_job_handler", "index.py")
+
+USER_ID = "bench-user"
+INPUT_BUCKET = "bench-input"
+OUTPUT_BUCKET = "bench-output"
+METADATA_TABLE = "bench-metadata"
+JOBS_TABLE = "bench-jobs"
+RATE_LIMITER_TABLE = "bench-rate-limiter"
+QUEUE_NAME = "bench-inference"
+CHARS_PER_TOKEN = 3.5
+
+# Metrics compared by --compare, with True when higher is better
+COMPARED_METRICS = {
+    "throughput_files_per_s": True,
+    "file_p50_s": False,
+    "file_p95_s": False,
+    "bedrock_calls_per_file": False,
+    "p50_ms": False,
+    "p95_ms": False,
+}
+
+
+class SimulatedEventStream(list):
+    """Events of a ConverseStream response, closable like botocore's EventStream."""
+
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class SimulatedBedrock:
+    """Stand-in for the bedrock-runtime client used by the inference worker.
+
+    Every response is cut after `calls_per_response` calls: the earlier calls
+    stop on max_tokens and the worker has to continue them. A call fails with
+    ThrottlingException with probability `throttle_rate`. Grouped inputs are
+    answered with one <fichier> section per file.
+    """
+
+    def __init__(
+        self,
+        latency: float,
+        latency_jitter: float,
+        output_tokens: int,
+        calls_per_response: int,
+        throttle_rate: float,
+        seed: int,
+    ):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.output_tokens = output_tokens
+        self.calls_per_response = calls_per_response
+        self.throttle_rate = throttle_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.conversations = {}
+        self.calls = 0
+        self.throttles = 0
+
+    def reset(self):
+        with self.lock:
+            self.conversations = {}
+            self.calls = 0
+            self.throttles = 0
+
+    def _respond(self, operation: str, messages: List[Dict[str, Any]], system):
+        from botocore.exceptions import ClientError
+
+        with self.lock:
+            delay = max(0.0, self.random.gauss(self.latency, self.latency_jitter))
+            throttled = self.random.random() < self.throttle_rate
+            if throttled:
+                self.throttles += 1
+        time.sleep(delay)
+        if throttled:
+            raise ClientError(
+                {"Error": {"Code": "ThrottlingException", "Message": "Slow down"}},
+                operation,
+            )
+
+        texts = [block.get("text", "") for block in system or []] + [
+            block.get("text", "")
+            for message in messages
+            for block in message["content"]
+        ]
+        conversation = (texts[0], messages[0]["content"][0]["text"])
+        with self.lock:
+            self.calls += 1
+            # A conversation restarts when the assistant turn is not prefilled
+            if messages[-1]["role"] != "assistant":
+                self.conversations[conversation] = 0
+            self.conversations[conversation] = (
+                self.conversations.get(conversation, 0) + 1
+            )
+            call_number = self.conversations[conversation]
+
+        text = "lorem ipsum " * int(self.output_tokens * CHARS_PER_TOKEN / 12)
+        if call_number == 1:
+            text = "<reponse>" + text
+        finished = call_number >= self.calls_per_response
+        if finished:
+            text += "".join(
+                f'<fichier numero="{number}">ipsum</fichier>'
+                for number in re.findall(r'<fichier numero="(\d+)">', conversation[1])
+            )
+            text += "</reponse>"
+        input_tokens = int(sum(len(part) for part in texts) / CHARS_PER_TOKEN)
+        usage = {
+            "inputTokens": input_tokens,
+            "outputTokens": self.output_tokens,
+            "totalTokens": input_tokens + self.output_tokens,
+        }
+        stop_reason = "end_turn" if finished else "max_tokens"
+        return text, usage, stop_reason, int(delay * 1000)
+
+    def converse(self, modelId, messages, inferenceConfig, system=None, **kwargs):
+        text, usage, stop_reason, latency_ms = self._respond(
+            "Converse", messages, system
+        )
+        return {
+            "output": {"message": {"role": "assistant", "content": [{"text": text}]}},
+            "stopReason": stop_reason,
+            "usage": usage,
+            "metrics": {"latencyMs": latency_ms},
+        }
+
+    def converse_stream(
+        self, modelId, messages, inferenceConfig, system=None, **kwargs
+    ):
+        text, usage, stop_reason, latency_ms = self._respond(
+            "ConverseStream", messages, system
+        )
+        deltas = [text[i : i + 500] for i in range(0, len(text), 500)]
+        return {
+            "stream": SimulatedEventStream(
+                [{"messageStart": {"role": "assistant"}}]
+                + [
+                    {"contentBlockDelta": {"delta": {"text": delta}}}
+                    for delta in deltas
+                ]
+                + [
+                    {"messageStop": {"stopReason": stop_reason}},
+                    {
+                        "metadata": {
+                            "usage": usage,
+                            "metrics": {"latencyMs": latency_ms},
+                        }
+                    },
+                ]
+            )
+        }
+
+
+class LambdaContext:
+    """Minimal Lambda context accepted by the Powertools decorators."""
+
+    def __init__(self, function_name: str, timeout_seconds: int = 900):
+        self.function_name = function_name
+        self.memory_limit_in_mb = 1024
+        self.invoked_function_arn = (
+            f"arn:aws:lambda:us-east-1:000000000000:function:{function_name}"
+        )
+        self.aws_request_id = str(uuid.uuid4())
+        self.deadline = time.time() + timeout_seconds
+
+    def get_remaining_time_in_millis(self) -> int:
+        return int((self.deadline - time.time()) * 1000)
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile, 0 for an empty list."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def load_module(path: str, name: str):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def configure_environment(args: argparse.Namespace):
+    os.environ.update(
+        {
+            "AWS_DEFAULT_REGION": "us-east-1",
+            "AWS_ACCESS_KEY_ID": "bench",
+            "AWS_SECRET_ACCESS_KEY": "bench",
+            "POWERTOOLS_TRACE_DISABLED": "true",
+            "POWERTOOLS_LOG_LEVEL": "ERROR",
+            "LOG_LEVEL": "ERROR",
+            "POWERTOOLS_METRICS_NAMESPACE": "bench",
+            "POWERTOOLS_SERVICE_NAME": "bench",
+            "INPUT_BUCKET": INPUT_BUCKET,
+            "OUTPUT_BUCKET": OUTPUT_BUCKET,
+            "INPUT_BUCKET_NAME": INPUT_BUCKET,
+            "OUTPUT_BUCKET_NAME": OUTPUT_BUCKET,
+            "METADATA_TABLE": METADATA_TABLE,
+            "INFERENCE_JOBS_TABLE": JOBS_TABLE,
+        }
+    )
+    if args.throttle_rate > 0:
+        # Throttles are only retried by the worker through the rate limiter
+        os.environ.update(
+            {
+                "RATE_LIMITER_TABLE": RATE_LIMITER_TABLE,
+                "RATE_LIMIT_REQUESTS_PER_MINUTE": "100000",
+                "RATE_LIMIT_TOKENS_PER_MINUTE": "1000000000",
+            }
+        )
+    for setting in args.set:
+        name, _, value = setting.partition("=")
+        os.environ[name] = value
+
+
+def create_resources() -> str:
+    """Create the buckets, tables and queue described in Terraform."""
+    import boto3
+
+    s3 = boto3.client("s3")
+    for bucket in (INPUT_BUCKET, OUTPUT_BUCKET):
+        s3.create_bucket(Bucket=bucket)
+
+    dynamodb = boto3.client("dynamodb")
+    dynamodb.create_table(
+        TableName=METADATA_TABLE,
+        KeySchema=[
+            {"AttributeName": "user_id", "KeyType": "HASH"},
+            {"AttributeName": "file_id", "KeyType": "RANGE"},
+        ],
+        AttributeDefinitions=[
+            {"AttributeName": "user_id", "AttributeType": "S"},
+            {"AttributeName": "file_id", "AttributeType": "S"},
+            {"AttributeName": "content_hash", "AttributeType": "S"},
+            {"AttributeName": "last_modified", "AttributeType": "N"},
+            {"AttributeName": "filename", "AttributeType": "S"},
+        ],
+        GlobalSecondaryIndexes=[
+            {
+                "IndexName": "LastModifiedIndex",
+                "KeySchema": [
+                    {"AttributeName": "user_id", "KeyType": "HASH"},
+                    {"AttributeName": "last_modified", "KeyType": "RANGE"},
+                ],
+                "Projection": {"ProjectionType": "ALL"},
+            },
+            {
+                "IndexName": "ContentHashIndex",
+                "KeySchema": [
+                    {"AttributeName": "user_id", "KeyType": "HASH"},
+                    {"AttributeName": "content_hash", "KeyType": "RANGE"},
+                ],
+                "Projection": {
+                    "ProjectionType": "INCLUDE",
+                    "NonKeyAttributes": ["object_key", "size", "stored_size"],
+                },
+            },
+            {
+                "IndexName": "FilenameIndex",
+                "KeySchema": [
+                    {"AttributeName": "user_id", "KeyType": "HASH"},
+                    {"AttributeName": "filename", "KeyType": "RANGE"},
+                ],
+                "Projection": {"ProjectionType": "KEYS_ONLY"},
+            },
+        ],
+        BillingMode="PAY_PER_REQUEST",
+    )
+    dynamodb.create_table(
+        TableName=JOBS_TABLE,
+        KeySchema=[
+            {"AttributeName": "user_id", "KeyType": "HASH"},
+            {"AttributeName": "job_id", "KeyType": "RANGE"},
+        ],
+        AttributeDefinitions=[
+            {"AttributeName": "user_id", "AttributeType": "S"},
+            {"AttributeName": "job_id", "AttributeType": "S"},
+            {"AttributeName": "created_at", "AttributeType": "N"},
+            {"AttributeName": "updated_at", "AttributeType": "N"},
+        ],
+        GlobalSecondaryIndexes=[
+            {
+                "IndexName": index_name,
+                "KeySchema": [
+                    {"AttributeName": "user_id", "KeyType": "HASH"},
+                    {"AttributeName": range_key, "KeyType": "RANGE"},
+                ],
+                "Projection": {"ProjectionType": "ALL"},
+            }
+            for index_name, range_key in (
+                ("CreatedAtIndex", "created_at"),
+                ("UpdatedAtIndex", "updated_at"),
+            )
+        ],
+        BillingMode="PAY_PER_REQUEST",
+    )
+    dynamodb.create_table(
+        TableName=RATE_LIMITER_TABLE,
+        KeySchema=[{"AttributeName": "limiter_id", "KeyType": "HASH"}],
+        AttributeDefinitions=[{"AttributeName": "limiter_id", "AttributeType": "S"}],
+        BillingMode="PAY_PER_REQUEST",
+    )
+
+    queue_url = boto3.client("sqs").create_queue(QueueName=QUEUE_NAME)["QueueUrl"]
+    os.environ["INFERENCE_QUEUE_URL"] = queue_url
+    return queue_url
+
+
+def seed_files(file_count: int, file_size: int, prefix: str) -> List[str]:
+    """Upload synthetic input files and their metadata, returning the file ids."""
+    import boto3
+
+    s3 = boto3.client("s3")
+    metadata_table = boto3.resource("dynamodb").Table(METADATA_TABLE)
+    words = ["analyse", "donnees", "modele", "fichier", "resultat", "contexte"]
+    file_ids = []
+    with metadata_table.batch_writer() as batch:
+        for index in range(file_count):
+            file_id = f"{prefix}-{index}"
+            # Unique content per file so the result cache never short-circuits
+            content = f"{file_id}\n" + " ".join(
+                random.choice(words) for _ in range(file_size // 8)
+            )
+            content = content[:file_size]
+            s3.put_object(Bucket=INPUT_BUCKET, Key=f"{USER_ID}/{file_id}", Body=content)
+            batch.put_item(
+                Item={
+                    "user_id": USER_ID,
+                    "file_id": file_id,
+                    "filename": f"{file_id}.txt",
+                    "size": len(content),
+                    "last_modified": int(time.time()),
+                    "s3_key": f"{USER_ID}/{file_id}",
+                }
+            )
+            file_ids.append(file_id)
+    return file_ids
+
+
+def api_event(
+    method: str,
+    path: str,
+    body: Optional[Dict[str, Any]] = None,
+    query: Optional[Dict[str, str]] = None,
+) -> Dict[str, Any]:
+    """API Gateway REST proxy event for the router."""
+    return {
+        "resource": path,
+        "path": path,
+        "httpMethod": method,
+        "headers": {"Content-Type": "application/json"},
+        "multiValueHeaders": {},
+        "queryStringParameters": query,
+        "multiValueQueryStringParameters": (
+            {name: [value] for name, value in query.items()} if query else None
+        ),
+        "pathParameters": None,
+        "stageVariables": None,
+        "requestContext": {
+            "requestId": str(uuid.uuid4()),
+            "stage": "bench",
+            "httpMethod": method,
+            "path": path,
+            "authorizer": {"claims": {"sub": USER_ID}},
+        },
+        "body": json.dumps(body) if body is not None else None,
+        "isBase64Encoded": False,
+    }
+
+
+def sqs_event(messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {
+        "Records": [
+            {
+                "messageId": message["MessageId"],
+                "receiptHandle": message["ReceiptHandle"],
+                "body": message["Body"],
+                # Always set by Lambda, moto only returns it when asked for
+                "attributes": {
+                    "ApproximateReceiveCount": "1",
+                    **message.get("Attributes", {}),
+                },
+                "messageAttributes": {},
+                "md5OfBody": message["MD5OfBody"],
+                "eventSource": "aws:sqs",
+                "eventSourceARN": f"arn:aws:sqs:us-east-1:000000000000:{QUEUE_NAME}",
+                "awsRegion": "us-east-1",
+            }
+            for message in messages
+        ]
+    }
+
+
+def invoke(handler, event: Dict[str, Any], function_name: str) -> Dict[str, Any]:
+    # Metrics are printed as EMF on stdout, keep them out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        return handler(event, LambdaContext(function_name))
+
+
+def run_router_requests(
+    router, job_id: str, file_ids: List[str], repeat: int
+) -> List[Dict[str, Any]]:
+    """Time the interactive routes against the seeded files and jobs."""
+    requests = {
+        "GET /files": api_event("GET", "/files"),
+        "GET /files?limit=50": api_event("GET", "/files", query={"limit": "50"}),
+        "POST /jobs": api_event(
+            "POST", "/jobs", body={"files": file_ids, "prompt": "Resume"}
+        ),
+        "GET /jobs": api_event("GET", "/jobs"),
+        "GET /jobs?since": api_event("GET", "/jobs", query={"since": "0"}),
+        "GET /jobs/{job_id}": api_event("GET", f"/jobs/{job_id}"),
+        "GET /jobs/{job_id}/downloads": api_event("GET", f"/jobs/{job_id}/downloads"),
+    }
+    results = []
+    for route, event in requests.items():
+        latencies = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            response = invoke(router.lambda_handler, event, "router")
+            latencies.append(time.perf_counter() - start)
+            if response["statusCode"] >= 400:
+                raise RuntimeError(f"{route} failed: {response.get('body')}")
+        results.append(
+            {
+                "route": route,
+                "files": len(file_ids),
+                "requests": repeat,
+                "p50_ms": round(percentile(latencies, 0.5) * 1000, 2),
+                "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+                "throughput_rps": round(repeat / sum(latencies), 2),
+            }
+        )
+    return results
+
+
+def run_job(
+    router,
+    worker,
+    bedrock: SimulatedBedrock,
+    queue_url: str,
+    file_ids,
+    mode: str = "separate",
+):
+    """Create a job through the router and drain the queue through the worker."""
+    import boto3
+    from aws_lambda_powertools.utilities.batch.exceptions import BatchProcessingError
+
+    sqs = boto3.client("sqs")
+    response = invoke(
+        router.lambda_handler,
+        api_event(
+            "POST",
+            "/jobs",
+            body={"files": file_ids, "prompt": "Resume", "mode": mode},
+        ),
+        "router",
+    )
+    job_id = json.loads(response["body"])["job_id"]
+
+    bedrock.reset()
+    start = time.perf_counter()
+    while True:
+        # Fan-out and continuation messages come back through the same queue
+        messages = sqs.receive_message(
+            QueueUrl=queue_url, MaxNumberOfMessages=10, AttributeNames=["All"]
+        ).get("Messages", [])
+        if not messages:
+            break
+        try:
+            response = invoke(worker.lambda_handler, sqs_event(messages), "worker")
+        except BatchProcessingError:
+            # Every record failed, the whole batch is retried
+            response = {
+                "batchItemFailures": [
+                    {"itemIdentifier": message["MessageId"]} for message in messages
+                ]
+            }
+        # Like the event source mapping: failed records become visible again
+        failed_ids = {
+            failure["itemIdentifier"]
+            for failure in (response or {}).get("batchItemFailures", [])
+        }
+        for message in messages:
+            if message["MessageId"] in failed_ids:
+                sqs.change_message_visibility(
+                    QueueUrl=queue_url,
+                    ReceiptHandle=message["ReceiptHandle"],
+                    VisibilityTimeout=0,
+                )
+            else:
+                sqs.delete_message(
+                    QueueUrl=queue_url, ReceiptHandle=message["ReceiptHandle"]
+                )
+    wall_time = time.perf_counter() - start
+
+    job = (
+        boto3.resource("dynamodb")
+        .Table(JOBS_TABLE)
+        .get_item(Key={"user_id": USER_ID, "job_id": job_id})["Item"]
+    )
+    durations = [
+        float(progress["duration"])
+        for progress in job.get("file_progress", {}).values()
+        if "duration" in progress
+    ]
+    return job_id, {
+        "job_status": job["job_status"],
+        "wall_time_s": round(wall_time, 3),
+        "throughput_files_per_s": round(len(file_ids) / wall_time, 2),
+        "file_p50_s": round(percentile(durations, 0.5), 3),
+        "file_p95_s": round(percentile(durations, 0.95), 3),
+        "bedrock_calls": bedrock.calls,
+        "bedrock_calls_per_file": round(bedrock.calls / len(file_ids), 2),
+        "throttles": bedrock.throttles,
+        "failed_files": int(job.get("failed_file_count", 0)),
+        "input_tokens": int(job.get("input_tokens", 0)),
+        "output_tokens": int(job.get("output_tokens", 0)),
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def serialize_moto_requests():
+    """Run moto requests one at a time.
+
+    moto's backends are not thread safe and concurrent updates of one item
+    fail. AWS calls are short next to simulated Bedrock calls, which still
+    overlap.
+    """
+    from moto.core.botocore_stubber import BotocoreStubber
+
+    lock = threading.RLock()
+    process_request = BotocoreStubber.process_request
+
+    def locked_process_request(self, request):
+        with lock:
+            return process_request(self, request)
+
+    BotocoreStubber.process_request = locked_process_request
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    from moto import mock_aws
+
+    configure_environment(args)
+    random.seed(args.seed)
+    # Routes that emit no metric make log_metrics warn on every request
+    warnings.filterwarnings("ignore", message="No application metrics to publish")
+    serialize_moto_requests()
+    with mock_aws():
+        queue_url = create_resources()
+        router = load_module(ROUTER_PATH, "bench_router")
+        worker = load_module(WORKER_PATH, "bench_worker")
+        bedrock = SimulatedBedrock(
+            latency=args.latency,
+            latency_jitter=args.latency_jitter,
+            output_tokens=args.output_tokens,
+            calls_per_response=args.calls_per_response,
+            throttle_rate=args.throttle_rate,
+            seed=args.seed,
+        )
+        worker.bedrock_client = lambda: bedrock
+
+        worker_results, router_results = [], []
+        for file_count in args.files:
+            for file_size in args.sizes:
+                file_ids = seed_files(
+                    file_count, file_size, prefix=f"f{file_count}x{file_size}"
+                )
+                job_id, result = run_job(
+                    router, worker, bedrock, queue_url, file_ids, args.mode
+                )
+                worker_results.append(
+                    {"files": file_count, "file_size": file_size, **result}
+                )
+                print(
+                    f"worker  files={file_count:<5} size={file_size:<8} "
+                    f"{result['throughput_files_per_s']:>8} files/s  "
+                    f"p50={result['file_p50_s']}s p95={result['file_p95_s']}s  "
+                    f"calls/file={result['bedrock_calls_per_file']}",
+                    file=sys.stderr,
+                )
+
+            results = run_router_requests(router, job_id, file_ids, args.repeat)
+            router_results.extend(results)
+            drain_queue(queue_url)
+            for result in results:
+                print(
+                    f"router  files={file_count:<5} {result['route']:<20} "
+                    f"p50={result['p50_ms']}ms p95={result['p95_ms']}ms",
+                    file=sys.stderr,
+                )
+
+    return {
+        "commit": git_commit(),
+        "created_at": int(time.time()),
+        "parameters": {
+            name: value
+            for name, value in vars(args).items()
+            if name not in ("output", "compare")
+        },
+        "worker": worker_results,
+        "router": router_results,
+    }
+
+
+def drain_queue(queue_url: str):
+    """Drop the messages queued by the timed POST /jobs requests."""
+    import boto3
+
+    sqs = boto3.client("sqs")
+    while True:
+        messages = sqs.receive_message(QueueUrl=queue_url, MaxNumberOfMessages=10).get(
+            "Messages", []
+        )
+        if not messages:
+            return
+        sqs.delete_message_batch(
+            QueueUrl=queue_url,
+            Entries=[
+                {"Id": str(index), "ReceiptHandle": message["ReceiptHandle"]}
+                for index, message in enumerate(messages)
+            ],
+        )
+
+
+def index_rows(
+    report: Dict[str, Any], section: str, key_fields: List[str]
+) -> Dict[tuple, Dict[str, Any]]:
+    return {
+        tuple(row[field] for field in key_fields): row
+        for row in report.get(section, [])
+    }
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any]):
+    """Print the relative change of every compared metric against a baseline."""
+    print(
+        f"\nChange from {baseline.get('commit') or 'baseline'} "
+        f"to {report.get('commit') or 'current'}:"
+    )
+    for section, key_fields in (
+        ("worker", ["files", "file_size"]),
+        ("router", ["route", "files"]),
+    ):
+        before = index_rows(baseline, section, key_fields)
+        for key, row in index_rows(report, section, key_fields).items():
+            if key not in before:
+                continue
+            changes = []
+            for metric, higher_is_better in COMPARED_METRICS.items():
+                if metric not in row or not before[key].get(metric):
+                    continue
+                change = (row[metric] - before[key][metric]) / before[key][metric]
+                verdict = ""
+                if abs(change) >= 0.05:
+                    better = (change > 0) == higher_is_better
+                    verdict = " (better)" if better else " (worse)"
+                changes.append(f"{metric} {change:+.1%}{verdict}")
+            print(f"  {section} {' '.join(map(str, key))}: {', '.join(changes)}")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--files",
+        type=lambda value: [int(part) for part in value.split(",")],
+        default=[1, 10, 50],
+        help="comma separated file counts per job",
+    )
+    parser.add_argument(
+        "--sizes",
+        type=lambda value: [int(part) for part in value.split(",")],
+        default=[2000, 50000],
+        help="comma separated file sizes in characters",
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="Bedrock latency in seconds"
+    )
+    parser.add_argument("--latency-jitter", type=float, default=0.01)
+    parser.add_argument(
+        "--output-tokens", type=int, default=500, help="output tokens per call"
+    )
+    parser.add_argument(
+        "--calls-per-response",
+        type=int,
+        default=2,
+        help="calls needed to complete a response (1 means no truncation)",
+    )
+    parser.add_argument(
+        "--throttle-rate",
+        type=float,
+        default=0.0,
+        help="probability that a Bedrock call is throttled",
+    )
+    parser.add_argument(
+        "--mode",
+        choices=["separate", "grouped"],
+        default="separate",
+        help="job mode: one conversation per file or grouped small files",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=20, help="requests per router route"
+    )
+    parser.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        metavar="NAME=VALUE",
+        help="environment variable for the handlers, e.g. MAX_CONCURRENT_FILES=8",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--compare", help="baseline JSON report to compare with")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    report = run(args)
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if args.compare:
+        with open(args.compare) as baseline:
+            compare(report, json.load(baseline))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""Cold start profile of the API router and inference worker Lambdas.
+
+Each handler is loaded in a fresh interpreter started with ``-X importtime``
+and then serves a first request against moto, like the first invocation of a
+new Lambda environment. The script reports the import time, the first request
+time and the slowest imports, and exits with an error when a handler exceeds
+its budget:
+
+    python benchmarks/cold_start.py
+    python benchmarks/cold_start.py --budget api_router=600 --output cold.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bench  # noqa: E402
+
+# Import plus first request, in milliseconds. The router measures about
+# 320 ms and the worker about 460 ms, the margin absorbs slower CI runners.
+# boto3 is most of the import time and is deliberately imported up front:
+# every route of both handlers calls AWS, deferring it would only move the
+# cost out of the init phase, which Lambda runs at full CPU, into the first
+# request.
+BUDGETS_MS = {
+    "api_router": 800,
+    "inference_job_handler": 800,
+}
+HANDLER_PATHS = {
+    "api_router": bench.ROUTER_PATH,
+    "inference_job_handler": bench.WORKER_PATH,
+}
+IMPORT_START_MARKER = "cold-start: import start"
+IMPORT_END_MARKER = "cold-start: import end"
+
+
+def prepare_router_request(module) -> Callable[[], None]:
+    bench.seed_files(1, 2000, prefix="cold")
+    event = bench.api_event("GET", "/files")
+
+    def request():
+        response = bench.invoke(module.lambda_handler, event, "router")
+        if response["statusCode"] >= 400:
+            raise RuntimeError(f"GET /files failed: {response.get('body')}")
+
+    return request
+
+
+def prepare_worker_request(module) -> Callable[[], None]:
+    import boto3
+
+    file_id = bench.seed_files(1, 2000, prefix="cold")[0]
+    job = {
+        "user_id": bench.USER_ID,
+        "job_id": "cold-start",
+        "prompt": "Resume",
+        "input_files": [{"file_id": file_id, "filename": f"{file_id}.txt"}],
+    }
+    job_table = boto3.resource("dynamodb").Table(bench.JOBS_TABLE)
+    job_table.put_item(Item={**job, "job_status": "PENDING", "file_count": 1})
+    sqs = boto3.client("sqs")
+    queue_url = os.environ["INFERENCE_QUEUE_URL"]
+    sqs.send_message(QueueUrl=queue_url, MessageBody=json.dumps(job))
+    event = bench.sqs_event(sqs.receive_message(QueueUrl=queue_url)["Messages"])
+
+    # The bedrock-runtime client is still built, only its calls are simulated
+    build_bedrock_client = module.bedrock_client
+    simulated = bench.SimulatedBedrock(
+        latency=0,
+        latency_jitter=0,
+        output_tokens=100,
+        calls_per_response=1,
+        throttle_rate=0,
+        seed=0,
+    )
+
+    def bedrock_client():
+        build_bedrock_client()
+        return simulated
+
+    module.bedrock_client = bedrock_client
+
+    def request():
+        bench.invoke(module.lambda_handler, event, "worker")
+        job_status = job_table.get_item(
+            Key={"user_id": bench.USER_ID, "job_id": "cold-start"}
+        )["Item"]["job_status"]
+        if job_status != "COMPLETED":
+            raise RuntimeError(f"Worker job ended with status {job_status}")
+
+    return request
+
+
+PREPARE_REQUEST = {
+    "api_router": prepare_router_request,
+    "inference_job_handler": prepare_worker_request,
+}
+
+
+def measure(handler: str) -> Dict[str, float]:
+    """Load one handler and time its first request, in this process."""
+    bench.configure_environment(bench.parse_args([]))
+    # Set by Terraform before the handler starts
+    os.environ["INFERENCE_QUEUE_URL"] = ""
+    # Set by Lambda: the X-Ray recorder then skips the centralized sampling
+    # clients it builds at import time anywhere else
+    os.environ["LAMBDA_TASK_ROOT"] = os.path.dirname(HANDLER_PATHS[handler])
+    os.environ["AWS_XRAY_CONTEXT_MISSING"] = "IGNORE_ERROR"
+
+    print(IMPORT_START_MARKER, file=sys.stderr, flush=True)
+    start = time.perf_counter()
+    module = bench.load_module(HANDLER_PATHS[handler], f"cold_{handler}")
+    import_time = time.perf_counter() - start
+    print(IMPORT_END_MARKER, file=sys.stderr, flush=True)
+
+    from moto import mock_aws
+
+    with mock_aws():
+        bench.create_resources()
+        request = PREPARE_REQUEST[handler](module)
+        start = time.perf_counter()
+        request()
+        first_request_time = time.perf_counter() - start
+
+    return {
+        "import_ms": import_time * 1000,
+        "first_request_ms": first_request_time * 1000,
+    }
+
+
+def parse_importtime(stderr: str) -> List[Dict[str, Any]]:
+    """Imports made by the handler module itself, slowest first."""
+    lines = stderr.splitlines()
+    try:
+        lines = lines[
+            lines.index(IMPORT_START_MARKER) + 1 : lines.index(IMPORT_END_MARKER)
+        ]
+    except ValueError:
+        return []
+    imports = []
+    for line in lines:
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        # Nested imports are indented under the module that triggered them
+        if name.startswith("  ") or not cumulative.strip().isdigit():
+            continue
+        imports.append(
+            {"module": name.strip(), "cumulative_ms": int(cumulative) / 1000}
+        )
+    return sorted(imports, key=lambda entry: entry["cumulative_ms"], reverse=True)
+
+
+def profile(handler: str, runs: int, top: int) -> Dict[str, Any]:
+    """Median cold start of a handler over `runs` fresh interpreters."""
+    samples, imports = [], []
+    for _ in range(runs):
+        process = subprocess.run(
+            [sys.executable, "-X", "importtime", __file__, "--measure", handler],
+            capture_output=True,
+            text=True,
+        )
+        if process.returncode:
+            raise RuntimeError(
+                f"{handler} cold start failed:\n{process.stderr[-4000:]}"
+            )
+        samples.append(json.loads(process.stdout.strip().splitlines()[-1]))
+        imports = imports or parse_importtime(process.stderr)
+
+    import_ms = statistics.median(sample["import_ms"] for sample in samples)
+    first_request_ms = statistics.median(
+        sample["first_request_ms"] for sample in samples
+    )
+    return {
+        "handler": handler,
+        "runs": runs,
+        "import_ms": round(import_ms, 1),
+        "first_request_ms": round(first_request_ms, 1),
+        "cold_start_ms": round(import_ms + first_request_ms, 1),
+        "slowest_imports": imports[:top],
+    }
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--handlers",
+        type=lambda value: value.split(","),
+        default=list(HANDLER_PATHS),
+        help="comma separated handlers to profile",
+    )
+    parser.add_argument(
+        "--runs", type=int, default=3, help="fresh interpreters per handler"
+    )
+    parser.add_argument("--top", type=int, default=10, help="slowest imports shown")
+    parser.add_argument(
+        "--budget",
+        action="append",
+        default=[],
+        metavar="HANDLER=MS",
+        help="cold start budget overriding the default one",
+    )
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--measure", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    if args.measure:
+        print(json.dumps(measure(args.measure)))
+        return
+
+    budgets = dict(BUDGETS_MS)
+    for budget in args.budget:
+        handler, _, value = budget.partition("=")
+        budgets[handler] = float(value)
+
+    report, over_budget = [], []
+    for handler in args.handlers:
+        result = profile(handler, args.runs, args.top)
+        result["budget_ms"] = budgets[handler]
+        report.append(result)
+        print(
+            f"{handler:<22} import={result['import_ms']}ms "
+            f"first request={result['first_request_ms']}ms "
+            f"total={result['cold_start_ms']}ms budget={result['budget_ms']}ms",
+            file=sys.stderr,
+        )
+        for entry in result["slowest_imports"]:
+            print(
+                f"    {entry['cumulative_ms']:>8.1f}ms  {entry['module']}",
+                file=sys.stderr,
+            )
+        if result["cold_start_ms"] > result["budget_ms"]:
+            over_budget.append(handler)
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+    if over_budget:
+        sys.exit(f"Cold start budget exceeded: {', '.join(over_budget)}")
+
+
+if __name__ == "__main__":
+    main()
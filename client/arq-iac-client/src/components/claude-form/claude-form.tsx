@@ -16,6 +16,7 @@ const ClaudeForm: React.FC = () => {
   const selectedModel = "anthropic.claude-3-sonnet-20240229-v1:0";
   const [selectedFiles, setSelectedFiles] = useState<Set<string>>(new Set());
   const [prompt, setPrompt] = useState<string>("");
+  const [groupFiles, setGroupFiles] = useState(false);
   const [isSubmitting, setIsSubmitting] = useState(false);
   const [error, setError] = useState<string>("");
   const [submissionSuccess, setSubmissionSuccess] = useState(false); // Nouvel état pour la réussite
@@ -61,7 +62,7 @@ const ClaudeForm: React.FC = () => {
     setSubmissionSuccess(false); // Réinitialise le succès avant chaque soumission
 
     try {
-      await submitForm(selectedModel, [...selectedFiles], prompt);
+      await submitForm(selectedModel, [...selectedFiles], prompt, groupFiles);
 
       handleAllFileSelection([]);
       // setPrompt("");
@@ -95,6 +96,18 @@ const ClaudeForm: React.FC = () => {
 
       <PromptInput prompt={prompt} setPrompt={setPrompt} />
 
+      <div className="pf-form-field sm:col-span-6">
+        <label className="inline-flex items-center gap-2 text-p1 text-primary-500">
+          <input
+            id="group-files"
+            type="checkbox"
+            checked={groupFiles}
+            onChange={(e) => setGroupFiles(e.target.checked)}
+          />
+          <span data-key="group-files">{t["group-files"]}</span>
+        </label>
+      </div>
+
       {isFormInvalid && (
         <div className="error-message sm:col-span-6 text-center mt-4 text-red-700">
           <span>{t["fields-required"]}</span>
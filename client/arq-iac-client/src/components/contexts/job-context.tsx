@@ -4,9 +4,10 @@ import React, {
   ReactNode,
   useContext,
   useEffect,
+  useRef,
   useState,
 } from "react";
-import { getJobs } from "../../utils/api-utils";
+import { getJobs, getJobsSince } from "../../utils/api-utils";
 import { Job } from "../../utils/interfaces";
 
 // Crée un contexte pour les jobs
@@ -16,23 +17,54 @@ interface JobContextType {
   loadJobs: (reload?: boolean) => Promise<void>;
 }
 
+const JOB_POLL_INTERVAL_MS = 5000;
+
 const JobContext = createContext<JobContextType | undefined>(undefined);
 
 interface JobProviderProps {
   children: ReactNode;
 }
 
+// Fusionne les jobs modifiés dans la liste, du plus récent au plus ancien
+const mergeJobs = (currentJobs: Job[], updatedJobs: Job[]): Job[] => {
+  const jobsById = new Map(currentJobs.map((job) => [job.job_id, job]));
+  updatedJobs.forEach((job) =>
+    jobsById.set(job.job_id, { ...jobsById.get(job.job_id), ...job })
+  );
+  return Array.from(jobsById.values()).sort(
+    (a, b) => b.updated_at - a.updated_at
+  );
+};
+
 // Provider pour envelopper l'application avec ce contexte
 export const JobProvider: React.FC<JobProviderProps> = ({ children }) => {
   const [jobs, setJobs] = useState<Job[]>([]);
   const [isLoading, setIsLoading] = useState(false);
+  // Horodatage serveur à partir duquel demander les jobs modifiés
+  const watermark = useRef<number | null>(null);
+
+  const syncJobs = async () => {
+    const delta = await getJobsSince(watermark.current ?? 0);
+    watermark.current = delta.watermark;
+    if (delta.items.length > 0) {
+      setJobs((currentJobs) => mergeJobs(currentJobs, delta.items));
+    }
+  };
 
   const loadJobs = async (reload = false) => {
     if ((jobs.length === 0 && !isLoading) || reload) {
       setIsLoading(true);
       try {
-        const jobData = await getJobs();
-        setJobs(jobData);
+        if (watermark.current === null) {
+          const jobData = await getJobs();
+          setJobs(jobData);
+          watermark.current = Math.max(
+            0,
+            ...jobData.map((job) => job.updated_at)
+          );
+        } else {
+          await syncJobs();
+        }
       } catch (error) {
         console.error("Erreur lors de la récupération des jobs", error);
       } finally {
@@ -45,6 +77,26 @@ export const JobProvider: React.FC<JobProviderProps> = ({ children }) => {
     loadJobs();
   }, [jobs]);
 
+  // Tant que des jobs sont en cours, ne récupère que les jobs modifiés
+  useEffect(() => {
+    const hasActiveJobs = jobs.some(
+      (job) => job.job_status === "PENDING" || job.job_status === "PROCESSING"
+    );
+    if (!hasActiveJobs) {
+      return;
+    }
+
+    const interval = setInterval(async () => {
+      try {
+        await syncJobs();
+      } catch (error) {
+        console.error("Erreur lors du suivi des jobs en cours", error);
+      }
+    }, JOB_POLL_INTERVAL_MS);
+
+    return () => clearInterval(interval);
+  }, [jobs]);
+
   return (
     <JobContext.Provider value={{ jobs, setJobs, loadJobs }}>
       {children}
@@ -1,6 +1,6 @@
 import React, { useEffect, useState } from "react";
 import { useLanguage } from "../../context/languages-context";
-import { getLink } from "../../utils/api-utils"; // Fonction pour obtenir l'URL presignée
+import { getJobDownloads, getJobExportUrl } from "../../utils/api-utils";
 import { languages } from "../../utils/languages";
 import { formatDate } from "../../utils/utils";
 
@@ -27,19 +27,23 @@ const JobItem: React.FC<JobItemProps> = ({ job }) => {
   const [fileLinks, setFileLinks] = useState<Record<string, string>>({});
   const [loadingLinks, setLoadingLinks] = useState<boolean>(false);
   const [isOpen, setIsOpen] = useState<boolean>(false);
+  const [exporting, setExporting] = useState<boolean>(false);
 
   useEffect(() => {
     const fetchFileLinks = async () => {
       setLoadingLinks(true);
 
       const links: Record<string, string> = {};
-      for (const file of job.input_files) {
-        try {
-          const link = await getLink(job.job_id, file.file_id);
-          links[file.file_id] = link;
-        } catch (error) {
-          console.error("Failed to fetch link for file:", file.filename);
+      try {
+        // Every link of the job in one request
+        const downloads = await getJobDownloads(job.job_id, "COMPLETED");
+        for (const file of downloads.files) {
+          if (file.download_url) {
+            links[file.file_id] = file.download_url;
+          }
         }
+      } catch (error) {
+        console.error("Failed to fetch links for job:", job.job_id);
       }
 
       setFileLinks(links);
@@ -55,6 +59,21 @@ const JobItem: React.FC<JobItemProps> = ({ job }) => {
     setIsOpen(!isOpen);
   };
 
+  const downloadArchive = async (includeInputs: boolean) => {
+    setExporting(true);
+    try {
+      window.location.href = await getJobExportUrl(job.job_id, includeInputs);
+    } catch (error) {
+      console.error("Failed to export job:", job.job_id, error);
+      alert(t["export-failed"]);
+    } finally {
+      setExporting(false);
+    }
+  };
+
+  const isFinished =
+    job.job_status === "COMPLETED" || job.job_status === "ERROR";
+
   return (
     <div className="job-accordion-item mb-4 border-b">
       <div
@@ -140,6 +159,27 @@ const JobItem: React.FC<JobItemProps> = ({ job }) => {
               ))}
             </ul>
           </div>
+
+          {isFinished && (
+            <div className="mt-4 text-sm flex gap-4">
+              <button
+                type="button"
+                disabled={exporting}
+                onClick={() => downloadArchive(false)}
+                className="text-blue-500 hover:text-blue-700 underline disabled:text-gray-400"
+              >
+                {exporting ? t["loading-span"] : t["download-all"]}
+              </button>
+              <button
+                type="button"
+                disabled={exporting}
+                onClick={() => downloadArchive(true)}
+                className="text-blue-500 hover:text-blue-700 underline disabled:text-gray-400"
+              >
+                {t["download-all-with-inputs"]}
+              </button>
+            </div>
+          )}
         </div>
       )}
     </div>
@@ -1,5 +1,10 @@
 import { fetchAuthSession } from "aws-amplify/auth";
-import { Job, ServerFile } from "./interfaces";
+import {
+  Job,
+  JobDownloads,
+  JobsDelta,
+  ServerFile,
+} from "./interfaces";
 
 let API_URL: string | undefined;
 
@@ -25,42 +30,192 @@ export function getApiUrl(): string | undefined {
   return API_URL;
 }
 
-async function readFileAsText(file: File): Promise<string> {
-  return new Promise((resolve, reject) => {
-    const reader = new FileReader();
-    reader.onload = () => resolve(reader.result as string);
-    reader.onerror = reject;
-    reader.readAsText(file, 'utf-8'); // Explicitly specify UTF-8 encoding
+interface UploadInitiation {
+  file_id: string;
+  exists: boolean;
+  file?: ServerFile;
+  upload_url?: string;
+  upload_headers?: Record<string, string>;
+  upload_id?: string;
+  part_size?: number;
+  parts?: { part_number: number; upload_url: string }[];
+}
+
+async function putToS3(
+  url: string,
+  body: Blob,
+  contentType?: string,
+  extraHeaders?: Record<string, string>
+) {
+  const response = await fetch(url, {
+    method: "PUT",
+    headers: {
+      ...(contentType ? { "Content-Type": contentType } : {}),
+      ...extraHeaders,
+    },
+    body,
   });
+  if (!response.ok) {
+    throw new Error(`S3 upload failed with status ${response.status}`);
+  }
+  return response;
+}
+
+interface FileCheck {
+  sha256: string;
+  filename: string;
+  file_id: string;
+  exists: boolean;
+  content_exists: boolean;
+  name_conflicts: string[];
+}
+
+// Files above this size are uploaded without hashing them in the browser
+const HASH_MAX_SIZE = 100 * 1024 * 1024;
+const CHECK_MAX_FILES = 100;
+
+async function sha256Hex(file: File): Promise<string | undefined> {
+  if (file.size > HASH_MAX_SIZE || !crypto.subtle) return undefined;
+  const digest = await crypto.subtle.digest("SHA-256", await file.arrayBuffer());
+  return Array.from(new Uint8Array(digest))
+    .map((byte) => byte.toString(16).padStart(2, "0"))
+    .join("");
+}
+
+// Ask the API which contents are already stored, so their bytes are not sent
+async function checkFiles(
+  files: { sha256: string; filename: string }[],
+  idToken?: string
+): Promise<FileCheck[]> {
+  const checks: FileCheck[] = [];
+  for (let i = 0; i < files.length; i += CHECK_MAX_FILES) {
+    const response = await fetch(`${import.meta.env.VITE_BASE_URL}/files/check`, {
+      method: "POST",
+      headers: {
+        Authorization: `Bearer ${idToken}`,
+        "Content-Type": "application/json",
+      },
+      body: JSON.stringify({ files: files.slice(i, i + CHECK_MAX_FILES) }),
+    });
+    if (!response.ok) {
+      throw new Error(await response.text());
+    }
+    const data: { files: FileCheck[] } = await response.json();
+    checks.push(...data.files);
+  }
+  return checks;
+}
+
+async function uploadFile(
+  file: File,
+  idToken?: string,
+  sha256?: string
+): Promise<ServerFile> {
+  const contentType = file.type || "application/octet-stream";
+  const headers = {
+    Authorization: `Bearer ${idToken}`,
+    "Content-Type": "application/json",
+  };
+
+  // Ask the API for presigned URLs, then send the bytes straight to S3
+  const initResponse = await fetch(
+    `${import.meta.env.VITE_BASE_URL}/files/uploads`,
+    {
+      method: "POST",
+      headers,
+      body: JSON.stringify({
+        filename: file.name,
+        size: file.size,
+        content_type: contentType,
+        sha256,
+      }),
+    }
+  );
+  if (!initResponse.ok) {
+    throw new Error(await initResponse.text());
+  }
+  const upload: UploadInitiation = await initResponse.json();
+  if (upload.exists && upload.file) {
+    // Same content already stored, only the file metadata was written
+    return upload.file;
+  }
+
+  let parts: { part_number: number; etag: string }[] | undefined;
+  if (upload.upload_url) {
+    // The checksum headers let S3 reject content that does not match sha256
+    await putToS3(upload.upload_url, file, contentType, upload.upload_headers);
+  } else if (upload.parts && upload.part_size) {
+    const partSize = upload.part_size;
+    parts = await Promise.all(
+      upload.parts.map(async (part) => {
+        const start = (part.part_number - 1) * partSize;
+        const response = await putToS3(
+          part.upload_url,
+          file.slice(start, start + partSize)
+        );
+        return {
+          part_number: part.part_number,
+          etag: response.headers.get("ETag") ?? "",
+        };
+      })
+    );
+  }
+
+  const completeResponse = await fetch(
+    `${import.meta.env.VITE_BASE_URL}/files/uploads/complete`,
+    {
+      method: "POST",
+      headers,
+      body: JSON.stringify({
+        file_id: upload.file_id,
+        filename: file.name,
+        upload_id: upload.upload_id,
+        parts,
+        sha256,
+      }),
+    }
+  );
+  if (!completeResponse.ok) {
+    throw new Error(await completeResponse.text());
+  }
+  return completeResponse.json();
 }
 
 export async function uploadFiles(files: File[]): Promise<void> {
   try {
     const idToken = await getToken();
-    const uploadPromises = files.map(async (file) => {
+    // One file at a time, so only one file is held in memory
+    const hashes: (string | undefined)[] = [];
+    for (const file of files) {
+      hashes.push(await sha256Hex(file));
+    }
+    const hashed = files.flatMap((file, index) => {
+      const sha256 = hashes[index];
+      return sha256 ? [{ sha256, filename: file.name }] : [];
+    });
+    // Files already stored under the same name with the same content
+    let stored = new Set<string>();
+    try {
+      const checks = await checkFiles(hashed, idToken);
+      stored = new Set(
+        checks
+          .filter((check) => check.exists)
+          .map((check) => `${check.sha256}/${check.filename}`)
+      );
+    } catch (error) {
+      // Without the check every file is uploaded
+      console.error("Erreur lors de la vérification des fichiers:", error);
+    }
+
+    const uploadPromises = files.map(async (file, index) => {
+      const sha256 = hashes[index];
+      if (sha256 && stored.has(`${sha256}/${file.name}`)) {
+        console.log(`${file.name} est déjà présent, envoi ignoré`);
+        return;
+      }
       try {
-        const fileContent = await readFileAsText(file);
-        const response = await fetch(`${import.meta.env.VITE_BASE_URL}/files`, {
-          method: "POST",
-          headers: {
-            "Content-Type": "text/plain; charset=utf-8",
-            Authorization: `Bearer ${idToken}`,
-            filename: file.name,
-          },
-          body: fileContent, // Send the text content directly
-        });
-
-        const contentType = response.headers.get("Content-Type");
-        if (contentType && contentType.includes("application/json")) {
-          const result = await response.json();
-          console.log(`Upload réussi pour ${file.name}:`, result);
-        } else {
-          const responseText = await response.text();
-          console.error(
-            `Erreur lors de l'upload de ${file.name}:`,
-            responseText
-          );
-        }
+        const result = await uploadFile(file, idToken, sha256);
+        console.log(`Upload réussi pour ${file.name}:`, result);
       } catch (error) {
         console.error(`Erreur lors de l'upload de ${file.name}:`, error);
       }
@@ -136,7 +291,8 @@ export async function deleteFiles(fileIds: string[]) {
 export const submitForm = async (
   model: string,
   selectedFiles: string[],
-  prompt: string
+  prompt: string,
+  grouped: boolean = false
 ): Promise<any> => {
   try {
     const idToken = await getToken();
@@ -144,6 +300,8 @@ export const submitForm = async (
       files: selectedFiles,
       prompt: prompt,
       model: model,
+      // Les petits fichiers partagent une même requête au modèle
+      mode: grouped ? "grouped" : "separate",
     };
     const response = await fetch(`${import.meta.env.VITE_BASE_URL}/jobs`, {
       method: "POST",
@@ -167,15 +325,43 @@ export const submitForm = async (
   }
 };
 
-export const getLink = async (
+// Presigned URLs of every result of a job, in a single request
+export async function getJobDownloads(
   jobId: string,
-  fileId: string
-): Promise<string> => {
-  try {
-    const idToken = await getToken();
-    const url = `${import.meta.env.VITE_BASE_URL
-      }/jobs/${jobId}/download/${fileId}`;
+  status?: string
+): Promise<JobDownloads> {
+  const idToken = await getToken();
+  const query = status ? `?status=${status}` : "";
+  const url = `${import.meta.env.VITE_BASE_URL}/jobs/${jobId}/downloads${query}`;
+
+  const response = await fetch(url, {
+    method: "GET",
+    headers: {
+      Authorization: `Bearer ${idToken}`,
+      "Content-Type": "application/json",
+    },
+  });
+
+  if (!response.ok) {
+    throw new Error("Network response was not ok");
+  }
+
+  return response.json();
+}
 
+// One archive with every result of a finished job, built and cached by the API.
+// The archive is built in the background: the API answers 202 until it is ready.
+const EXPORT_MAX_WAIT_MS = 10 * 60 * 1000;
+
+export async function getJobExportUrl(
+  jobId: string,
+  includeInputs: boolean
+): Promise<string> {
+  const url = `${import.meta.env.VITE_BASE_URL}/jobs/${jobId}/export?include_inputs=${includeInputs}`;
+  const deadline = Date.now() + EXPORT_MAX_WAIT_MS;
+
+  while (Date.now() < deadline) {
+    const idToken = await getToken();
     const response = await fetch(url, {
       method: "GET",
       headers: {
@@ -185,20 +371,20 @@ export const getLink = async (
     });
 
     if (!response.ok) {
-      throw new Error("Network response was not ok");
+      throw new Error(await response.text());
     }
 
-    const data = await response.json();
-    if (data && data.presigned_url) {
-      return `${data.presigned_url}`; // Retourne seulement l'URL
-    } else {
-      throw new Error("Presigned URL not found in the response");
+    const data: { status: string; download_url?: string; retry_after?: number } =
+      await response.json();
+    if (response.status === 200 && data.download_url) {
+      return data.download_url;
     }
-  } catch (error) {
-    console.error("Error fetching files:", error);
-    throw new Error("Error fetching the presigned URL");
+    await new Promise((resolve) =>
+      setTimeout(resolve, (data.retry_after ?? 2) * 1000)
+    );
   }
-};
+  throw new Error("Export is taking too long, try again later");
+}
 
 export async function getJobs(): Promise<Job[]> {
   try {
@@ -229,3 +415,22 @@ export async function getJobs(): Promise<Job[]> {
     return [];
   }
 }
+
+export async function getJobsSince(since: number): Promise<JobsDelta> {
+  const idToken = await getToken();
+  const url = `${import.meta.env.VITE_BASE_URL}/jobs?since=${since}`;
+
+  const response = await fetch(url, {
+    method: "GET",
+    headers: {
+      Authorization: `Bearer ${idToken}`,
+      "Content-Type": "application/json",
+    },
+  });
+
+  if (!response.ok) {
+    throw new Error("Network response was not ok");
+  }
+
+  return response.json();
+}
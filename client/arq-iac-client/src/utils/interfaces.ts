@@ -9,6 +9,25 @@ export interface Job {
   job_status: "PENDING" | "PROCESSING" | "COMPLETED" | "ERROR";
 }
 
+export interface JobsDelta {
+  items: Job[];
+  watermark: number;
+}
+
+export interface JobDownload {
+  file_id: string;
+  filename: string;
+  status: string;
+  download_url: string | null;
+}
+
+export interface JobDownloads {
+  job_id: string;
+  job_status: string;
+  expires_in: number;
+  files: JobDownload[];
+}
+
 export interface ServerFile {
   filename: string;
   size: number;
@@ -16,6 +16,8 @@ export const languages = {
     "upload-label": "Upload Source Code File",
     "upload-button-span": "Upload File",
     "prompt-label": "Enter your request",
+    "group-files":
+      "Group small files in a single request (faster, one answer per file)",
     "prompt-input": {
       text: "Enter your prompt here",
       "data-val-phone":
@@ -50,6 +52,9 @@ export const languages = {
     status: "Status: ",
     "created-at": "Created at: ",
     "link-not-available": "Link not available yet",
+    "download-all": "Download all results (ZIP)",
+    "download-all-with-inputs": "Download results and input files (ZIP)",
+    "export-failed": "The archive could not be created.",
     "job-search-placeholder": "Search by prompt or status",
     previous: "Previous",
     next: "Next",
@@ -85,6 +90,8 @@ export const languages = {
     "upload-label": "Ajouter des fichiers ",
     "upload-button-span": "Téléverser les fichiers",
     "prompt-label": "Saisir votre demande",
+    "group-files":
+      "Grouper les petits fichiers dans une même requête (plus rapide, une réponse par fichier)",
     "prompt-input": {
       text: "Entrez votre prompt ici",
       "data-val-phone":
@@ -123,6 +130,10 @@ export const languages = {
     status: "Statut : ",
     "created-at": "Créé le : ",
     "link-not-available": "Lien non disponible pour le moment",
+    "download-all": "Télécharger tous les résultats (ZIP)",
+    "download-all-with-inputs":
+      "Télécharger les résultats et les fichiers d'entrée (ZIP)",
+    "export-failed": "L'archive n'a pas pu être créée.",
     "job-search-placeholder": "Rechercher par prompt ou par statut",
     previous: "Précédent",
     next: "Suivant",
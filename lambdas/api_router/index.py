@@ -1,12 +1,17 @@
 ﻿import base64
+import gzip
 import os
 import simplejson as json
+import random
 import uuid
-from typing import Dict, Any, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Any, List, Optional, Tuple
+import threading
 import time
 import boto3
 from aws_lambda_powertools import Logger, Tracer, Metrics
 from aws_lambda_powertools.event_handler import APIGatewayRestResolver, Response
+from aws_lambda_powertools.metrics import MetricUnit
 from aws_lambda_powertools.utilities.typing import LambdaContext
 from aws_lambda_powertools.logging import correlation_paths
 from botocore.exceptions import ClientError
@@ -24,14 +29,87 @@ tracer = Tracer()
 metrics = Metrics()
 app = APIGatewayRestResolver()
 
-s3_client = boto3.client("s3")
-dynamodb = boto3.resource("dynamodb")
-metadata_table = dynamodb.Table(os.environ["METADATA_TABLE"])
-job_table = dynamodb.Table(os.environ["INFERENCE_JOBS_TABLE"])
-sqs_client = boto3.client("sqs")
+
+def lazy(factory: Callable[[], Any]) -> Callable[[], Any]:
+    """Build a client on its first use instead of at import time.
+
+    Creating the boto3 clients loads their service models, which is the
+    largest part of the cold start. Each route only pays for the clients it
+    uses.
+    """
+    lock = threading.Lock()
+    instance = []
+
+    def get():
+        if not instance:
+            with lock:
+                if not instance:
+                    instance.append(factory())
+        return instance[0]
+
+    return get
+
+
+@lazy
+def s3_client():
+    return boto3.client("s3")
+
+
+@lazy
+def dynamodb():
+    return boto3.resource("dynamodb")
+
+
+@lazy
+def metadata_table():
+    return dynamodb().Table(os.environ["METADATA_TABLE"])
+
+
+@lazy
+def job_table():
+    return dynamodb().Table(os.environ["INFERENCE_JOBS_TABLE"])
+
+
+@lazy
+def sqs_client():
+    return boto3.client("sqs")
+
+
 INPUT_BUCKET_NAME = os.environ["INPUT_BUCKET_NAME"]
 OUTPUT_BUCKET_NAME = os.environ["OUTPUT_BUCKET_NAME"]
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
+COMPRESSION_MIN_SIZE = 1024  # 1KB
+COMPRESSION_LEVEL = 6
+CONTENT_ID_LENGTH = 16  # hex characters of the content SHA-256 in file_id
+NAME_ID_LENGTH = 8  # hex characters of the filename SHA-256 in file_id
+METADATA_CONTENT_HASH_INDEX = "ContentHashIndex"
+METADATA_FILENAME_INDEX = "FilenameIndex"
+METADATA_LAST_MODIFIED_INDEX = "LastModifiedIndex"
+CHECK_MAX_FILES = 100
+# Objects no file uses anymore expire through a lifecycle rule on this tag
+UNREFERENCED_OBJECT_TAG = {"Key": "unreferenced", "Value": "true"}
+MAX_DIRECT_UPLOAD_SIZE = 1024 * 1024 * 1024  # 1GB
+MULTIPART_THRESHOLD = 100 * 1024 * 1024  # 100MB
+MULTIPART_PART_SIZE = 10 * 1024 * 1024  # 10MB
+UPLOAD_URL_EXPIRATION = 3600  # 1 hour in seconds
+BATCH_GET_MAX_KEYS = 100  # DynamoDB BatchGetItem limit
+BATCH_GET_MAX_ATTEMPTS = 5
+BATCH_GET_BASE_DELAY = 0.05  # seconds
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+JOBS_CREATED_AT_INDEX = "CreatedAtIndex"
+JOBS_UPDATED_AT_INDEX = "UpdatedAtIndex"
+# Overlap between delta polls, covering the index's eventual consistency
+JOBS_SYNC_LAG_SECONDS = 5
+FINISHED_JOB_STATUSES = ("COMPLETED", "ERROR")
+# "grouped" packs small files into shared Bedrock conversations
+JOB_MODES = ("separate", "grouped")
+EXPORT_PREFIX = "exports/"
+EXPORT_POLL_SECONDS = 2
+# Export requests left unanswered this long are sent again
+EXPORT_REQUEST_TIMEOUT = 1800  # 30 minutes in seconds
+EXPORT_URL_EXPIRATION = 3600  # 1 hour in seconds
+DOWNLOAD_URL_EXPIRATION = 600  # 10 minutes in seconds
 
 CORS_HEADERS = {
     "Access-Control-Allow-Origin": "*",
@@ -41,6 +119,95 @@ CORS_HEADERS = {
 }
 
 
+def encode_next_token(last_evaluated_key: Dict[str, Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(last_evaluated_key).encode()).decode()
+
+
+def decode_next_token(next_token: str, user_id: str) -> Dict[str, Any]:
+    try:
+        key = json.loads(
+            base64.urlsafe_b64decode(next_token.encode()), use_decimal=True
+        )
+    except (ValueError, TypeError):
+        raise BadRequestError("Invalid next_token")
+    if not isinstance(key, dict) or key.get("user_id") != user_id:
+        raise BadRequestError("Invalid next_token")
+    return key
+
+
+def apply_view(query_kwargs: Dict[str, Any], summary_attributes: List[str]):
+    """Project the query on summary_attributes when view=summary is requested."""
+    view = app.current_event.get_query_string_value(name="view", default_value="full")
+    if view == "summary":
+        names = {f"#a{i}": name for i, name in enumerate(summary_attributes)}
+        query_kwargs["ProjectionExpression"] = ", ".join(names)
+        query_kwargs["ExpressionAttributeNames"] = names
+    elif view != "full":
+        raise BadRequestError("view must be one of: full, summary")
+
+
+def query_all_pages(table, **query_kwargs) -> List[Dict[str, Any]]:
+    items = []
+    while True:
+        response = table.query(**query_kwargs)
+        items.extend(response["Items"])
+        if "LastEvaluatedKey" not in response:
+            return items
+        query_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def query_user_items(
+    table, user_id: str, summary_attributes: List[str], **query_kwargs
+) -> Response:
+    """Query a user's items, honoring the limit, next_token and view parameters.
+
+    Without limit or next_token every page is read and a plain list is
+    returned. Otherwise a single page is returned as {"items", "next_token"}.
+    """
+    limit = app.current_event.get_query_string_value(name="limit", default_value=None)
+    next_token = app.current_event.get_query_string_value(
+        name="next_token", default_value=None
+    )
+    query_kwargs["KeyConditionExpression"] = Key("user_id").eq(user_id)
+    apply_view(query_kwargs, summary_attributes)
+
+    if limit is None and next_token is None:
+        items = query_all_pages(table, **query_kwargs)
+        return Response(
+            status_code=200,
+            headers=CORS_HEADERS,
+            body=json.dumps(items, iterable_as_array=True),
+        )
+
+    try:
+        limit = int(limit) if limit is not None else DEFAULT_PAGE_SIZE
+    except ValueError:
+        raise BadRequestError("limit must be an integer")
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise BadRequestError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    query_kwargs["Limit"] = limit
+    if next_token:
+        query_kwargs["ExclusiveStartKey"] = decode_next_token(next_token, user_id)
+
+    response = table.query(**query_kwargs)
+    last_evaluated_key = response.get("LastEvaluatedKey")
+    return Response(
+        status_code=200,
+        headers=CORS_HEADERS,
+        body=json.dumps(
+            {
+                "items": response["Items"],
+                "next_token": (
+                    encode_next_token(last_evaluated_key)
+                    if last_evaluated_key
+                    else None
+                ),
+            },
+            iterable_as_array=True,
+        ),
+    )
+
+
 @app.get("/files")
 @tracer.capture_method
 def list_files():
@@ -49,20 +216,157 @@ def list_files():
         raise UnauthorizedError("User ID not found in claims")
 
     try:
-        response = metadata_table.query(
-            KeyConditionExpression="user_id = :uid",
-            ExpressionAttributeValues={":uid": user_id},
-        )
-        return Response(
-            status_code=200,
-            headers=CORS_HEADERS,
-            body=json.dumps(response["Items"]),
+        # Retrieve the user's files, most recently uploaded first
+        return query_user_items(
+            metadata_table(),
+            user_id,
+            summary_attributes=["file_id", "filename", "size", "last_modified"],
+            IndexName=METADATA_LAST_MODIFIED_INDEX,
+            ScanIndexForward=False,
         )
     except ClientError as e:
         logger.exception("Failed to list files")
         raise ServiceError(msg="Failed to retrieve files")
 
 
+def compress_for_storage(data: bytes) -> Tuple[bytes, Dict[str, str]]:
+    """Gzip text content when it is large enough to be worth it.
+
+    Returns the body to store and the extra put_object arguments. S3 serves
+    the object with its Content-Encoding, so browsers decompress presigned
+    downloads transparently and the worker decompresses on read.
+    """
+    if len(data) < COMPRESSION_MIN_SIZE:
+        return data, {}
+    try:
+        data.decode("utf-8")
+    except UnicodeDecodeError:
+        # Binary formats are usually compressed already
+        return data, {}
+    compressed = gzip.compress(data, compresslevel=COMPRESSION_LEVEL)
+    if len(compressed) >= len(data):
+        return data, {}
+    return compressed, {"ContentEncoding": "gzip"}
+
+
+def content_file_id(content_hash: str, filename: str) -> str:
+    """Files are identified by their content, then by their name.
+
+    An upload never replaces a file with another content, and the same
+    content uploaded under several names gives one file per name.
+    """
+    name_hash = hashlib.sha256(filename.encode()).hexdigest()
+    return content_hash[:CONTENT_ID_LENGTH] + name_hash[:NAME_ID_LENGTH]
+
+
+def unhashed_file_id() -> str:
+    # Content unknown until uploaded, the file gets a fresh identity
+    return uuid.uuid4().hex[: CONTENT_ID_LENGTH + NAME_ID_LENGTH]
+
+
+def content_object_key(user_id: str, content_hash: str) -> str:
+    """Key of a content whose hash is known, shared by the files that have it."""
+    return f"{user_id}/sha256/{content_hash}"
+
+
+def file_object_key(file: Dict[str, Any]) -> str:
+    # Files uploaded without a hash are stored under their own id
+    return file.get("object_key") or f"{file['user_id']}/{file['file_id']}"
+
+
+def content_checksum(content_hash: str) -> str:
+    """S3 reports SHA-256 checksums as the base64 of the digest."""
+    return base64.b64encode(bytes.fromhex(content_hash)).decode()
+
+
+def parse_content_hash(value: Any) -> str:
+    """Validate a hex SHA-256 digest sent by the client."""
+    if (
+        not isinstance(value, str)
+        or len(value) != 64
+        or any(char not in "0123456789abcdef" for char in value.lower())
+    ):
+        raise BadRequestError("sha256 must be a hex encoded SHA-256 digest")
+    return value.lower()
+
+
+def find_content(
+    user_id: str, content_hash: str, exclude_file_id: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """Return the user's files with this content, other than exclude_file_id."""
+    return [
+        item
+        for item in query_all_pages(
+            metadata_table(),
+            IndexName=METADATA_CONTENT_HASH_INDEX,
+            KeyConditionExpression=Key("user_id").eq(user_id)
+            & Key("content_hash").eq(content_hash),
+        )
+        if item["file_id"] != exclude_file_id
+    ]
+
+
+def find_file_ids_by_name(user_id: str, filename: str) -> List[str]:
+    return [
+        item["file_id"]
+        for item in query_all_pages(
+            metadata_table(),
+            IndexName=METADATA_FILENAME_INDEX,
+            KeyConditionExpression=Key("user_id").eq(user_id)
+            & Key("filename").eq(filename),
+        )
+    ]
+
+
+def release_object(file: Dict[str, Any]):
+    """Let the object of a removed file expire unless another file still uses it.
+
+    Queued and running jobs read their inputs by object key, so the object is
+    only tagged here and the bucket lifecycle rule deletes it after a delay.
+    """
+    key = file_object_key(file)
+    if file.get("content_hash") and any(
+        file_object_key(other) == key
+        for other in find_content(
+            file["user_id"], file["content_hash"], file["file_id"]
+        )
+    ):
+        return
+    s3_client().put_object_tagging(
+        Bucket=INPUT_BUCKET_NAME,
+        Key=key,
+        Tagging={"TagSet": [UNREFERENCED_OBJECT_TAG]},
+    )
+
+
+def record_shared_upload(
+    user_id: str, filename: str, content_type: str, content: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Upload of content the user already has: only the metadata is written."""
+    metadata = {
+        "user_id": user_id,
+        "file_id": content_file_id(content["content_hash"], filename),
+        "filename": filename,
+        "content_type": content_type,
+        "size": content["size"],
+        "content_hash": content["content_hash"],
+        "object_key": file_object_key(content),
+        "last_modified": int(time.time()),
+    }
+    if "stored_size" in content:
+        metadata["stored_size"] = content["stored_size"]
+    metadata_table().put_item(Item=metadata)
+    # The last file using the content may have been deleted meanwhile
+    s3_client().delete_object_tagging(
+        Bucket=INPUT_BUCKET_NAME, Key=metadata["object_key"]
+    )
+    metrics.add_metric(name="DeduplicatedUploads", unit=MetricUnit.Count, value=1)
+    metrics.add_metric(
+        name="DeduplicatedBytes", unit=MetricUnit.Bytes, value=int(content["size"])
+    )
+    return metadata
+
+
 @app.post("/files")
 @tracer.capture_method
 def upload_file():
@@ -71,10 +375,9 @@ def upload_file():
         raise UnauthorizedError("User ID not found in claims")
 
     if app.current_event.is_base64_encoded:
-        # Decode base64 and then decode bytes to string
-        file_content = base64.b64decode(app.current_event.body).decode("utf-8")
+        file_content = base64.b64decode(app.current_event.body)
     else:
-        file_content = app.current_event.body
+        file_content = (app.current_event.body or "").encode("utf-8")
 
     # Check file size
     if len(file_content) > MAX_FILE_SIZE:
@@ -85,33 +388,45 @@ def upload_file():
     )
     filename = app.current_event.headers.get("filename", "unnamed-file")
 
-    # Generate file_id as the hash of the filename
-    file_id = hashlib.sha256(filename.encode()).hexdigest()[0:8]
-    key = f"{user_id}/{file_id}"
+    content_hash = hashlib.sha256(file_content).hexdigest()
+    key = content_object_key(user_id, content_hash)
 
     try:
+        existing = find_content(user_id, content_hash)
+        if existing:
+            return Response(
+                status_code=200,
+                headers=CORS_HEADERS,
+                body=json.dumps(
+                    record_shared_upload(user_id, filename, content_type, existing[0])
+                ),
+            )
+
         # Upload to S3
-        s3_client.put_object(
+        body, encoding = compress_for_storage(file_content)
+        s3_client().put_object(
             Bucket=INPUT_BUCKET_NAME,
             Key=key,
-            Body=file_content,
+            Body=body,
             ContentType=content_type,
+            **encoding,
         )
 
         # Prepare metadata
         metadata = {
             "user_id": user_id,
-            "file_id": file_id,
+            "file_id": content_file_id(content_hash, filename),
             "filename": filename,
             "content_type": content_type,
             "size": len(file_content),
+            "stored_size": len(body),
+            "content_hash": content_hash,
+            "object_key": key,
             "last_modified": int(time.time()),
         }
 
-        # Upsert in DynamoDB
-        metadata_table.put_item(
-            Item=metadata,
-        )
+        # Save to DynamoDB
+        metadata_table().put_item(Item=metadata)
 
         return Response(
             status_code=200,
@@ -127,6 +442,311 @@ def upload_file():
         raise ServiceError(msg="Failed to upload file")
 
 
+@app.post("/files/uploads")
+@tracer.capture_method
+def initiate_upload():
+    """Return presigned URLs so the client can upload a file directly to S3.
+
+    Files above MULTIPART_THRESHOLD get one presigned URL per multipart part.
+    Smaller files sent with their `sha256` are stored by content: when the
+    user already has that content, nothing is uploaded and only the metadata
+    of the file is written. Otherwise the checksum is signed into the URL and
+    returned in `upload_headers`, so S3 rejects any other content.
+    """
+    user_id = app.current_event.request_context.authorizer.claims.get("sub")
+    if not user_id:
+        raise UnauthorizedError("User ID not found in claims")
+
+    body = app.current_event.json_body or {}
+    filename = body.get("filename")
+    size = body.get("size")
+    content_type = body.get("content_type") or "application/octet-stream"
+    if not filename:
+        raise BadRequestError("filename is required")
+    if not isinstance(size, int) or size < 0:
+        raise BadRequestError("size must be a positive integer")
+    if size > MAX_DIRECT_UPLOAD_SIZE:
+        raise BadRequestError(
+            f"File too large. Maximum size is {MAX_DIRECT_UPLOAD_SIZE} bytes"
+        )
+
+    content_hash = None
+    if body.get("sha256") is not None and size <= MULTIPART_THRESHOLD:
+        content_hash = parse_content_hash(body["sha256"])
+        file_id = content_file_id(content_hash, filename)
+        key = content_object_key(user_id, content_hash)
+    else:
+        file_id = unhashed_file_id()
+        key = f"{user_id}/{file_id}"
+
+    try:
+        existing = content_hash and find_content(user_id, content_hash)
+        if existing:
+            metadata = record_shared_upload(
+                user_id, filename, content_type, existing[0]
+            )
+            return Response(
+                status_code=200,
+                headers=CORS_HEADERS,
+                body=json.dumps({"file_id": file_id, "exists": True, "file": metadata}),
+            )
+
+        if size <= MULTIPART_THRESHOLD:
+            params = {
+                "Bucket": INPUT_BUCKET_NAME,
+                "Key": key,
+                "ContentType": content_type,
+            }
+            upload_headers = {}
+            if content_hash:
+                params["ChecksumAlgorithm"] = "SHA256"
+                params["ChecksumSHA256"] = content_checksum(content_hash)
+                upload_headers = {
+                    "x-amz-sdk-checksum-algorithm": "SHA256",
+                    "x-amz-checksum-sha256": params["ChecksumSHA256"],
+                }
+            upload_url = s3_client().generate_presigned_url(
+                ClientMethod="put_object",
+                Params=params,
+                ExpiresIn=UPLOAD_URL_EXPIRATION,
+            )
+            return Response(
+                status_code=200,
+                headers=CORS_HEADERS,
+                body=json.dumps(
+                    {
+                        "file_id": file_id,
+                        "exists": False,
+                        "upload_url": upload_url,
+                        "upload_headers": upload_headers,
+                    }
+                ),
+            )
+
+        upload_id = s3_client().create_multipart_upload(
+            Bucket=INPUT_BUCKET_NAME, Key=key, ContentType=content_type
+        )["UploadId"]
+        part_count = -(-size // MULTIPART_PART_SIZE)
+        parts = [
+            {
+                "part_number": part_number,
+                "upload_url": s3_client().generate_presigned_url(
+                    ClientMethod="upload_part",
+                    Params={
+                        "Bucket": INPUT_BUCKET_NAME,
+                        "Key": key,
+                        "UploadId": upload_id,
+                        "PartNumber": part_number,
+                    },
+                    ExpiresIn=UPLOAD_URL_EXPIRATION,
+                ),
+            }
+            for part_number in range(1, part_count + 1)
+        ]
+        return Response(
+            status_code=200,
+            headers=CORS_HEADERS,
+            body=json.dumps(
+                {
+                    "file_id": file_id,
+                    "exists": False,
+                    "upload_id": upload_id,
+                    "part_size": MULTIPART_PART_SIZE,
+                    "parts": parts,
+                }
+            ),
+        )
+    except ClientError as e:
+        error_code = e.response["Error"]["Code"]
+        logger.error(f"AWS error during upload initiation: {error_code}")
+        if error_code == "NoSuchBucket":
+            raise NotFoundError("Storage bucket not found")
+        raise ServiceError(msg="Failed to initiate upload")
+
+
+@app.post("/files/uploads/complete")
+@tracer.capture_method
+def complete_upload():
+    """Finalize a direct upload and record its metadata from the stored object.
+
+    The `sha256` of a hashed upload is checked against the checksum S3
+    computed, the metadata is only written when they match.
+    """
+    user_id = app.current_event.request_context.authorizer.claims.get("sub")
+    if not user_id:
+        raise UnauthorizedError("User ID not found in claims")
+
+    body = app.current_event.json_body or {}
+    file_id = body.get("file_id")
+    filename = body.get("filename")
+    if not file_id or not filename:
+        raise BadRequestError("file_id and filename are required")
+    # Same choice of key as initiate_upload, multipart uploads are not hashed
+    upload_id = body.get("upload_id")
+    content_hash = None
+    if body.get("sha256") is not None and not upload_id:
+        content_hash = parse_content_hash(body["sha256"])
+        if file_id != content_file_id(content_hash, filename):
+            raise BadRequestError("file_id does not match sha256 and filename")
+        key = content_object_key(user_id, content_hash)
+    else:
+        key = f"{user_id}/{file_id}"
+
+    try:
+        if upload_id:
+            parts = body.get("parts")
+            if not isinstance(parts, list) or not parts:
+                raise BadRequestError(
+                    "parts are required to complete a multipart upload"
+                )
+            s3_client().complete_multipart_upload(
+                Bucket=INPUT_BUCKET_NAME,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={
+                    "Parts": [
+                        {"ETag": part["etag"], "PartNumber": part["part_number"]}
+                        for part in parts
+                    ]
+                },
+            )
+
+        head = s3_client().head_object(
+            Bucket=INPUT_BUCKET_NAME, Key=key, ChecksumMode="ENABLED"
+        )
+        if content_hash and head.get("ChecksumSHA256") != content_checksum(
+            content_hash
+        ):
+            release_object(
+                {
+                    "user_id": user_id,
+                    "file_id": file_id,
+                    "content_hash": content_hash,
+                    "object_key": key,
+                }
+            )
+            metrics.add_metric(name="RejectedUploads", unit=MetricUnit.Count, value=1)
+            raise BadRequestError("Uploaded content does not match sha256")
+
+        # Prepare metadata from the object actually stored
+        metadata = {
+            "user_id": user_id,
+            "file_id": file_id,
+            "filename": filename,
+            "content_type": head.get("ContentType", "application/octet-stream"),
+            "size": head["ContentLength"],
+            "object_key": key,
+            "last_modified": int(time.time()),
+        }
+        if content_hash:
+            metadata["content_hash"] = content_hash
+
+        # Save to DynamoDB
+        metadata_table().put_item(Item=metadata)
+
+        return Response(
+            status_code=200,
+            headers=CORS_HEADERS,
+            body=json.dumps(metadata),
+        )
+    except ClientError as e:
+        error_code = e.response["Error"]["Code"]
+        logger.error(f"AWS error during upload completion: {error_code}")
+        if error_code in ("404", "NoSuchKey", "NoSuchUpload"):
+            raise NotFoundError("Uploaded file not found")
+        raise ServiceError(msg="Failed to complete upload")
+
+
+@app.post("/files/check")
+@tracer.capture_method
+def check_files():
+    """Tell the client which files it does not need to upload.
+
+    The body lists the `sha256` and `filename` of the files about to be
+    uploaded. `exists` reports the files already stored under that name with
+    that content, `content_exists` the contents the user already has under
+    any name, whose upload only writes metadata. `name_conflicts` lists the
+    files of the same name with another content, which the upload keeps.
+    """
+    user_id = app.current_event.request_context.authorizer.claims.get("sub")
+    if not user_id:
+        raise UnauthorizedError("User ID not found in claims")
+
+    files = (app.current_event.json_body or {}).get("files")
+    if not isinstance(files, list) or not files:
+        raise BadRequestError("files must be a non-empty list")
+    if len(files) > CHECK_MAX_FILES:
+        raise BadRequestError(f"At most {CHECK_MAX_FILES} files can be checked")
+    for file in files:
+        if not isinstance(file, dict):
+            raise BadRequestError("Each file must be an object with a sha256")
+        file["sha256"] = parse_content_hash(file.get("sha256"))
+
+    file_ids = [
+        (
+            content_file_id(file["sha256"], file["filename"])
+            if file.get("filename")
+            else None
+        )
+        for file in files
+    ]
+    content_hashes = list(dict.fromkeys(file["sha256"] for file in files))
+    filenames = list(
+        dict.fromkeys(file["filename"] for file in files if file.get("filename"))
+    )
+    try:
+        existing = {
+            item["file_id"]
+            for item in retrieve_files(
+                user_id, [file_id for file_id in file_ids if file_id]
+            )
+        }
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            contents = executor.map(
+                lambda content_hash: find_content(user_id, content_hash),
+                content_hashes,
+            )
+            names = executor.map(
+                lambda filename: find_file_ids_by_name(user_id, filename), filenames
+            )
+            stored = {
+                content_hash
+                for content_hash, found in zip(content_hashes, contents)
+                if found
+            }
+            named = dict(zip(filenames, names))
+    except ClientError as e:
+        logger.error(f"DynamoDB error while checking files: {e}")
+        raise ServiceError(msg="Failed to check files")
+
+    results = []
+    for file, file_id in zip(files, file_ids):
+        results.append(
+            {
+                "sha256": file["sha256"],
+                "filename": file.get("filename"),
+                "file_id": file_id,
+                "exists": file_id in existing,
+                "content_exists": file["sha256"] in stored,
+                "name_conflicts": [
+                    other
+                    for other in named.get(file.get("filename"), [])
+                    if other != file_id
+                ],
+            }
+        )
+    metrics.add_metric(
+        name="CheckedFilesExisting",
+        unit=MetricUnit.Count,
+        value=sum(result["content_exists"] for result in results),
+    )
+    return Response(
+        status_code=200,
+        headers=CORS_HEADERS,
+        body=json.dumps({"files": results}),
+    )
+
+
 @app.delete("/files/<file_id>")
 @tracer.capture_method
 def delete_file(file_id: str):
@@ -135,17 +755,19 @@ def delete_file(file_id: str):
         raise UnauthorizedError("User ID not found in claims")
 
     try:
-        # First, retrieve the metadata to get the S3 key
-        response = metadata_table.get_item(Key={"user_id": user_id, "file_id": file_id})
+        # Delete the metadata first, the object may be shared with other files
+        file = (
+            metadata_table()
+            .delete_item(
+                Key={"user_id": user_id, "file_id": file_id}, ReturnValues="ALL_OLD"
+            )
+            .get("Attributes")
+        )
 
-        if "Item" not in response:
+        if not file:
             raise NotFoundError("File not found")
 
-        # Delete from S3
-        s3_client.delete_object(Bucket=INPUT_BUCKET_NAME, Key=f"{user_id}/{file_id}")
-
-        # Delete metadata
-        metadata_table.delete_item(Key={"user_id": user_id, "file_id": file_id})
+        release_object(file)
 
         return Response(status_code=204, headers=CORS_HEADERS)
     except ClientError as e:
@@ -156,23 +778,65 @@ def delete_file(file_id: str):
         raise ServiceError(msg="Failed to delete file")
 
 
+def object_exists(bucket: str, key: str) -> bool:
+    try:
+        s3_client().head_object(Bucket=bucket, Key=key)
+        return True
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+            return False
+        raise
+
+
+def batch_get_files(user_id: str, file_ids: List[str]) -> List[Dict[str, Any]]:
+    """Fetch up to 100 metadata items, retrying unprocessed keys with backoff."""
+    request = {
+        metadata_table().name: {
+            "Keys": [{"user_id": user_id, "file_id": file_id} for file_id in file_ids]
+        }
+    }
+    items = []
+    for attempt in range(BATCH_GET_MAX_ATTEMPTS):
+        response = dynamodb().meta.client.batch_get_item(RequestItems=request)
+        items.extend(response["Responses"].get(metadata_table().name, []))
+        request = response.get("UnprocessedKeys")
+        if not request:
+            return items
+        # Exponential backoff with full jitter before retrying throttled keys
+        time.sleep(random.uniform(0, BATCH_GET_BASE_DELAY * 2**attempt))
+
+    raise ServiceError(503, "Failed to retrieve files, please try again later")
+
+
 def retrieve_files(user_id: str, file_list: List[str]) -> List[Dict[str, Any]]:
     logger.debug(f"Retrieving files: {file_list}")
-    files = []
-    for file_id in file_list:
-        try:
-            response = metadata_table.get_item(
-                Key={"user_id": user_id, "file_id": file_id}
+    # Deduplicate while keeping the requested order
+    file_ids = list(dict.fromkeys(file_list))
+    chunks = [
+        file_ids[i : i + BATCH_GET_MAX_KEYS]
+        for i in range(0, len(file_ids), BATCH_GET_MAX_KEYS)
+    ]
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, len(chunks))) as executor:
+            results = executor.map(
+                lambda chunk: batch_get_files(user_id, chunk), chunks
             )
-            if "Item" in response:
-                files.append(response["Item"])
-        except ClientError as e:
-            error_code = e.response["Error"]["Code"]
-            logger.error(f"Error retrieving file {file_id}: {error_code}")
-            if error_code == "ResourceNotFoundException":
-                continue
-            raise ServiceError(msg=f"Failed to retrieve file {file_id}")
-    return files
+            items = {item["file_id"]: item for chunk in results for item in chunk}
+    except ClientError as e:
+        error_code = e.response["Error"]["Code"]
+        logger.error(f"Error retrieving files: {error_code}")
+        if error_code == "ResourceNotFoundException":
+            raise NotFoundError("Metadata table not found")
+        raise ServiceError(msg="Failed to retrieve files")
+    return [items[file_id] for file_id in file_ids if file_id in items]
+
+
+def file_count_bucket(file_count: int) -> str:
+    """Coarse file count bucket used as a metric dimension."""
+    for upper in (1, 10, 50, 100, 500):
+        if file_count <= upper:
+            return f"<={upper}"
+    return ">500"
 
 
 @app.post("/jobs")
@@ -183,6 +847,7 @@ def create_batch_inference_job():
         raise UnauthorizedError("User ID not found in claims")
 
     job_id = str(uuid.uuid4())
+    start = time.perf_counter()
 
     # Validate request body
     if not app.current_event.body:
@@ -211,6 +876,10 @@ def create_batch_inference_job():
     if not prompt:
         raise BadRequestError("Prompt is required")
 
+    mode = body.get("mode", "separate")
+    if mode not in JOB_MODES:
+        raise BadRequestError(f"mode must be one of {', '.join(JOB_MODES)}")
+
     # Send SQS message
     try:
         message_body = {
@@ -219,9 +888,10 @@ def create_batch_inference_job():
             "job_status": "PENDING",
             "input_files": files,
             "prompt": prompt,
+            "mode": mode,
         }
 
-        sqs_client.send_message(
+        sqs_client().send_message(
             QueueUrl=os.environ["INFERENCE_QUEUE_URL"],
             MessageBody=json.dumps(message_body),
         )
@@ -237,13 +907,15 @@ def create_batch_inference_job():
     # Write job to DynamoDB
     try:
         current_time = int(time.time())
-        job_table.put_item(
+        job_table().put_item(
             Item={
                 "user_id": user_id,
                 "job_id": job_id,
                 "job_status": "PENDING",
                 "prompt": prompt,
                 "input_files": files,
+                "file_count": len(files),
+                "mode": mode,
                 "created_at": current_time,
                 "updated_at": current_time,
                 "job_error": "",
@@ -260,6 +932,16 @@ def create_batch_inference_job():
             )
         raise ServiceError(msg="Failed to create job record")
 
+    latency_ms = (time.perf_counter() - start) * 1000
+    logger.info(
+        "Job created",
+        extra={"job_id": job_id, "file_count": len(files), "latency_ms": latency_ms},
+    )
+    metrics.add_dimension(name="FileCount", value=file_count_bucket(len(files)))
+    metrics.add_metric(
+        name="CreateJobLatency", unit=MetricUnit.Milliseconds, value=latency_ms
+    )
+
     return Response(
         status_code=201,
         headers=CORS_HEADERS,
@@ -268,6 +950,7 @@ def create_batch_inference_job():
                 "job_id": job_id,
                 "status": "PENDING",
                 "prompt": prompt,
+                "mode": mode,
                 "created_at": current_time,
                 "input_files": files,
             }
@@ -275,6 +958,16 @@ def create_batch_inference_job():
     )
 
 
+JOB_SUMMARY_ATTRIBUTES = [
+    "job_id",
+    "job_status",
+    "job_error",
+    "file_count",
+    "created_at",
+    "updated_at",
+]
+
+
 @app.get("/jobs")
 @tracer.capture_method
 def list_jobs():
@@ -282,18 +975,329 @@ def list_jobs():
     if not user_id:
         raise UnauthorizedError("User ID not found in claims")
 
+    since = app.current_event.get_query_string_value(name="since", default_value=None)
+    if since is not None:
+        return list_jobs_since(user_id, since)
+
+    try:
+        # Retrieve the user's jobs, newest first
+        return query_user_items(
+            job_table(),
+            user_id,
+            summary_attributes=JOB_SUMMARY_ATTRIBUTES,
+            IndexName=JOBS_CREATED_AT_INDEX,
+            ScanIndexForward=False,
+        )
+    except ClientError as e:
+        logger.exception("Failed to list jobs")
+        raise ServiceError(msg="Failed to retrieve jobs")
+
+
+def list_jobs_since(user_id: str, since: str) -> Response:
+    """Return the jobs updated since a previous poll along with the next watermark.
+
+    The watermark lags behind the current time so that updates not yet visible
+    in the index are returned again by the next poll; clients merge the items
+    by job_id.
+    """
+    try:
+        since = int(since)
+    except ValueError:
+        raise BadRequestError("since must be an integer timestamp")
+
+    watermark = int(time.time()) - JOBS_SYNC_LAG_SECONDS
+    query_kwargs = {
+        "IndexName": JOBS_UPDATED_AT_INDEX,
+        "KeyConditionExpression": Key("user_id").eq(user_id)
+        & Key("updated_at").gte(since),
+    }
+    apply_view(query_kwargs, JOB_SUMMARY_ATTRIBUTES)
+    try:
+        items = query_all_pages(job_table(), **query_kwargs)
+    except ClientError as e:
+        logger.exception("Failed to list updated jobs")
+        raise ServiceError(msg="Failed to retrieve jobs")
+
+    metrics.add_metric(name="JobsDeltaItems", unit=MetricUnit.Count, value=len(items))
+    return Response(
+        status_code=200,
+        headers=CORS_HEADERS,
+        body=json.dumps(
+            {"items": items, "watermark": max(watermark, since)},
+            iterable_as_array=True,
+        ),
+    )
+
+
+def job_file_statuses(job: Dict[str, Any]) -> Dict[str, str]:
+    """Status of every input file of a job, derived from the job item alone."""
+    file_progress = job.get("file_progress", {})
+    failed_file_ids = {file["file_id"] for file in job.get("failed_files", [])}
+    done_file_ids = job.get("done_file_ids", set())
+    job_status = job.get("job_status")
+    statuses = {}
+    for file in job.get("input_files", []):
+        file_id = file["file_id"]
+        if file_id in file_progress:
+            statuses[file_id] = file_progress[file_id]["status"]
+        elif file_id in failed_file_ids:
+            statuses[file_id] = "ERROR"
+        elif file_id in done_file_ids or job_status == "COMPLETED":
+            # Batch inference jobs only record the failed files
+            statuses[file_id] = "COMPLETED"
+        elif job_status == "ERROR":
+            statuses[file_id] = "ERROR"
+        else:
+            statuses[file_id] = "PENDING"
+    return statuses
+
+
+@app.get("/jobs/<job_id>")
+@tracer.capture_method
+def get_job(job_id: str):
+    user_id = app.current_event.request_context.authorizer.claims.get("sub")
+    if not user_id:
+        raise UnauthorizedError("User ID not found in claims")
+
     try:
-        # Retrieve all jobs for the user
-        response = job_table.query(KeyConditionExpression=Key("user_id").eq(user_id))
+        job = (
+            job_table().get_item(Key={"user_id": user_id, "job_id": job_id}).get("Item")
+        )
+    except ClientError as e:
+        logger.exception(f"Failed to retrieve job {job_id}")
+        raise ServiceError(msg="Failed to retrieve job")
+    if not job:
+        raise NotFoundError(f"Job {job_id} not found")
+
+    # Files the worker has not reached yet have no progress entry
+    file_progress = job.get("file_progress", {})
+    statuses = job_file_statuses(job)
+    files = [
+        {
+            "file_id": file["file_id"],
+            "filename": file.get("filename"),
+            **file_progress.get(file["file_id"], {"status": statuses[file["file_id"]]}),
+        }
+        for file in job.get("input_files", [])
+    ]
+
+    started_at = job.get("started_at")
+    if started_at is None:
+        elapsed = 0
+    elif job.get("job_status") in FINISHED_JOB_STATUSES:
+        elapsed = job["updated_at"] - started_at
+    else:
+        elapsed = int(time.time()) - started_at
+
+    # simplejson renders DynamoDB Decimals as JSON numbers
+    detail = {
+        "job_id": job_id,
+        "job_status": job.get("job_status"),
+        "job_error": job.get("job_error"),
+        "execution_mode": job.get("execution_mode"),
+        "created_at": job.get("created_at"),
+        "updated_at": job.get("updated_at"),
+        "started_at": started_at,
+        "elapsed_seconds": elapsed,
+        "file_count": job.get("file_count", len(files)),
+        "completed_files": job.get("completed_files", 0),
+        "failed_file_count": job.get("failed_file_count", 0),
+        "bedrock_calls": job.get("bedrock_calls", 0),
+        "input_tokens": job.get("input_tokens", 0),
+        "output_tokens": job.get("output_tokens", 0),
+        "bedrock_latency_ms": job.get("bedrock_latency_ms", 0),
+        "input_bytes": job.get("input_bytes", 0),
+        "files": files,
+    }
+    return Response(
+        status_code=200,
+        headers=CORS_HEADERS,
+        body=json.dumps(detail, iterable_as_array=True),
+    )
+
+
+def request_job_export(user_id: str, job_id: str, variant: str, key: str, version: str):
+    """Queue the build of an export, once per job version.
+
+    A request left unanswered for EXPORT_REQUEST_TIMEOUT is sent again, in
+    case its build failed.
+    """
+    now = int(time.time())
+    try:
+        job_table().update_item(
+            Key={"user_id": user_id, "job_id": job_id},
+            UpdateExpression="SET #request = :request",
+            ConditionExpression=(
+                "attribute_not_exists(#request) OR #request.version <> :version "
+                "OR #request.requested_at < :stale"
+            ),
+            ExpressionAttributeNames={"#request": f"export_{variant}"},
+            ExpressionAttributeValues={
+                ":request": {"version": version, "requested_at": now},
+                ":version": version,
+                ":stale": now - EXPORT_REQUEST_TIMEOUT,
+            },
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            # Already being built
+            return
+        raise
+    sqs_client().send_message(
+        QueueUrl=os.environ["INFERENCE_QUEUE_URL"],
+        MessageBody=json.dumps(
+            {
+                "export": {
+                    "user_id": user_id,
+                    "job_id": job_id,
+                    "include_inputs": variant == "results-inputs",
+                    "key": key,
+                }
+            }
+        ),
+    )
+    metrics.add_metric(name="ExportRequested", unit=MetricUnit.Count, value=1)
+
+
+@app.get("/jobs/<job_id>/export")
+@tracer.capture_method
+def export_job(job_id: str):
+    """Return a single presigned URL to a ZIP archive of a job's results.
+
+    With include_inputs=true the archive also holds the input files. Archives
+    are cached in the output bucket and rebuilt when the job changes. The
+    worker builds them: until the archive of the current job version is
+    ready, the response is 202 and the client polls again.
+    """
+    user_id = app.current_event.request_context.authorizer.claims.get("sub")
+    if not user_id:
+        raise UnauthorizedError("User ID not found in claims")
+    include_inputs = (
+        app.current_event.get_query_string_value(
+            name="include_inputs", default_value="false"
+        ).lower()
+        == "true"
+    )
+
+    try:
+        job = (
+            job_table().get_item(Key={"user_id": user_id, "job_id": job_id}).get("Item")
+        )
+        if not job:
+            raise NotFoundError(f"Job {job_id} not found")
+        if job.get("job_status") not in FINISHED_JOB_STATUSES:
+            raise BadRequestError("Job is not finished yet")
+
+        variant = "results-inputs" if include_inputs else "results"
+        key = f"{EXPORT_PREFIX}{user_id}/{job_id}/{variant}.zip"
+        version = str(job.get("updated_at"))
+        try:
+            head = s3_client().head_object(Bucket=OUTPUT_BUCKET_NAME, Key=key)
+            cached = head.get("Metadata", {}).get("job-version") == version
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("404", "NoSuchKey", "NotFound"):
+                raise
+            cached = False
 
+        if not cached:
+            request_job_export(user_id, job_id, variant, key, version)
+            return Response(
+                status_code=202,
+                headers=CORS_HEADERS,
+                body=json.dumps(
+                    {"status": "PENDING", "retry_after": EXPORT_POLL_SECONDS}
+                ),
+            )
+        metrics.add_metric(name="ExportCacheHit", unit=MetricUnit.Count, value=1)
+
+        download_url = s3_client().generate_presigned_url(
+            ClientMethod="get_object",
+            Params={
+                "Bucket": OUTPUT_BUCKET_NAME,
+                "Key": key,
+                "ResponseContentDisposition": f'attachment; filename="{job_id}.zip"',
+            },
+            ExpiresIn=EXPORT_URL_EXPIRATION,
+        )
         return Response(
             status_code=200,
             headers=CORS_HEADERS,
-            body=json.dumps([item for item in response["Items"]]),
+            body=json.dumps({"status": "READY", "download_url": download_url}),
         )
     except ClientError as e:
-        logger.exception("Failed to list jobs")
-        raise ServiceError(msg="Failed to retrieve jobs")
+        logger.error(f"AWS error during job export: {e}")
+        raise ServiceError(msg="Failed to export job")
+
+
+@app.get("/jobs/<job_id>/downloads")
+@tracer.capture_method
+def get_download_urls(job_id: str):
+    """Return presigned URLs for every result of a job in one response.
+
+    The job is read once and the URLs are signed locally, without any AWS
+    call per file. Only completed files get a URL; status=COMPLETED leaves
+    the other files out of the response.
+    """
+    user_id = app.current_event.request_context.authorizer.claims.get("sub")
+    if not user_id:
+        raise UnauthorizedError("User ID not found in claims")
+    status_filter = app.current_event.get_query_string_value(
+        name="status", default_value=None
+    )
+
+    try:
+        job = (
+            job_table().get_item(Key={"user_id": user_id, "job_id": job_id}).get("Item")
+        )
+    except ClientError as e:
+        logger.exception(f"Failed to retrieve job {job_id}")
+        raise ServiceError(msg="Failed to retrieve job")
+    if not job:
+        raise NotFoundError(f"Job {job_id} not found")
+
+    statuses = job_file_statuses(job)
+    files = []
+    for file in job.get("input_files", []):
+        file_id = file["file_id"]
+        status = statuses[file_id]
+        if status_filter and status != status_filter.upper():
+            continue
+        download_url = None
+        if status == "COMPLETED":
+            download_url = s3_client().generate_presigned_url(
+                ClientMethod="get_object",
+                Params={
+                    "Bucket": OUTPUT_BUCKET_NAME,
+                    "Key": f"{user_id}/{job_id}/{file_id}_result.txt",
+                },
+                ExpiresIn=DOWNLOAD_URL_EXPIRATION,
+            )
+        files.append(
+            {
+                "file_id": file_id,
+                "filename": file.get("filename"),
+                "status": status,
+                "download_url": download_url,
+            }
+        )
+
+    metrics.add_metric(
+        name="DownloadUrlsSigned",
+        unit=MetricUnit.Count,
+        value=sum(1 for file in files if file["download_url"]),
+    )
+    return Response(
+        status_code=200,
+        headers=CORS_HEADERS,
+        body=json.dumps(
+            {
+                "job_id": job_id,
+                "job_status": job.get("job_status"),
+                "expires_in": DOWNLOAD_URL_EXPIRATION,
+                "files": files,
+            }
+        ),
+    )
 
 
 @app.get("/jobs/<job_id>/download/<file_id>")
@@ -305,7 +1309,7 @@ def get_download_url(job_id: str, file_id: str):
 
     try:
         # Retrieve the job record from DynamoDB
-        job_response = job_table.get_item(Key={"user_id": user_id, "job_id": job_id})
+        job_response = job_table().get_item(Key={"user_id": user_id, "job_id": job_id})
         if "Item" not in job_response:
             raise NotFoundError(f"Job {job_id} not found")
 
@@ -321,16 +1325,28 @@ def get_download_url(job_id: str, file_id: str):
         # Generate a presigned URL for the file
         # TODO: make sure to sync with the inference output key
         s3_key = f"{user_id}/{job_id}/{file_id}_result.txt"
-        presigned_url = s3_client.generate_presigned_url(
+        partial = False
+        if job_response["Item"].get("job_status") in (
+            "PENDING",
+            "PROCESSING",
+        ) and not object_exists(OUTPUT_BUCKET_NAME, s3_key):
+            # The worker publishes the output generated so far while streaming
+            partial_key = f"{user_id}/{job_id}/{file_id}_result.partial.txt"
+            if not object_exists(OUTPUT_BUCKET_NAME, partial_key):
+                raise NotFoundError(f"Result of file {file_id} is not ready yet")
+            s3_key = partial_key
+            partial = True
+
+        presigned_url = s3_client().generate_presigned_url(
             ClientMethod="get_object",
             Params={"Bucket": OUTPUT_BUCKET_NAME, "Key": s3_key},
-            ExpiresIn=600,
+            ExpiresIn=DOWNLOAD_URL_EXPIRATION,
         )
 
         return Response(
             status_code=200,
             headers=CORS_HEADERS,
-            body=json.dumps({"presigned_url": presigned_url}),
+            body=json.dumps({"presigned_url": presigned_url, "partial": partial}),
         )
     except ClientError as e:
         error_code = e.response["Error"]["Code"]
@@ -338,6 +1354,8 @@ def get_download_url(job_id: str, file_id: str):
         if error_code == "NoSuchKey":
             raise NotFoundError(f"File {file_id} not found")
         raise ServiceError(msg="Failed to generate download URL")
+    except NotFoundError:
+        raise
     except Exception as e:
         logger.exception(
             f"Error generating download URL for file {file_id} in job {job_id}"
@@ -348,6 +1366,7 @@ def get_download_url(job_id: str, file_id: str):
 @logger.inject_lambda_context(
     correlation_id_path=correlation_paths.API_GATEWAY_REST, log_event=True
 )
+@metrics.log_metrics
 @tracer.capture_lambda_handler
 def lambda_handler(event: Dict[str, Any], context: LambdaContext) -> Dict[str, Any]:
     try:
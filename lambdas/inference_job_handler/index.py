@@ -1,12 +1,22 @@
-﻿import json
+﻿import gzip
+import hashlib
+import json
 import os
+import random
 import re
+import tempfile
+import threading
 import time
 import traceback
+import zipfile
+import zlib
 import boto3
-from typing import List, Optional, Dict, Any
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from decimal import Decimal
+from typing import Callable, Iterable, Iterator, List, Optional, Dict, Any, Tuple
 from aws_lambda_powertools import Logger, Tracer, Metrics
-from aws_lambda_powertools.metrics import MetricUnit
+from aws_lambda_powertools.metrics import MetricUnit, single_metric
 from aws_lambda_powertools.utilities.batch import (
     BatchProcessor,
     EventType,
@@ -15,67 +25,519 @@ from aws_lambda_powertools.utilities.batch import (
 from aws_lambda_powertools.utilities.data_classes.sqs_event import SQSRecord
 from aws_lambda_powertools.utilities.typing import LambdaContext
 from botocore.config import Config
-from botocore.exceptions import ClientError
+from botocore.exceptions import ClientError, HTTPClientError
+from botocore.exceptions import ConnectionError as BotocoreConnectionError
+
+
+class ConcurrentBatchProcessor(BatchProcessor):
+    """BatchProcessor handling the records of an SQS batch concurrently.
+
+    Records only coordinate the work of their job, the files themselves are
+    bounded by the file slots shared by every record.
+    """
+
+    def process(self):
+        if len(self.records) <= 1:
+            return super().process()
+        with ThreadPoolExecutor(max_workers=len(self.records)) as executor:
+            return list(executor.map(self._process_record, self.records))
+
+
+processor = ConcurrentBatchProcessor(event_type=EventType.SQS)
+
+
+class ThreadSafeMetrics(Metrics):
+    """Metrics shared by the record, file and chunk threads.
+
+    The EMF provider adds to a shared metric set and flushes it once a metric
+    reaches 100 values, the lock keeps threads from interleaving there.
+    """
+
+    _lock = threading.Lock()
+
+    def add_metric(self, *args, **kwargs):
+        with self._lock:
+            super().add_metric(*args, **kwargs)
+
+    def flush_metrics(self, *args, **kwargs):
+        with self._lock:
+            super().flush_metrics(*args, **kwargs)
 
-processor = BatchProcessor(event_type=EventType.SQS)
 
 # Initialize Powertools
 logger = Logger()
 tracer = Tracer()
-metrics = Metrics()
+metrics = ThreadSafeMetrics()
+
+
+def lazy(factory: Callable[[], Any]) -> Callable[[], Any]:
+    """Build a client on its first use instead of at import time.
+
+    Creating the boto3 clients loads their service models, which is the
+    largest part of the cold start. The lock keeps the file workers from
+    building the same client twice.
+    """
+    lock = threading.Lock()
+    instance = []
+
+    def get():
+        if not instance:
+            with lock:
+                if not instance:
+                    instance.append(factory())
+        return instance[0]
+
+    return get
+
 
 # Get clients using utility function
-config = Config(read_timeout=1000)
-s3_client = boto3.client("s3")
-bedrock_client = boto3.client("bedrock-runtime", config=config)
-dynamodb = boto3.resource("dynamodb")
-job_table = dynamodb.Table(os.environ["INFERENCE_JOBS_TABLE"])
+if os.environ.get("RATE_LIMITER_TABLE"):
+    # Throttles are retried by the shared rate limiter, which adapts to them
+    config = Config(read_timeout=1000, retries={"max_attempts": 1})
+else:
+    config = Config(read_timeout=1000)
+
+
+@lazy
+def s3_client():
+    return boto3.client("s3")
+
+
+@lazy
+def bedrock_client():
+    return boto3.client("bedrock-runtime", config=config)
+
+
+@lazy
+def dynamodb():
+    return boto3.resource("dynamodb")
+
+
+@lazy
+def sqs_client():
+    return boto3.client("sqs")
+
+
+@lazy
+def job_table():
+    return dynamodb().Table(os.environ["INFERENCE_JOBS_TABLE"])
 
 
 # Configuration
 class Config:
     DEFAULT_MODEL = "anthropic.claude-3-sonnet-20240229-v1:0"
     DEFAULT_MAX_TOKENS = 4096
-    MAX_TOTAL_TOKENS = 27000
+    # Tokens billed over all the calls of one conversation, continuations
+    # included: about MAX_BEDROCK_CALL_AMOUNT calls on a full chunk
+    MAX_TOTAL_TOKENS = int(os.environ.get("MAX_TOTAL_TOKENS", "100000"))
     DEFAULT_TEMPERATURE = 0.4
     INSTRUCTIONS = (
         "\nGénère ta réponse entre les balises suivantes : <reponse></reponse>, "
         "n'utilise aucune balise supplémentaire.\n"
     )
     MAX_BEDROCK_CALL_AMOUNT = 6
+    # Models on which Bedrock prompt caching checkpoints are used
+    PROMPT_CACHE_MODELS = {
+        "anthropic.claude-3-5-haiku-20241022-v1:0",
+        "anthropic.claude-3-7-sonnet-20250219-v1:0",
+        "us.anthropic.claude-3-5-haiku-20241022-v1:0",
+        "us.anthropic.claude-3-7-sonnet-20250219-v1:0",
+    }
+    MAX_CONCURRENT_FILES = int(os.environ.get("MAX_CONCURRENT_FILES", "8"))
+    STREAMING_ENABLED = os.environ.get("STREAMING_ENABLED", "false").lower() == "true"
+    MULTIPART_PART_SIZE = 5 * 1024 * 1024  # S3 minimum part size
+    PARTIAL_PREVIEW_MAX_BYTES = 1024 * 1024
+    PARTIAL_FLUSH_SECONDS = 2
+    # Results at least this large are stored gzip-compressed
+    COMPRESSION_MIN_BYTES = int(os.environ.get("COMPRESSION_MIN_BYTES", "1024"))
+    COMPRESSION_LEVEL = 6
+    CHARS_PER_TOKEN = 3.5
+    CONTINUATION_TAIL_CHARS = 2000
+    CHUNK_MAX_TOKENS = int(os.environ.get("CHUNK_MAX_TOKENS", "12000"))
+    MAX_CONCURRENT_CHUNKS = int(os.environ.get("MAX_CONCURRENT_CHUNKS", "4"))
+    REDUCE_ENABLED = os.environ.get("REDUCE_ENABLED", "true").lower() == "true"
+    REDUCE_INSTRUCTIONS = (
+        "\nLe document a été traité en plusieurs parties. Fusionne les réponses "
+        "partielles fournies entre les balises <partie></partie> en une seule "
+        "réponse cohérente.\n"
+    )
+    GROUP_INSTRUCTIONS = (
+        "\nLe message contient plusieurs fichiers, chacun entre les balises "
+        '<fichier numero="N"></fichier>. Applique la demande à chaque fichier '
+        "séparément. Génère ta réponse entre les balises suivantes : "
+        "<reponse></reponse> et, à l'intérieur, la réponse de chaque fichier entre "
+        'les balises <fichier numero="N"></fichier> avec son numéro, '
+        "n'utilise aucune balise supplémentaire.\n"
+    )
+    # Grouped jobs pack files into conversations of at most this many input tokens
+    GROUP_MAX_TOKENS = int(os.environ.get("GROUP_MAX_TOKENS", "8000"))
+    GROUP_MAX_FILES = int(os.environ.get("GROUP_MAX_FILES", "20"))
+    GROUP_FILE_OVERHEAD_TOKENS = 10  # <fichier> tags around each file
+    RESULT_CACHE_ENABLED = (
+        os.environ.get("RESULT_CACHE_ENABLED", "true").lower() == "true"
+    )
+    RESULT_CACHE_PREFIX = "cache/"
+    BATCH_INFERENCE_ROLE_ARN = os.environ.get("BATCH_INFERENCE_ROLE_ARN", "")
+    # Bedrock rejects batch inference jobs of fewer records
+    BATCH_INFERENCE_SERVICE_MIN_RECORDS = 100
+    BATCH_INFERENCE_MIN_FILES = max(
+        int(os.environ.get("BATCH_INFERENCE_MIN_FILES", "100")),
+        BATCH_INFERENCE_SERVICE_MIN_RECORDS,
+    )
+    BATCH_INFERENCE_MIN_TOKENS = int(
+        os.environ.get("BATCH_INFERENCE_MIN_TOKENS", "2000000")
+    )
+    BATCH_INFERENCE_PREFIX = "batch/"
+    BATCH_INFERENCE_TERMINAL_STATUSES = (
+        "Completed",
+        "PartiallyCompleted",
+        "Failed",
+        "Stopped",
+        "Expired",
+    )
+    # Jobs with at least this many files are fanned out per file, 0 disables
+    FANOUT_MIN_FILES = int(os.environ.get("FANOUT_MIN_FILES", "0"))
+    SQS_BATCH_SIZE = 10  # SendMessageBatch limit
+    INFERENCE_QUEUE_URL = os.environ.get("INFERENCE_QUEUE_URL", "")
+    # Time kept in reserve before the Lambda timeout when starting a new file
+    TIME_BUDGET_SAFETY_SECONDS = int(
+        os.environ.get("TIME_BUDGET_SAFETY_SECONDS", "120")
+    )
+    TERMINAL_JOB_STATUSES = ("COMPLETED", "ERROR")
+    # ZIP exports of finished jobs, requested by the API
+    EXPORT_CONCURRENCY = 8
+    EXPORT_PREFETCH_MAX_SIZE = 1024 * 1024  # 1MB, larger objects are streamed
+    EXPORT_READ_CHUNK_SIZE = 256 * 1024  # 256KB
+    # Shared Bedrock rate limiting, disabled when no table is configured
+    RATE_LIMITER_TABLE = os.environ.get("RATE_LIMITER_TABLE", "")
+    RATE_LIMIT_REQUESTS_PER_MINUTE = int(
+        os.environ.get("RATE_LIMIT_REQUESTS_PER_MINUTE", "50")
+    )
+    RATE_LIMIT_TOKENS_PER_MINUTE = int(
+        os.environ.get("RATE_LIMIT_TOKENS_PER_MINUTE", "200000")
+    )
+    RATE_LIMIT_MIN_REQUESTS_PER_MINUTE = 2
+    RATE_LIMIT_INCREASE = 1  # requests per minute added after each success
+    RATE_LIMIT_DECREASE_FACTOR = 0.5  # applied to the rate after a throttle
+    RATE_LIMIT_BURST_SECONDS = 10
+    MAX_THROTTLE_RETRIES = 5
+    THROTTLE_BASE_DELAY = 1  # seconds
+    THROTTLE_MAX_DELAY = 20  # seconds
+    RETRYABLE_BEDROCK_ERRORS = (
+        "ThrottlingException",
+        "ServiceUnavailableException",
+        "ModelNotReadyException",
+    )
+    # Errors left to SQS to retry once the in-process retries are exhausted
+    TRANSIENT_ERROR_CODES = RETRYABLE_BEDROCK_ERRORS + (
+        "ModelTimeoutException",
+        "InternalServerException",
+        "ProvisionedThroughputExceededException",
+        "RequestLimitExceeded",
+        "InternalError",
+        "ServiceUnavailable",
+        "SlowDown",
+        "RequestTimeout",
+    )
+    # maxReceiveCount of the queue, failures on the last attempt are permanent
+    MAX_RECEIVE_COUNT = int(os.environ.get("MAX_RECEIVE_COUNT", "3"))
+    # Records moved there, for instance after timing out on every delivery,
+    # are consumed to mark their files failed
+    DEAD_LETTER_QUEUE_ARN = os.environ.get("DEAD_LETTER_QUEUE_ARN", "")
     INPUT_BUCKET = os.environ["INPUT_BUCKET"]
     OUTPUT_BUCKET = os.environ["OUTPUT_BUCKET"]
 
 
-@tracer.capture_method
-def extract_ai_response(messages: List[Dict[str, Any]]) -> Optional[str]:
-    """Extract AI response from the response messages."""
-    concat_output = ""
-    for message in messages:
-        if message["role"] != "assistant":
-            continue
+# Shared by the concurrent records of a batch, each file (or group of files)
+# being processed holds a slot
+file_slots = threading.BoundedSemaphore(Config.MAX_CONCURRENT_FILES)
 
-        content = message.get("content")
-        if not isinstance(content, list) or len(content) == 0:
-            logger.warning(
-                f"Invalid message format: {message} - skipping response extraction"
+
+# Each Lambda is packaged from its own directory, keep in sync with the copy in
+# terraform/modules/plan_b/src/index.py
+class ResponseTagScanner:
+    """Incremental scanner of the <reponse></reponse> tags of a model output.
+
+    The output is fed as it is generated, in chunks of any size. Only the few
+    characters that may start a tag split across two chunks are carried over
+    to the next one, so each character is scanned once however long the output.
+    """
+
+    TAG = re.compile(r"<(/?)reponse>", re.IGNORECASE)
+    CARRY_CHARS = len("</reponse>") - 1
+
+    def __init__(self):
+        self.chunks = []
+        # Content of every closed <reponse> block
+        self.responses = []
+        self._current = []
+        self._carry = ""
+        self._inside = False
+
+    @property
+    def complete(self) -> bool:
+        """Whether a closing tag has been seen."""
+        return bool(self.responses)
+
+    @property
+    def output(self) -> str:
+        """Everything fed so far, tags included."""
+        return "".join(self.chunks)
+
+    def feed(self, text: str) -> bool:
+        """Consume the next chunk of output, True once a closing tag was seen."""
+        self.chunks.append(text)
+        data = self._carry + text
+        position = 0
+        for match in self.TAG.finditer(data):
+            closing = bool(match.group(1))
+            if self._inside and closing:
+                self._current.append(data[position : match.start()])
+                self.responses.append("".join(self._current))
+                self._current = []
+                self._inside = False
+            elif self._inside:
+                # Nested opening tag, kept as content
+                continue
+            elif closing:
+                # Closing tag without an opening one
+                self.responses.append("")
+            else:
+                self._inside = True
+            position = match.end()
+
+        keep = max(position, len(data) - self.CARRY_CHARS)
+        if self._inside:
+            self._current.append(data[position:keep])
+        self._carry = data[keep:]
+        return self.complete
+
+
+def build_request(
+    system_prompt: str, messages: List[Dict[str, Any]], model_id: str
+) -> Dict[str, Any]:
+    """Build the system and messages parameters of a Converse request.
+
+    For models with prompt caching enabled, cache checkpoints are placed after
+    the system prompt and after the first user message, which are identical
+    for every file of a job and every continuation of a file.
+    """
+    if model_id not in Config.PROMPT_CACHE_MODELS:
+        return {"system": [{"text": system_prompt}], "messages": messages}
+
+    first_message = messages[0]
+    return {
+        "system": [{"text": system_prompt}, {"cachePoint": {"type": "default"}}],
+        "messages": [
+            {
+                **first_message,
+                "content": first_message["content"]
+                + [{"cachePoint": {"type": "default"}}],
+            }
+        ]
+        + messages[1:],
+    }
+
+
+def record_cache_usage(usage: Dict[str, Any]):
+    """Record the prompt cache token counts of a Bedrock call."""
+    cache_read = usage.get("cacheReadInputTokens", 0)
+    cache_write = usage.get("cacheWriteInputTokens", 0)
+    if not cache_read and not cache_write:
+        return
+    logger.info(f"Prompt cache read tokens: {cache_read}, write tokens: {cache_write}")
+    metrics.add_metric(
+        name="CacheReadInputTokens", unit=MetricUnit.Count, value=cache_read
+    )
+    metrics.add_metric(
+        name="CacheWriteInputTokens", unit=MetricUnit.Count, value=cache_write
+    )
+
+
+def to_decimal(value: float) -> Decimal:
+    # DynamoDB numbers must be Decimal, going through str keeps them round-trippable
+    return Decimal(str(value))
+
+
+class BedrockRateLimiter:
+    """Token bucket shared by every worker instance through a DynamoDB item.
+
+    The bucket paces both requests and tokens per minute. Its rate adapts with
+    AIMD: it grows by RATE_LIMIT_INCREASE after each successful call and is
+    multiplied by RATE_LIMIT_DECREASE_FACTOR after each throttle. The token
+    budget scales with the request rate.
+    """
+
+    def __init__(self, table_name: str, limiter_id: str):
+        self.table = dynamodb().Table(table_name)
+        self.key = {"limiter_id": limiter_id}
+
+    def _load(self) -> Dict[str, float]:
+        item = self.table.get_item(Key=self.key, ConsistentRead=True).get("Item")
+        if not item:
+            rate = Config.RATE_LIMIT_REQUESTS_PER_MINUTE
+            return {"rate": rate, "requests": 0, "tokens": 0, "updated_at": 0}
+        return {name: float(item[name]) for name in item if name != "limiter_id"}
+
+    def acquire(self, tokens: int) -> float:
+        """Wait until a request of the given size fits, return the time waited."""
+        waited = 0.0
+        while True:
+            state = self._load()
+            now = time.time()
+            rate = state["rate"]
+            token_rate = (
+                Config.RATE_LIMIT_TOKENS_PER_MINUTE
+                * rate
+                / Config.RATE_LIMIT_REQUESTS_PER_MINUTE
             )
-            continue
+            elapsed = now - state["updated_at"]
+            request_capacity = max(1.0, rate * Config.RATE_LIMIT_BURST_SECONDS / 60)
+            token_capacity = token_rate * Config.RATE_LIMIT_BURST_SECONDS / 60
+            needed_tokens = min(tokens, token_capacity)
+            requests = min(request_capacity, state["requests"] + elapsed * rate / 60)
+            budget = min(token_capacity, state["tokens"] + elapsed * token_rate / 60)
+
+            if requests >= 1 and budget >= needed_tokens:
+                try:
+                    # Never write the rate back, throttles may have lowered it
+                    self.table.update_item(
+                        Key=self.key,
+                        UpdateExpression=(
+                            "SET rate = if_not_exists(rate, :rate), "
+                            "requests = :requests, tokens = :tokens, updated_at = :now"
+                        ),
+                        ConditionExpression=(
+                            "attribute_not_exists(limiter_id) OR updated_at = :u"
+                        ),
+                        ExpressionAttributeValues={
+                            ":rate": to_decimal(rate),
+                            ":requests": to_decimal(requests - 1),
+                            ":tokens": to_decimal(budget - needed_tokens),
+                            ":now": to_decimal(now),
+                            ":u": to_decimal(state["updated_at"]),
+                        },
+                    )
+                    return waited
+                except ClientError as e:
+                    if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                        raise
+                    # Another instance took from the bucket first, read it again
+                    continue
 
-        text = content[0].get("text")
-        if not isinstance(text, str):
+            delay = max(
+                (1 - requests) * 60 / rate,
+                (needed_tokens - budget) * 60 / token_rate,
+                0.05,
+            ) * random.uniform(1, 1.2)
+            time.sleep(delay)
+            waited += delay
+
+    def _update_rate(self, expression: str, condition: str, values: Dict[str, Any]):
+        try:
+            self.table.update_item(
+                Key=self.key,
+                UpdateExpression=expression,
+                ConditionExpression=condition,
+                ExpressionAttributeValues=values,
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+
+    def on_success(self):
+        """Additive increase, up to the configured quota."""
+        self._update_rate(
+            "SET rate = rate + :inc",
+            "rate <= :limit",
+            {
+                ":inc": to_decimal(Config.RATE_LIMIT_INCREASE),
+                ":limit": to_decimal(
+                    Config.RATE_LIMIT_REQUESTS_PER_MINUTE - Config.RATE_LIMIT_INCREASE
+                ),
+            },
+        )
+
+    def on_throttle(self):
+        """Multiplicative decrease, down to the minimum rate."""
+        rate = self._load()["rate"]
+        decreased = max(
+            Config.RATE_LIMIT_MIN_REQUESTS_PER_MINUTE,
+            rate * Config.RATE_LIMIT_DECREASE_FACTOR,
+        )
+        # Only decrease from the rate we observed, concurrent throttles count once
+        self._update_rate(
+            "SET rate = :decreased",
+            "rate = :observed",
+            {":decreased": to_decimal(decreased), ":observed": to_decimal(rate)},
+        )
+
+
+rate_limiter = (
+    lazy(lambda: BedrockRateLimiter(Config.RATE_LIMITER_TABLE, Config.DEFAULT_MODEL))
+    if Config.RATE_LIMITER_TABLE
+    else None
+)
+
+
+def is_transient_error(error: Exception) -> bool:
+    """Whether an error may go away on a later attempt: throttling, timeouts."""
+    if isinstance(error, ClientError):
+        return error.response["Error"]["Code"] in Config.TRANSIENT_ERROR_CODES
+    return isinstance(error, (BotocoreConnectionError, HTTPClientError, TimeoutError))
+
+
+def call_with_rate_limit(call: Callable[[], Any], estimated_tokens: int) -> Any:
+    """Run a Bedrock call through the shared rate limiter.
+
+    Throttled and transiently unavailable calls are retried with jittered
+    exponential backoff, each retry taking from the bucket again.
+    """
+    if not rate_limiter:
+        return call()
+
+    for attempt in range(Config.MAX_THROTTLE_RETRIES + 1):
+        waited = rate_limiter().acquire(estimated_tokens)
+        metrics.add_metric(
+            name="RateLimiterWaitTime",
+            unit=MetricUnit.Milliseconds,
+            value=waited * 1000,
+        )
+        try:
+            result = call()
+        except ClientError as e:
+            error_code = e.response["Error"]["Code"]
+            if (
+                error_code not in Config.RETRYABLE_BEDROCK_ERRORS
+                or attempt == Config.MAX_THROTTLE_RETRIES
+            ):
+                raise
+            if error_code == "ThrottlingException":
+                metrics.add_metric(
+                    name="BedrockThrottle", unit=MetricUnit.Count, value=1
+                )
+                rate_limiter().on_throttle()
+            delay = random.uniform(
+                0,
+                min(Config.THROTTLE_MAX_DELAY, Config.THROTTLE_BASE_DELAY * 2**attempt),
+            )
             logger.warning(
-                f"Invalid message format: {message} - skipping response extraction"
+                f"Bedrock call failed with {error_code}, retrying in {delay:.1f}s"
             )
+            time.sleep(delay)
             continue
+        rate_limiter().on_success()
+        return result
 
-        concat_output += text
 
-    if not concat_output:
-        logger.warning("No response found in messages")
-        return None
-
-    return concat_output
+def estimate_request_tokens(
+    system_prompt: str, messages: List[Dict[str, Any]], max_tokens: int
+) -> int:
+    """Tokens a call counts against the quota: its input plus the output cap."""
+    text = system_prompt + "".join(
+        block.get("text", "") for message in messages for block in message["content"]
+    )
+    return estimate_tokens(text) + max_tokens
 
 
 @tracer.capture_method
@@ -90,16 +552,19 @@ def call_bedrock(
     try:
         metrics.add_metric(name="BedrockAPICall", unit=MetricUnit.Count, value=1)
 
-        response = bedrock_client.converse(
-            modelId=model_id,
-            messages=messages,
-            system=[{"text": system_prompt}],
-            inferenceConfig={"maxTokens": max_tokens, "temperature": temperature},
+        response = call_with_rate_limit(
+            lambda: bedrock_client().converse(
+                modelId=model_id,
+                inferenceConfig={"maxTokens": max_tokens, "temperature": temperature},
+                **build_request(system_prompt, messages, model_id),
+            ),
+            estimate_request_tokens(system_prompt, messages, max_tokens),
         )
 
         output_message = response["output"]["message"]
-        total_tokens = response["usage"]["totalTokens"]
-        return output_message, total_tokens
+        usage = {**response["usage"], "latencyMs": response["metrics"]["latencyMs"]}
+        record_cache_usage(usage)
+        return output_message, usage
 
     except ClientError as e:
         logger.exception(f"Error calling Bedrock: {str(e)}")
@@ -108,119 +573,1850 @@ def call_bedrock(
 
 
 @tracer.capture_method
-def process_file(
-    file_content: str, user_prompt: str, job_id: str, file_id: str, user_id: str
-) -> Dict[str, Any]:
-    """Process a single file content."""
-    system_prompt = user_prompt + Config.INSTRUCTIONS
-    messages = [
-        {"role": "user", "content": [{"text": file_content}]},
-    ]
+def call_bedrock_stream(
+    system_prompt: str,
+    messages: List[Dict[str, Any]],
+    on_text: Callable[[str], None],
+    model_id: str = Config.DEFAULT_MODEL,
+    max_tokens: int = Config.DEFAULT_MAX_TOKENS,
+    temperature: float = Config.DEFAULT_TEMPERATURE,
+    stop: Optional[Callable[[], bool]] = None,
+) -> str:
+    """Call Bedrock streaming API, forwarding every text delta to on_text.
+
+    Returns the same (message, usage) tuple as call_bedrock. Once stop returns
+    True the stream is closed, the usage Bedrock only reports at the end is
+    then estimated.
+    """
+    try:
+        metrics.add_metric(name="BedrockAPICall", unit=MetricUnit.Count, value=1)
+
+        response = call_with_rate_limit(
+            lambda: bedrock_client().converse_stream(
+                modelId=model_id,
+                inferenceConfig={"maxTokens": max_tokens, "temperature": temperature},
+                **build_request(system_prompt, messages, model_id),
+            ),
+            estimate_request_tokens(system_prompt, messages, max_tokens),
+        )
+
+        chunks = []
+        usage = {"inputTokens": 0, "outputTokens": 0, "totalTokens": 0}
+        latency_ms = 0
+        start = time.perf_counter()
+        stream = response["stream"]
+        for event in stream:
+            if "contentBlockDelta" in event:
+                text = event["contentBlockDelta"]["delta"].get("text", "")
+                if text:
+                    chunks.append(text)
+                    on_text(text)
+                if stop and stop():
+                    # The rest of the generation is not needed
+                    stream.close()
+                    input_tokens = estimate_request_tokens(system_prompt, messages, 0)
+                    output_tokens = estimate_tokens("".join(chunks))
+                    usage = {
+                        "inputTokens": input_tokens,
+                        "outputTokens": output_tokens,
+                        "totalTokens": input_tokens + output_tokens,
+                    }
+                    latency_ms = int((time.perf_counter() - start) * 1000)
+                    metrics.add_metric(
+                        name="StreamsClosedEarly", unit=MetricUnit.Count, value=1
+                    )
+                    break
+            elif "metadata" in event:
+                usage = event["metadata"]["usage"]
+                latency_ms = event["metadata"].get("metrics", {}).get("latencyMs", 0)
+
+        output_message = {"role": "assistant", "content": [{"text": "".join(chunks)}]}
+        usage = {**usage, "latencyMs": latency_ms}
+        record_cache_usage(usage)
+        return output_message, usage
+
+    except ClientError as e:
+        logger.exception(f"Error calling Bedrock: {str(e)}")
+        metrics.add_metric(name="BedrockError", unit=MetricUnit.Count, value=1)
+        raise
+
+
+class ResultStreamWriter:
+    """Write a result object incrementally through an S3 multipart upload.
+
+    Text is gzip-compressed as it arrives and buffered until a full part (S3
+    minimum is 5 MiB) is available, so memory stays bounded by the part size.
+    While the upload is in progress the beginning of the output is published
+    uncompressed to a partial object so it can be downloaded before the job
+    completes.
+    """
+
+    def __init__(self, bucket: str, key: str, partial_key: str):
+        self.bucket = bucket
+        self.key = key
+        self.partial_key = partial_key
+        self.upload_id = s3_client().create_multipart_upload(
+            Bucket=bucket,
+            Key=key,
+            ContentType="text/plain; charset=utf-8",
+            ContentEncoding="gzip",
+        )["UploadId"]
+        # wbits=31 writes a gzip container around the deflate stream
+        self.compressor = zlib.compressobj(Config.COMPRESSION_LEVEL, zlib.DEFLATED, 31)
+        self.parts = []
+        self.buffer = bytearray()
+        self.preview = bytearray()
+        self.preview_dirty = False
+        self.last_preview_flush = 0.0
+
+    def write(self, text: str):
+        data = text.encode("utf-8")
+        self.buffer.extend(self.compressor.compress(data))
+        if len(self.preview) < Config.PARTIAL_PREVIEW_MAX_BYTES:
+            remaining = Config.PARTIAL_PREVIEW_MAX_BYTES - len(self.preview)
+            # Cut on a character boundary, the preview must stay valid UTF-8
+            self.preview.extend(
+                data[:remaining].decode("utf-8", errors="ignore").encode("utf-8")
+            )
+            self.preview_dirty = True
+        if len(self.buffer) >= Config.MULTIPART_PART_SIZE:
+            self._upload_part()
+        if (
+            self.preview_dirty
+            and time.monotonic() - self.last_preview_flush
+            >= Config.PARTIAL_FLUSH_SECONDS
+        ):
+            self._flush_preview()
+
+    def _upload_part(self):
+        part_number = len(self.parts) + 1
+        response = s3_client().upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            Body=bytes(self.buffer),
+        )
+        self.parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+        self.buffer = bytearray()
+
+    def _flush_preview(self):
+        s3_client().put_object(
+            Bucket=self.bucket,
+            Key=self.partial_key,
+            Body=bytes(self.preview),
+            ContentType="text/plain; charset=utf-8",
+        )
+        self.preview_dirty = False
+        self.last_preview_flush = time.monotonic()
+
+    def close(self):
+        self.buffer.extend(self.compressor.flush())
+        if self.buffer or not self.parts:
+            self._upload_part()
+        s3_client().complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            MultipartUpload={"Parts": self.parts},
+        )
+        s3_client().delete_object(Bucket=self.bucket, Key=self.partial_key)
+
+    def abort(self):
+        s3_client().abort_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id
+        )
+        s3_client().delete_object(Bucket=self.bucket, Key=self.partial_key)
+
+
+def input_object_key(user_id: str, file: Dict[str, Any]) -> str:
+    # Files uploaded with a content hash share an object stored under object_key
+    return file.get("object_key") or f"{user_id}/{file['file_id']}"
+
+
+def read_object(bucket: str, key: str) -> bytes:
+    """Read an S3 object, decompressing it when it is stored gzip-encoded."""
+    response = s3_client().get_object(Bucket=bucket, Key=key)
+    body = response["Body"].read()
+    if response.get("ContentEncoding") == "gzip":
+        return gzip.decompress(body)
+    return body
+
+
+def put_result(key: str, text: str):
+    """Store a result in the output bucket, gzip-compressed when it is large."""
+    body = text.encode("utf-8")
+    encoding = {}
+    if len(body) >= Config.COMPRESSION_MIN_BYTES:
+        compressed = gzip.compress(body, compresslevel=Config.COMPRESSION_LEVEL)
+        if len(compressed) < len(body):
+            body = compressed
+            encoding = {"ContentEncoding": "gzip"}
+    s3_client().put_object(
+        Bucket=Config.OUTPUT_BUCKET,
+        Key=key,
+        Body=body,
+        ContentType="text/plain; charset=utf-8",
+        **encoding,
+    )
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap local token estimate, good enough to size context windows."""
+    return int(len(text) / Config.CHARS_PER_TOKEN) + 1
+
+
+def split_into_chunks(text: str, max_tokens: int) -> List[str]:
+    """Split text into windows of at most max_tokens estimated tokens.
+
+    Sections (markdown headings) and paragraphs (blank lines) are kept whole
+    whenever they fit; oversized paragraphs fall back to line then character
+    boundaries.
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return [text]
+
+    max_chars = int(max_tokens * Config.CHARS_PER_TOKEN)
+    blocks = []
+    for block in re.split(r"\n\s*\n|\n(?=#{1,6} )", text):
+        if len(block) <= max_chars:
+            blocks.append(block)
+            continue
+        for line in block.split("\n"):
+            blocks.extend(
+                line[i : i + max_chars] for i in range(0, len(line), max_chars)
+            )
+
+    chunks = []
+    current = ""
+    for block in blocks:
+        candidate = f"{current}\n\n{block}" if current else block
+        if len(candidate) > max_chars and current:
+            chunks.append(current)
+            current = block
+        else:
+            current = candidate
+    if current:
+        chunks.append(current)
+
+    return chunks
+
+
+@tracer.capture_method
+def run_conversation(
+    system_prompt: str,
+    file_content: str,
+    on_text: Optional[Callable[[str], None]] = None,
+    on_usage: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Tuple[Optional[str], bool]:
+    """Run the generate/continue loop on a single input.
+
+    Returns the output and whether its closing tag was reached, a call or
+    token budget running out first leaves the output truncated.
+
+    Continuations do not resend the conversation: the assistant turn is
+    prefilled with the last CONTINUATION_TAIL_CHARS of the output so far and
+    the model resumes from there, keeping input tokens linear in the number
+    of calls.
+
+    When on_text is given, the streaming API is used and every text delta is
+    forwarded to it as it arrives. on_usage receives the token usage of every
+    Bedrock call.
+    """
+    user_message = {"role": "user", "content": [{"text": file_content}]}
+    messages = [user_message]
+    responses = []
+    scanner = ResponseTagScanner()
     should_continue = True
     total_tokens = 0
     call_count = 0
     cumulative_tokens = 0
+    input_tokens = 0
+    output_tokens = 0
+    first_input_tokens = 0
+    # Input tokens the former strategy would have sent: the whole history
+    history_input_tokens = 0
 
     while should_continue:
         with tracer.provider.in_subsegment("bedrock_call") as subsegment:
             logger.info(f"Bedrock API call attempt {call_count + 1}")
             subsegment.put_annotation("attempt", call_count + 1)
 
-            bedrock_response, total_tokens = call_bedrock(
-                system_prompt=system_prompt,
-                messages=messages,
-                model_id=Config.DEFAULT_MODEL,
-                max_tokens=Config.DEFAULT_MAX_TOKENS,
-                temperature=Config.DEFAULT_TEMPERATURE,
-            )
+            if on_text:
+
+                def on_delta(delta: str):
+                    scanner.feed(delta)
+                    on_text(delta)
+
+                bedrock_response, usage = call_bedrock_stream(
+                    system_prompt=system_prompt,
+                    messages=messages,
+                    on_text=on_delta,
+                    model_id=Config.DEFAULT_MODEL,
+                    max_tokens=Config.DEFAULT_MAX_TOKENS,
+                    temperature=Config.DEFAULT_TEMPERATURE,
+                    stop=lambda: scanner.complete,
+                )
+            else:
+                bedrock_response, usage = call_bedrock(
+                    system_prompt=system_prompt,
+                    messages=messages,
+                    model_id=Config.DEFAULT_MODEL,
+                    max_tokens=Config.DEFAULT_MAX_TOKENS,
+                    temperature=Config.DEFAULT_TEMPERATURE,
+                )
+                scanner.feed(bedrock_response["content"][0]["text"])
+            # The former strategy resent the file, every reply and "continue"
+            if call_count == 0:
+                first_input_tokens = usage["inputTokens"]
+            history_input_tokens += first_input_tokens + output_tokens + call_count
+            total_tokens = usage["totalTokens"]
             cumulative_tokens += total_tokens
+            input_tokens += usage["inputTokens"]
+            output_tokens += usage["outputTokens"]
             call_count += 1
+            if on_usage:
+                on_usage(usage)
+            responses.append(bedrock_response)
+            # The scanner also sees a closing tag split across two calls. The
+            # next call is expected to cost about as much as the last one.
             should_continue = (
-                (total_tokens <= Config.MAX_TOTAL_TOKENS)
+                (cumulative_tokens + total_tokens <= Config.MAX_TOTAL_TOKENS)
                 and (call_count <= Config.MAX_BEDROCK_CALL_AMOUNT)
-                and (
-                    not re.search(r"</reponse>", bedrock_response["content"][0]["text"])
-                )
+                and (not scanner.complete)
             )
-            messages.append(bedrock_response)
 
             if should_continue:
-                messages.append({"role": "user", "content": [{"text": "continue"}]})
+                tail = "".join(
+                    response["content"][0]["text"] for response in responses[-2:]
+                )[-Config.CONTINUATION_TAIL_CHARS :].rstrip()
+                if not tail:
+                    # The last replies were blank, resume after the earlier output
+                    tail = scanner.output[-Config.CONTINUATION_TAIL_CHARS :].rstrip()
+                if not tail:
+                    # Converse rejects an empty assistant block
+                    logger.warning("Blank output so far, nothing to continue")
+                    should_continue = False
+                else:
+                    messages = [
+                        user_message,
+                        {"role": "assistant", "content": [{"text": tail}]},
+                    ]
 
-    extracted_response = extract_ai_response(messages)
     logger.info(
         f"Bedrock API call attempt {call_count}\nCumulative tokens: {cumulative_tokens}"
+        f"\nInput tokens: {input_tokens} (full history would have been"
+        f" ~{history_input_tokens}), output tokens: {output_tokens}"
+    )
+    metrics.add_metric(
+        name="FileInputTokens", unit=MetricUnit.Count, value=input_tokens
     )
+    metrics.add_metric(
+        name="FileOutputTokens", unit=MetricUnit.Count, value=output_tokens
+    )
+    metrics.add_metric(
+        name="ContinuationTokensSaved",
+        unit=MetricUnit.Count,
+        value=max(0, history_input_tokens - input_tokens),
+    )
+    if not scanner.output:
+        logger.warning("No response found in messages")
+        return None, False
+    return scanner.output, scanner.complete
 
-    # Store response in S3
+
+@tracer.capture_method
+def process_chunks(
+    user_prompt: str,
+    chunks: List[str],
+    on_usage: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Tuple[str, bool]:
+    """Map the prompt over every chunk in parallel, then optionally reduce.
+
+    Also returns whether every conversation the output comes from completed.
+    """
+    system_prompt = user_prompt + Config.INSTRUCTIONS
+    logger.info(f"Processing {len(chunks)} chunks")
+    metrics.add_metric(name="FileChunks", unit=MetricUnit.Count, value=len(chunks))
+
+    max_workers = max(1, min(Config.MAX_CONCURRENT_CHUNKS, len(chunks)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        conversations = list(
+            executor.map(
+                lambda chunk: run_conversation(system_prompt, chunk, on_usage=on_usage),
+                chunks,
+            )
+        )
+    outputs = [output or "" for output, _ in conversations]
+    complete = all(chunk_complete for _, chunk_complete in conversations)
+
+    if not Config.REDUCE_ENABLED:
+        return "\n\n".join(outputs), complete
+
+    reduce_input = "\n".join(
+        f'<partie numero="{index + 1}">\n{output}\n</partie>'
+        for index, output in enumerate(outputs)
+    )
+    if estimate_tokens(reduce_input) > Config.CHUNK_MAX_TOKENS:
+        logger.warning("Partial outputs too large for a reduce pass, concatenating")
+        return "\n\n".join(outputs), complete
+
+    output, reduce_complete = run_conversation(
+        user_prompt + Config.REDUCE_INSTRUCTIONS + Config.INSTRUCTIONS,
+        reduce_input,
+        on_usage=on_usage,
+    )
+    return output, complete and reduce_complete
+
+
+def result_cache_key(file_content: str, user_prompt: str) -> str:
+    """Content-addressed cache key for the result of a file/prompt pair."""
+    digest = hashlib.sha256()
+    for part in (
+        file_content,
+        user_prompt + Config.INSTRUCTIONS,
+        Config.DEFAULT_MODEL,
+        str(Config.DEFAULT_TEMPERATURE),
+        str(Config.DEFAULT_MAX_TOKENS),
+        str(Config.CHUNK_MAX_TOKENS),
+        str(Config.REDUCE_ENABLED),
+    ):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return f"{Config.RESULT_CACHE_PREFIX}{digest.hexdigest()}.txt"
+
+
+def copy_cached_result(cache_key: str, result_key: str) -> bool:
+    """Copy a cached result server-side, returning False on a cache miss."""
+    try:
+        s3_client().copy_object(
+            Bucket=Config.OUTPUT_BUCKET,
+            Key=result_key,
+            CopySource={"Bucket": Config.OUTPUT_BUCKET, "Key": cache_key},
+        )
+        return True
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+            return False
+        raise
+
+
+@tracer.capture_method
+def process_file(
+    file_content: str,
+    user_prompt: str,
+    job_id: str,
+    file_id: str,
+    user_id: str,
+    on_usage: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Dict[str, Any]:
+    """Process a single file content."""
     result_key = f"{user_id}/{job_id}/{file_id}_result.txt"
-    s3_client.put_object(
-        Bucket=Config.OUTPUT_BUCKET,
-        Key=result_key,
-        Body=(extracted_response).encode("utf-8"),
+
+    cache_key = None
+    if Config.RESULT_CACHE_ENABLED:
+        cache_key = result_cache_key(file_content, user_prompt)
+        if copy_cached_result(cache_key, result_key):
+            logger.info(f"Result cache hit for file {file_id}: {cache_key}")
+            metrics.add_metric(name="ResultCacheHit", unit=MetricUnit.Count, value=1)
+            return
+        metrics.add_metric(name="ResultCacheMiss", unit=MetricUnit.Count, value=1)
+
+    complete = generate_result(
+        file_content, user_prompt, job_id, file_id, user_id, result_key, on_usage
     )
 
+    # A truncated result would be served again to every later job
+    if cache_key and complete:
+        s3_client().copy_object(
+            Bucket=Config.OUTPUT_BUCKET,
+            Key=cache_key,
+            CopySource={"Bucket": Config.OUTPUT_BUCKET, "Key": result_key},
+        )
+
 
 @tracer.capture_method
-def record_handler(record: SQSRecord):
-    payload = record.json_body
-    job_id = payload.get("job_id")
-    user_id = payload.get("user_id")
-    job_table.update_item(
+def generate_result(
+    file_content: str,
+    user_prompt: str,
+    job_id: str,
+    file_id: str,
+    user_id: str,
+    result_key: str,
+    on_usage: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> bool:
+    """Run inference on a file and write the result object.
+
+    Returns whether the result is complete, i.e. its closing tag was reached.
+    """
+    chunks = split_into_chunks(file_content, Config.CHUNK_MAX_TOKENS)
+    if len(chunks) > 1:
+        extracted_response, complete = process_chunks(user_prompt, chunks, on_usage)
+    elif Config.STREAMING_ENABLED:
+        writer = ResultStreamWriter(
+            bucket=Config.OUTPUT_BUCKET,
+            key=result_key,
+            partial_key=f"{user_id}/{job_id}/{file_id}_result.partial.txt",
+        )
+        try:
+            _, complete = run_conversation(
+                user_prompt + Config.INSTRUCTIONS,
+                file_content,
+                on_text=writer.write,
+                on_usage=on_usage,
+            )
+        except Exception:
+            writer.abort()
+            raise
+        # The output has already been uploaded as it was generated
+        writer.close()
+        return complete
+    else:
+        extracted_response, complete = run_conversation(
+            user_prompt + Config.INSTRUCTIONS, file_content, on_usage=on_usage
+        )
+
+    # Store response in S3
+    put_result(result_key, extracted_response)
+    return complete
+
+
+def file_count_bucket(file_count: int) -> str:
+    """Coarse file count bucket used as a metric dimension."""
+    for upper in (1, 10, 50, 100, 500):
+        if file_count <= upper:
+            return f"<={upper}"
+    return ">500"
+
+
+def add_dimensioned_metric(
+    name: str, unit: MetricUnit, value: float, dimensions: Dict[str, str]
+):
+    """Emit a metric with its own dimensions.
+
+    The worker can handle several jobs per invocation, so these dimensions
+    cannot be set on the shared metrics object.
+    """
+    with single_metric(name=name, unit=unit, value=value) as metric:
+        for dimension, dimension_value in dimensions.items():
+            metric.add_dimension(name=dimension, value=dimension_value)
+
+
+class FileProgress:
+    """Per-file progress kept in the file_progress map of the job item.
+
+    Every Bedrock call also adds its usage to the job totals and emits token
+    and latency metrics by model and job size. Progress is best effort: a
+    failed write is logged and never fails the file.
+    """
+
+    def __init__(self, user_id: str, job_id: str, file_id: str, job_file_count: int):
+        self.key = {"user_id": user_id, "job_id": job_id}
+        self.file_id = file_id
+        self.start = time.time()
+        self.calls = 0
+        self.file_size = 0
+        self.lock = threading.Lock()
+        self.dimensions = {
+            "Model": Config.DEFAULT_MODEL,
+            "JobSize": file_count_bucket(job_file_count),
+        }
+
+    def _update(
+        self,
+        expression: str,
+        values: Dict[str, Any],
+        names: Optional[Dict[str, str]] = None,
+    ):
+        try:
+            job_table().update_item(
+                Key=self.key,
+                UpdateExpression=expression,
+                ExpressionAttributeNames={"#f": self.file_id, **(names or {})},
+                ExpressionAttributeValues=values,
+            )
+        except ClientError as e:
+            logger.warning(f"Failed to record progress of file {self.file_id}: {e}")
+
+    def started(self):
+        self._update(
+            "SET file_progress.#f = :p",
+            {
+                ":p": {
+                    "status": "PROCESSING",
+                    "calls": 0,
+                    "input_tokens": 0,
+                    "output_tokens": 0,
+                    "started_at": int(self.start),
+                }
+            },
+        )
+
+    def add_usage(self, usage: Dict[str, Any]):
+        # Chunks of a file call Bedrock from several threads
+        with self.lock:
+            self.calls += 1
+        for name, unit, value in (
+            ("InputTokens", MetricUnit.Count, usage["inputTokens"]),
+            ("OutputTokens", MetricUnit.Count, usage["outputTokens"]),
+            ("BedrockLatency", MetricUnit.Milliseconds, usage["latencyMs"]),
+        ):
+            add_dimensioned_metric(name, unit, value, self.dimensions)
+
+        self._update(
+            "SET file_progress.#f.calls = file_progress.#f.calls + :one, "
+            "file_progress.#f.input_tokens = file_progress.#f.input_tokens + :in, "
+            "file_progress.#f.output_tokens = file_progress.#f.output_tokens + :out "
+            "ADD bedrock_calls :one, input_tokens :in, output_tokens :out, "
+            "bedrock_latency_ms :latency",
+            {
+                ":one": 1,
+                ":in": usage["inputTokens"],
+                ":out": usage["outputTokens"],
+                ":latency": usage["latencyMs"],
+            },
+        )
+
+    def finished(self, status: str, error: Optional[str] = None):
+        add_dimensioned_metric(
+            "BedrockCallsPerFile", MetricUnit.Count, self.calls, self.dimensions
+        )
+        add_dimensioned_metric(
+            "FileSize", MetricUnit.Bytes, self.file_size, self.dimensions
+        )
+        self._update(
+            "SET file_progress.#f.#s = :s, file_progress.#f.#e = :e, "
+            "file_progress.#f.#d = :d ADD input_bytes :b",
+            {
+                ":s": status,
+                ":e": error,
+                ":d": to_decimal(round(time.time() - self.start, 3)),
+                ":b": self.file_size,
+            },
+            {"#s": "status", "#e": "error", "#d": "duration"},
+        )
+
+
+@tracer.capture_method
+def process_input_file(
+    user_id: str,
+    job_id: str,
+    file: Dict[str, Any],
+    prompt: str,
+    job_file_count: int,
+    retry_transient: bool = False,
+) -> Dict[str, Any]:
+    """Download, process and upload a single file of a job.
+
+    Errors are caught and returned in the result so that one bad file does not
+    fail the whole job. With retry_transient, transient errors are raised
+    instead so that the SQS message is delivered again.
+    """
+    start = time.perf_counter()
+    file_id = file["file_id"]
+    progress = FileProgress(user_id, job_id, file_id, job_file_count)
+    try:
+        if result_exists(f"{user_id}/{job_id}/{file_id}_result.txt"):
+            # Finished by a previous delivery of the same message
+            logger.info(f"Result of file {file_id} already exists, skipping")
+            metrics.add_metric(name="SkippedFiles", unit=MetricUnit.Count, value=1)
+            return {"file_id": file_id, "status": "COMPLETED", "duration": 0.0}
+
+        progress.started()
+        body = read_object(Config.INPUT_BUCKET, input_object_key(user_id, file))
+        progress.file_size = len(body)
+        file_content = body.decode("utf-8")
+        process_file(
+            file_content=file_content,
+            user_prompt=prompt,
+            job_id=job_id,
+            file_id=file_id,
+            user_id=user_id,
+            on_usage=progress.add_usage,
+        )
+        progress.finished("COMPLETED")
+        return {
+            "file_id": file_id,
+            "status": "COMPLETED",
+            "duration": time.perf_counter() - start,
+        }
+    except Exception as e:
+        if retry_transient and is_transient_error(e):
+            logger.warning(f"Transient error on file {file_id} of job {job_id}: {e}")
+            raise
+        logger.error(
+            f"Error processing file {file_id} of job {job_id}: {str(e)}, stack trace: {traceback.format_exc()}"
+        )
+        progress.finished("ERROR", str(e))
+        return {
+            "file_id": file_id,
+            "status": "ERROR",
+            "error": str(e),
+            "duration": time.perf_counter() - start,
+        }
+
+
+def result_exists(key: str) -> bool:
+    try:
+        s3_client().head_object(Bucket=Config.OUTPUT_BUCKET, Key=key)
+        return True
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+            return False
+        raise
+
+
+def estimate_file_tokens(file: Dict[str, Any]) -> int:
+    """Token estimate of an input file from its size in the job message."""
+    return (
+        int(int(file.get("size", 0)) / Config.CHARS_PER_TOKEN)
+        + Config.GROUP_FILE_OVERHEAD_TOKENS
+    )
+
+
+def pack_file_groups(files: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """Pack the files of a grouped job into conversations of GROUP_MAX_TOKENS.
+
+    First-fit decreasing: the largest files are placed first, each in the first
+    group with room left. A file larger than the budget gets a group of its own
+    and is processed like in a regular job. Groups keep the order of the job.
+    """
+    groups = []
+    for file in sorted(files, key=estimate_file_tokens, reverse=True):
+        tokens = estimate_file_tokens(file)
+        for group in groups:
+            if (
+                group["tokens"] + tokens <= Config.GROUP_MAX_TOKENS
+                and len(group["files"]) < Config.GROUP_MAX_FILES
+            ):
+                group["tokens"] += tokens
+                group["files"].append(file)
+                break
+        else:
+            groups.append({"tokens": tokens, "files": [file]})
+
+    order = {file["file_id"]: index for index, file in enumerate(files)}
+    return sorted(
+        (
+            sorted(group["files"], key=lambda file: order[file["file_id"]])
+            for group in groups
+        ),
+        key=lambda group: order[group[0]["file_id"]],
+    )
+
+
+def split_group_response(response: str) -> Dict[int, str]:
+    """Per-file answers of a grouped conversation, by file number."""
+    outputs = {}
+    for match in re.finditer(
+        r'<fichier numero="(\d+)">(.*?)</fichier>', response, re.DOTALL
+    ):
+        outputs.setdefault(int(match.group(1)), match.group(2).strip())
+    return outputs
+
+
+@tracer.capture_method
+def process_file_group(
+    user_id: str,
+    job_id: str,
+    files: List[Dict[str, Any]],
+    prompt: str,
+    job_file_count: int,
+    retry_transient: bool = False,
+) -> List[Dict[str, Any]]:
+    """Process several small files of a grouped job in a single conversation.
+
+    Each file is sent between numbered <fichier> tags and its answer is split
+    back into its own result object. The Bedrock usage of the conversation is
+    recorded on the first file of the group. Files missing from the answer, for
+    instance when it was cut short, are then processed on their own.
+    """
+    if len(files) == 1:
+        return [
+            process_input_file(
+                user_id,
+                job_id,
+                files[0],
+                prompt,
+                job_file_count,
+                retry_transient,
+            )
+        ]
+
+    start = time.perf_counter()
+    results = []
+    contents = {}
+    progresses = {}
+
+    def failed(file_id: str, error: Exception):
+        if retry_transient and is_transient_error(error):
+            logger.warning(
+                f"Transient error on file {file_id} of job {job_id}: {error}"
+            )
+            raise error
+        logger.error(
+            f"Error processing file {file_id} of job {job_id}: {str(error)}, stack trace: {traceback.format_exc()}"
+        )
+        progresses[file_id].finished("ERROR", str(error))
+        results.append(
+            {
+                "file_id": file_id,
+                "status": "ERROR",
+                "error": str(error),
+                "duration": time.perf_counter() - start,
+            }
+        )
+
+    for file in files:
+        file_id = file["file_id"]
+        if result_exists(f"{user_id}/{job_id}/{file_id}_result.txt"):
+            # Finished by a previous delivery of the same message
+            logger.info(f"Result of file {file_id} already exists, skipping")
+            metrics.add_metric(name="SkippedFiles", unit=MetricUnit.Count, value=1)
+            results.append({"file_id": file_id, "status": "COMPLETED", "duration": 0.0})
+            continue
+        progresses[file_id] = FileProgress(user_id, job_id, file_id, job_file_count)
+        try:
+            progresses[file_id].started()
+            body = read_object(Config.INPUT_BUCKET, input_object_key(user_id, file))
+            progresses[file_id].file_size = len(body)
+            contents[file_id] = body.decode("utf-8")
+        except Exception as e:
+            failed(file_id, e)
+
+    if not contents:
+        return results
+
+    file_ids = list(contents)
+    group_input = "\n".join(
+        f'<fichier numero="{number}">\n{contents[file_id]}\n</fichier>'
+        for number, file_id in enumerate(file_ids, start=1)
+    )
+    try:
+        response, _ = run_conversation(
+            prompt + Config.GROUP_INSTRUCTIONS,
+            group_input,
+            on_usage=progresses[file_ids[0]].add_usage,
+        )
+    except Exception as e:
+        for file_id in file_ids:
+            failed(file_id, e)
+        return results
+
+    outputs = split_group_response(response or "")
+    missing = []
+    for number, file_id in enumerate(file_ids, start=1):
+        if number not in outputs:
+            missing.append(file_id)
+            continue
+        try:
+            put_result(
+                f"{user_id}/{job_id}/{file_id}_result.txt",
+                f"<reponse>{outputs[number]}</reponse>",
+            )
+            progresses[file_id].finished("COMPLETED")
+            results.append(
+                {
+                    "file_id": file_id,
+                    "status": "COMPLETED",
+                    "duration": time.perf_counter() - start,
+                }
+            )
+        except Exception as e:
+            failed(file_id, e)
+
+    logger.info(
+        f"Processed {len(file_ids)} files of job {job_id} in one conversation, "
+        f"{len(missing)} missing from the answer"
+    )
+    metrics.add_metric(name="FileGroups", unit=MetricUnit.Count, value=1)
+    metrics.add_metric(
+        name="GroupedFiles", unit=MetricUnit.Count, value=len(file_ids) - len(missing)
+    )
+    if missing:
+        metrics.add_metric(
+            name="GroupFallbackFiles", unit=MetricUnit.Count, value=len(missing)
+        )
+    files_by_id = {file["file_id"]: file for file in files}
+    for file_id in missing:
+        results.append(
+            process_input_file(
+                user_id,
+                job_id,
+                files_by_id[file_id],
+                prompt,
+                job_file_count,
+                retry_transient,
+            )
+        )
+    return results
+
+
+@tracer.capture_method
+def process_job_files(
+    user_id: str,
+    job_id: str,
+    file_groups: List[List[Dict[str, Any]]],
+    prompt: str,
+    job_file_count: int,
+    remaining_time: Optional[Callable[[], int]] = None,
+    mode: str = "separate",
+    retry_transient: bool = False,
+) -> List[Dict[str, Any]]:
+    """Process the files of a job concurrently, bounded by MAX_CONCURRENT_FILES.
+
+    Each group of files is processed in one conversation, regular jobs have a
+    single file per group. Groups take a slot from file_slots, shared with the
+    other records of the batch. Each finished file is checkpointed on the job
+    item. When remaining_time (the Lambda context's
+    get_remaining_time_in_millis) shows that a new group might not finish
+    before the timeout, the files not started yet are sent back to the queue
+    as a continuation message instead.
+    """
+    max_workers = max(1, min(Config.MAX_CONCURRENT_FILES, len(file_groups)))
+    start = time.perf_counter()
+    results = []
+    pending = list(file_groups)
+    in_flight = set()
+    longest_group = 0.0
+
+    def process_and_checkpoint(files: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        try:
+            group_results = process_file_group(
+                user_id, job_id, files, prompt, job_file_count, retry_transient
+            )
+        finally:
+            file_slots.release()
+        for result in group_results:
+            record_file_result(user_id, job_id, result)
+        return group_results
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or in_flight:
+            while pending and len(in_flight) < max_workers:
+                # Only wait for a slot when none of this job's groups can free one
+                if not file_slots.acquire(blocking=not in_flight):
+                    break
+                reserve = max(Config.TIME_BUDGET_SAFETY_SECONDS, longest_group)
+                if remaining_time and remaining_time() < reserve * 1000:
+                    file_slots.release()
+                    enqueue_continuation(
+                        user_id,
+                        job_id,
+                        [file for group in pending for file in group],
+                        prompt,
+                        job_file_count,
+                        mode,
+                    )
+                    pending = []
+                    break
+                in_flight.add(executor.submit(process_and_checkpoint, pending.pop(0)))
+            if not in_flight:
+                break
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                group_results = future.result()
+                longest_group = max(
+                    [longest_group] + [result["duration"] for result in group_results]
+                )
+                results.extend(group_results)
+    wall_time = time.perf_counter() - start
+
+    # The sum of per-file durations is what the sequential path would have taken
+    sequential_time = sum(result["duration"] for result in results)
+    speedup = sequential_time / wall_time if wall_time > 0 else 1.0
+    logger.info(
+        f"Processed {len(results)} files in {len(file_groups)} groups with "
+        f"{max_workers} workers in {wall_time:.2f}s "
+        f"(sequential estimate {sequential_time:.2f}s, speedup x{speedup:.2f})"
+    )
+    metrics.add_metric(name="JobWallTime", unit=MetricUnit.Seconds, value=wall_time)
+    metrics.add_metric(name="JobSpeedup", unit=MetricUnit.Count, value=speedup)
+
+    return results
+
+
+def enqueue_continuation(
+    user_id: str,
+    job_id: str,
+    files: List[Dict[str, Any]],
+    prompt: str,
+    job_file_count: int,
+    mode: str = "separate",
+):
+    """Queue the files a worker could not start before its timeout."""
+    sqs_client().send_message(
+        QueueUrl=Config.INFERENCE_QUEUE_URL,
+        MessageBody=json.dumps(
+            {
+                "user_id": user_id,
+                "job_id": job_id,
+                "prompt": prompt,
+                # Sizes are kept for the packing of grouped jobs
+                "input_files": [
+                    {
+                        "file_id": file["file_id"],
+                        "size": int(file.get("size", 0)),
+                        "object_key": input_object_key(user_id, file),
+                    }
+                    for file in files
+                ],
+                "total_files": job_file_count,
+                "mode": mode,
+                "continuation": True,
+            }
+        ),
+    )
+    logger.info(
+        f"Time budget running out, re-enqueued {len(files)} files of job {job_id}"
+    )
+    metrics.add_metric(name="JobContinuations", unit=MetricUnit.Count, value=1)
+
+
+def set_job_status(user_id: str, job_id: str, status: str, **attributes):
+    """Update the job status along with any extra attributes."""
+    attributes.update({"job_status": status, "updated_at": int(time.time())})
+    names = {f"#a{i}": name for i, name in enumerate(attributes)}
+    job_table().update_item(
         Key={"user_id": user_id, "job_id": job_id},
-        UpdateExpression="SET job_status=:s, updated_at=:u",
+        UpdateExpression="SET " + ", ".join(f"{name}=:{name[1:]}" for name in names),
+        ExpressionAttributeNames=names,
         ExpressionAttributeValues={
-            ":s": "PROCESSING",
-            ":u": int(time.time()),
+            f":{name[1:]}": attributes[attribute] for name, attribute in names.items()
+        },
+    )
+
+
+def start_job_checkpoints(user_id: str, job_id: str, total_files: int, **attributes):
+    """Mark the job PROCESSING and create its per-file counters.
+
+    Existing counters are kept, so a redelivered or continued job resumes from
+    its checkpoints instead of starting over.
+    """
+    attributes.update({"job_status": "PROCESSING", "updated_at": int(time.time())})
+    counters = {
+        "total_files": total_files,
+        "completed_files": 0,
+        "failed_file_count": 0,
+        "failed_files": [],
+        "file_progress": {},
+        "started_at": int(time.time()),
+    }
+    # Counters are only initialised, to keep the checkpoints of a previous delivery
+    assignments = [f"#a{i}=:a{i}" for i in range(len(attributes))] + [
+        f"#c{i}=if_not_exists(#c{i}, :c{i})" for i in range(len(counters))
+    ]
+    names, values = {}, {}
+    for prefix, group in (("a", attributes), ("c", counters)):
+        for i, (name, value) in enumerate(group.items()):
+            names[f"#{prefix}{i}"] = name
+            values[f":{prefix}{i}"] = value
+    job_table().update_item(
+        Key={"user_id": user_id, "job_id": job_id},
+        UpdateExpression="SET " + ", ".join(assignments),
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues=values,
+    )
+
+
+def finalize_job(
+    user_id: str, job_id: str, results: List[Dict[str, Any]], **attributes
+):
+    """Mark the job COMPLETED, or ERROR when every file failed."""
+    failed_files = [result for result in results if result["status"] == "ERROR"]
+    metrics.add_metric(
+        name="FailedFiles", unit=MetricUnit.Count, value=len(failed_files)
+    )
+
+    if failed_files and len(failed_files) == len(results):
+        set_job_status(
+            user_id,
+            job_id,
+            "ERROR",
+            job_error=f"All {len(failed_files)} files failed: {failed_files[0]['error']}",
+            **attributes,
+        )
+        return
+
+    set_job_status(
+        user_id,
+        job_id,
+        "COMPLETED",
+        job_error="; ".join(
+            f"{result['file_id']}: {result['error']}" for result in failed_files
+        ),
+        failed_files=[
+            {"file_id": result["file_id"], "error": result["error"]}
+            for result in failed_files
+        ],
+        **attributes,
+    )
+
+
+def should_use_batch_inference(input_files: List[Dict[str, Any]]) -> bool:
+    """Route large jobs to Bedrock batch inference when it is configured.
+
+    Each file is one batch record, jobs under the service minimum of records
+    are never routed, whatever their size in tokens.
+    """
+    if (
+        not Config.BATCH_INFERENCE_ROLE_ARN
+        or len(input_files) < Config.BATCH_INFERENCE_SERVICE_MIN_RECORDS
+    ):
+        return False
+    estimated_tokens = sum(
+        int(file.get("size", 0)) / Config.CHARS_PER_TOKEN for file in input_files
+    )
+    return (
+        len(input_files) >= Config.BATCH_INFERENCE_MIN_FILES
+        or estimated_tokens >= Config.BATCH_INFERENCE_MIN_TOKENS
+    )
+
+
+class LocalBatchInferenceClient:
+    """Offline stand-in for the Bedrock control plane batch inference API.
+
+    Jobs complete synchronously: every input record is answered with its own
+    input text wrapped in response tags, in the same output layout as Bedrock.
+    Enabled with BATCH_INFERENCE_STUB=true, typically against moto.
+    """
+
+    def __init__(self):
+        self.jobs = {}
+
+    def create_model_invocation_job(
+        self, jobName, roleArn, modelId, inputDataConfig, outputDataConfig
+    ):
+        input_bucket, input_key = parse_s3_uri(
+            inputDataConfig["s3InputDataConfig"]["s3Uri"]
+        )
+        output_bucket, output_prefix = parse_s3_uri(
+            outputDataConfig["s3OutputDataConfig"]["s3Uri"]
+        )
+        body = s3_client().get_object(Bucket=input_bucket, Key=input_key)["Body"]
+        lines = []
+        for line in body.iter_lines():
+            record = json.loads(line)
+            text = record["modelInput"]["messages"][0]["content"][0]["text"]
+            record["modelOutput"] = {
+                "content": [{"type": "text", "text": f"<reponse>{text}</reponse>"}]
+            }
+            lines.append(json.dumps(record))
+        job_arn = f"arn:aws:bedrock:local:000000000000:model-invocation-job/{jobName}"
+        s3_client().put_object(
+            Bucket=output_bucket,
+            Key=f"{output_prefix}{jobName}/{input_key.split('/')[-1]}.out",
+            Body="\n".join(lines).encode("utf-8"),
+        )
+        self.jobs[job_arn] = {
+            "jobArn": job_arn,
+            "status": "Completed",
+            "outputDataConfig": outputDataConfig,
+        }
+        return {"jobArn": job_arn}
+
+    def get_model_invocation_job(self, jobIdentifier):
+        return self.jobs[jobIdentifier]
+
+
+def parse_s3_uri(uri: str):
+    bucket, _, key = uri[len("s3://") :].partition("/")
+    return bucket, key
+
+
+@lazy
+def bedrock_batch_client():
+    if os.environ.get("BATCH_INFERENCE_STUB", "false").lower() == "true":
+        return LocalBatchInferenceClient()
+    return boto3.client("bedrock")
+
+
+@tracer.capture_method
+def submit_batch_inference(
+    user_id: str, job_id: str, input_files: List[Dict[str, Any]], prompt: str
+):
+    """Build the JSONL input for a job and start a Bedrock batch inference job."""
+    prefix = f"{Config.BATCH_INFERENCE_PREFIX}{user_id}/{job_id}/"
+    input_key = f"{prefix}input.jsonl"
+    system_prompt = prompt + Config.INSTRUCTIONS
+
+    def read_file(file: Dict[str, Any]) -> str:
+        return read_object(Config.INPUT_BUCKET, input_object_key(user_id, file)).decode(
+            "utf-8"
+        )
+
+    # Spool the JSONL to disk so memory does not grow with the job size
+    file_ids = [file["file_id"] for file in input_files]
+    with tempfile.TemporaryFile() as spool:
+        with ThreadPoolExecutor(max_workers=Config.MAX_CONCURRENT_FILES) as executor:
+            for file_id, file_content in zip(
+                file_ids, executor.map(read_file, input_files)
+            ):
+                record = {
+                    "recordId": file_id,
+                    "modelInput": {
+                        "anthropic_version": "bedrock-2023-05-31",
+                        "max_tokens": Config.DEFAULT_MAX_TOKENS,
+                        "temperature": Config.DEFAULT_TEMPERATURE,
+                        "system": system_prompt,
+                        "messages": [
+                            {
+                                "role": "user",
+                                "content": [{"type": "text", "text": file_content}],
+                            }
+                        ],
+                    },
+                }
+                spool.write(json.dumps(record).encode("utf-8") + b"\n")
+        spool.seek(0)
+        s3_client().upload_fileobj(spool, Config.OUTPUT_BUCKET, input_key)
+
+    response = bedrock_batch_client().create_model_invocation_job(
+        jobName=f"job-{job_id}",
+        roleArn=Config.BATCH_INFERENCE_ROLE_ARN,
+        modelId=Config.DEFAULT_MODEL,
+        inputDataConfig={
+            "s3InputDataConfig": {"s3Uri": f"s3://{Config.OUTPUT_BUCKET}/{input_key}"}
         },
+        outputDataConfig={
+            "s3OutputDataConfig": {
+                "s3Uri": f"s3://{Config.OUTPUT_BUCKET}/{prefix}output/"
+            }
+        },
+    )
+    batch_job_arn = response["jobArn"]
+    logger.info(f"Submitted batch inference job {batch_job_arn} for job {job_id}")
+    metrics.add_metric(name="BatchInferenceJobs", unit=MetricUnit.Count, value=1)
+    set_job_status(
+        user_id,
+        job_id,
+        "PROCESSING",
+        execution_mode="BATCH",
+        batch_job_arn=batch_job_arn,
+        batch_status="Submitted",
+    )
+
+    # Poll once: the job may already be finished (always true for the stub)
+    handle_batch_job_state_change(batch_job_arn)
+
+
+@tracer.capture_method
+def handle_batch_job_state_change(batch_job_arn: str):
+    """Track a batch inference job and fan out its results once it is done."""
+    batch_job = bedrock_batch_client().get_model_invocation_job(
+        jobIdentifier=batch_job_arn
+    )
+    status = batch_job["status"]
+    output_uri = batch_job["outputDataConfig"]["s3OutputDataConfig"]["s3Uri"]
+    bucket, output_prefix = parse_s3_uri(output_uri)
+    # Output prefix layout: batch/{user_id}/{job_id}/output/
+    layout = output_prefix[len(Config.BATCH_INFERENCE_PREFIX) :].split("/")
+    if (
+        bucket != Config.OUTPUT_BUCKET
+        or not output_prefix.startswith(Config.BATCH_INFERENCE_PREFIX)
+        or len(layout) != 4
+        or layout[2:] != ["output", ""]
+    ):
+        # EventBridge forwards every batch inference job of the account
+        logger.info(f"Ignoring batch job {batch_job_arn} not submitted by this service")
+        return
+    user_id, job_id = layout[:2]
+
+    if status not in Config.BATCH_INFERENCE_TERMINAL_STATUSES:
+        set_job_status(user_id, job_id, "PROCESSING", batch_status=status)
+        return
+
+    if status not in ("Completed", "PartiallyCompleted"):
+        set_job_status(
+            user_id,
+            job_id,
+            "ERROR",
+            batch_status=status,
+            job_error=batch_job.get("message", f"Batch inference job {status}"),
+        )
+        return
+
+    results = []
+    paginator = s3_client().get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=output_prefix):
+        for obj in page.get("Contents", []):
+            if not obj["Key"].endswith(".jsonl.out"):
+                continue
+            body = s3_client().get_object(Bucket=bucket, Key=obj["Key"])["Body"]
+            for line in body.iter_lines():
+                if line:
+                    results.append(
+                        write_batch_record_result(user_id, job_id, json.loads(line))
+                    )
+
+    # Files without an output record failed, they must not count as done
+    job = (
+        job_table()
+        .get_item(
+            Key={"user_id": user_id, "job_id": job_id},
+            ProjectionExpression="input_files",
+            ConsistentRead=True,
+        )
+        .get("Item", {})
+    )
+    answered = {result["file_id"] for result in results}
+    missing = [
+        file["file_id"]
+        for file in job.get("input_files", [])
+        if file["file_id"] not in answered
+    ]
+    if missing:
+        logger.warning(f"No batch output record for {len(missing)} files")
+        results.extend(
+            {"file_id": file_id, "status": "ERROR", "error": "No batch output record"}
+            for file_id in missing
+        )
+    if not results:
+        set_job_status(
+            user_id,
+            job_id,
+            "ERROR",
+            batch_status=status,
+            job_error="Batch inference job produced no output records",
+        )
+        return
+
+    finalize_job(user_id, job_id, results, batch_status=status)
+
+
+def write_batch_record_result(
+    user_id: str, job_id: str, record: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Write one batch output record to the regular result key."""
+    file_id = record["recordId"]
+    if record.get("error") or not record.get("modelOutput"):
+        error = record.get("error", {})
+        return {
+            "file_id": file_id,
+            "status": "ERROR",
+            "error": error.get("errorMessage", str(error)) if error else "No output",
+        }
+
+    text = "".join(
+        block.get("text", "") for block in record["modelOutput"].get("content", [])
     )
+    put_result(f"{user_id}/{job_id}/{file_id}_result.txt", text)
+    return {"file_id": file_id, "status": "COMPLETED"}
+
+
+@tracer.capture_method
+def fan_out_job(
+    user_id: str, job_id: str, input_files: List[Dict[str, Any]], prompt: str
+):
+    """Queue one work item per file so a job spreads across Lambda instances.
+
+    The job item carries atomic counters that record_file_result uses to close
+    the job once the last file is done.
+    """
+    start_job_checkpoints(user_id, job_id, len(input_files), execution_mode="FANOUT")
+
+    entries = [
+        {
+            "Id": str(index),
+            "MessageBody": json.dumps(
+                {
+                    "user_id": user_id,
+                    "job_id": job_id,
+                    "prompt": prompt,
+                    "file": file,
+                    "total_files": len(input_files),
+                }
+            ),
+        }
+        for index, file in enumerate(input_files)
+    ]
+    batches = [
+        entries[i : i + Config.SQS_BATCH_SIZE]
+        for i in range(0, len(entries), Config.SQS_BATCH_SIZE)
+    ]
+
+    def send_batch(batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        response = sqs_client().send_message_batch(
+            QueueUrl=Config.INFERENCE_QUEUE_URL, Entries=batch
+        )
+        return response.get("Failed", [])
+
+    with ThreadPoolExecutor(max_workers=Config.MAX_CONCURRENT_FILES) as executor:
+        failed = [
+            entry for result in executor.map(send_batch, batches) for entry in result
+        ]
+    if failed:
+        raise RuntimeError(f"Failed to queue {len(failed)} of {len(entries)} files")
+
+    logger.info(f"Fanned out job {job_id} into {len(entries)} file work items")
+
+
+@tracer.capture_method
+def record_file_result(user_id: str, job_id: str, result: Dict[str, Any]):
+    """Atomically checkpoint a finished file and close the job after the last one.
+
+    The processed file ids are kept in a set so that a redelivered work item is
+    never counted twice.
+    """
+    failed = result["status"] == "ERROR"
+    update_expression = (
+        "ADD done_file_ids :fid_set, completed_files :completed, "
+        "failed_file_count :failed SET updated_at=:u"
+    )
+    values = {
+        ":fid_set": {result["file_id"]},
+        ":fid": result["file_id"],
+        ":completed": 0 if failed else 1,
+        ":failed": 1 if failed else 0,
+        ":u": int(time.time()),
+    }
+    if failed:
+        update_expression += (
+            ", failed_files=list_append(if_not_exists(failed_files, :empty), :error)"
+        )
+        values[":empty"] = []
+        values[":error"] = [{"file_id": result["file_id"], "error": result["error"]}]
+
     try:
-        # extract file ids list
-        file_keys = [file["file_id"] for file in payload["input_files"]]
-        # extract prompt
-        prompt = payload["prompt"]
-
-        # retrieve files
-        for file_id in file_keys:
-            file_content = (
-                s3_client.get_object(
-                    Bucket=Config.INPUT_BUCKET, Key=f"{user_id}/{file_id}"
-                )["Body"]
-                .read()
-                .decode("utf-8")
-            )
-            process_file(
-                file_content=file_content,
-                user_prompt=prompt,
-                job_id=job_id,
-                file_id=file_id,
-                user_id=user_id,
-            )
-
-        job_table.update_item(
+        job = job_table().update_item(
             Key={"user_id": user_id, "job_id": job_id},
-            UpdateExpression="SET job_status=:s, updated_at=:u",
+            UpdateExpression=update_expression,
+            ConditionExpression=(
+                "attribute_not_exists(done_file_ids) OR NOT contains(done_file_ids, :fid)"
+            ),
+            ExpressionAttributeValues=values,
+            ReturnValues="ALL_NEW",
+        )["Attributes"]
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            logger.info(f"File {result['file_id']} of job {job_id} already counted")
+            return
+        raise
+
+    close_job_if_done(user_id, job_id, job)
+
+
+def close_job_if_done(user_id: str, job_id: str, job: Dict[str, Any]):
+    """Set the final status once every file of the job has been counted."""
+    if job["completed_files"] + job["failed_file_count"] < job["total_files"]:
+        return
+
+    status = "ERROR" if job["failed_file_count"] == job["total_files"] else "COMPLETED"
+    try:
+        job_table().update_item(
+            Key={"user_id": user_id, "job_id": job_id},
+            UpdateExpression="SET job_status=:s, job_error=:e, updated_at=:u",
+            ConditionExpression="job_status = :processing",
             ExpressionAttributeValues={
-                ":s": "COMPLETED",
+                ":s": status,
+                ":e": "; ".join(
+                    f"{file['file_id']}: {file['error']}"
+                    for file in job.get("failed_files", [])
+                ),
                 ":u": int(time.time()),
+                ":processing": "PROCESSING",
             },
         )
+        logger.info(f"Job {job_id} finished with status {status}")
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+
+
+class MultipartUploadWriter:
+    """Write-only file object backed by an S3 multipart upload.
+
+    Data is buffered until a full part is available, so memory stays bounded
+    by MULTIPART_PART_SIZE whatever the size of the object.
+    """
+
+    def __init__(self, bucket: str, key: str, **upload_args):
+        self.bucket = bucket
+        self.key = key
+        self.upload_id = s3_client().create_multipart_upload(
+            Bucket=bucket, Key=key, **upload_args
+        )["UploadId"]
+        self.parts = []
+        self.buffer = bytearray()
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        self.buffer.extend(data)
+        self.size += len(data)
+        if len(self.buffer) >= Config.MULTIPART_PART_SIZE:
+            self._upload_part()
+        return len(data)
+
+    def flush(self):
+        # Parts are only uploaded once full
+        pass
+
+    def _upload_part(self):
+        part_number = len(self.parts) + 1
+        response = s3_client().upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            Body=bytes(self.buffer),
+        )
+        self.parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+        self.buffer = bytearray()
+
+    def close(self):
+        if self.buffer or not self.parts:
+            self._upload_part()
+        s3_client().complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            MultipartUpload={"Parts": self.parts},
+        )
+
+    def abort(self):
+        s3_client().abort_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id
+        )
+
+
+def gunzip_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    decompressor = zlib.decompressobj(wbits=31)
+    for chunk in chunks:
+        yield decompressor.decompress(chunk)
+    yield decompressor.flush()
+
+
+def open_export_object(bucket: str, key: str) -> Optional[Iterator[bytes]]:
+    """Open an object to archive as decompressed chunks, None if it is missing.
+
+    Small objects are read at once so they can be prefetched in parallel,
+    larger ones are streamed by the caller.
+    """
+    try:
+        response = s3_client().get_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+            return None
+        raise
+    if response["ContentLength"] <= Config.EXPORT_PREFETCH_MAX_SIZE:
+        data = response["Body"].read()
+        chunks = (
+            data[start : start + Config.EXPORT_READ_CHUNK_SIZE]
+            for start in range(0, len(data), Config.EXPORT_READ_CHUNK_SIZE)
+        )
+    else:
+        chunks = response["Body"].iter_chunks(Config.EXPORT_READ_CHUNK_SIZE)
+    if response.get("ContentEncoding") == "gzip":
+        return gunzip_chunks(chunks)
+    return chunks
+
+
+def iter_export_objects(
+    entries: List[Tuple[str, str, str]],
+) -> Iterator[Tuple[str, Optional[Iterator[bytes]]]]:
+    """Yield (archive name, chunks) in order, opening the next objects ahead."""
+    remaining = iter(entries)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=Config.EXPORT_CONCURRENCY) as executor:
+
+        def submit_next():
+            entry = next(remaining, None)
+            if entry:
+                name, bucket, key = entry
+                pending.append((name, executor.submit(open_export_object, bucket, key)))
+
+        for _ in range(Config.EXPORT_CONCURRENCY):
+            submit_next()
+        while pending:
+            name, future = pending.popleft()
+            submit_next()
+            yield name, future.result()
+
+
+def archive_name(file_id: str, filename: str, suffix: str = "") -> str:
+    # Filenames are not unique, the file_id prefix keeps entries apart
+    safe_filename = filename.replace("/", "_").replace("\\", "_")
+    return f"{file_id}_{safe_filename}{suffix}"
+
+
+def job_export_entries(
+    user_id: str, job: Dict[str, Any], include_inputs: bool
+) -> List[Tuple[str, str, str]]:
+    """List the (archive name, bucket, key) of every object of a job export."""
+    job_id = job["job_id"]
+    input_files = {file["file_id"]: file for file in job.get("input_files", [])}
+    filenames = {
+        file_id: file.get("filename") or file_id
+        for file_id, file in input_files.items()
+    }
+    entries = []
+    paginator = s3_client().get_paginator("list_objects_v2")
+    for page in paginator.paginate(
+        Bucket=Config.OUTPUT_BUCKET, Prefix=f"{user_id}/{job_id}/"
+    ):
+        for obj in page.get("Contents", []):
+            if not obj["Key"].endswith("_result.txt"):
+                continue
+            file_id = obj["Key"].rsplit("/", 1)[-1][: -len("_result.txt")]
+            name = archive_name(file_id, filenames.get(file_id, file_id), "_result.txt")
+            entries.append((f"results/{name}", Config.OUTPUT_BUCKET, obj["Key"]))
+    if include_inputs:
+        for file_id, filename in filenames.items():
+            entries.append(
+                (
+                    f"inputs/{archive_name(file_id, filename)}",
+                    Config.INPUT_BUCKET,
+                    input_object_key(user_id, input_files[file_id]),
+                )
+            )
+    return entries
+
+
+@tracer.capture_method
+def build_job_export(
+    user_id: str, job: Dict[str, Any], include_inputs: bool, key: str, version: str
+) -> Dict[str, int]:
+    """Stream a ZIP archive of a job's objects into the output bucket.
+
+    The archive is written through a multipart upload while the objects are
+    read, so memory stays bounded by one part plus the prefetched objects.
+    """
+    writer = MultipartUploadWriter(
+        Config.OUTPUT_BUCKET,
+        key,
+        ContentType="application/zip",
+        Metadata={"job-version": version},
+    )
+    file_count = 0
+    try:
+        # The writer cannot seek, zipfile then writes data descriptors
+        with zipfile.ZipFile(
+            writer, mode="w", compression=zipfile.ZIP_DEFLATED
+        ) as archive:
+            for name, chunks in iter_export_objects(
+                job_export_entries(user_id, job, include_inputs)
+            ):
+                if chunks is None:
+                    continue
+                with archive.open(name, mode="w") as entry:
+                    for chunk in chunks:
+                        entry.write(chunk)
+                file_count += 1
+        writer.close()
+    except Exception:
+        writer.abort()
+        raise
+    return {"file_count": file_count, "size": writer.size}
+
+
+@tracer.capture_method
+def handle_export_request(request: Dict[str, Any]):
+    """Build the ZIP archive of a job requested through GET /jobs/{job_id}/export."""
+    user_id = request["user_id"]
+    job_id = request["job_id"]
+    key = request["key"]
+    job = (
+        job_table()
+        .get_item(Key={"user_id": user_id, "job_id": job_id}, ConsistentRead=True)
+        .get("Item")
+    )
+    if not job:
+        logger.warning(f"Export requested for unknown job {job_id}")
+        return
+    version = str(job.get("updated_at"))
+    try:
+        head = s3_client().head_object(Bucket=Config.OUTPUT_BUCKET, Key=key)
+        if head.get("Metadata", {}).get("job-version") == version:
+            logger.info(f"Export {key} already built for this job version")
+            return
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in ("404", "NoSuchKey", "NotFound"):
+            raise
+
+    start = time.perf_counter()
+    export = build_job_export(user_id, job, request["include_inputs"], key, version)
+    logger.info(
+        f"Exported {export['file_count']} files of job {job_id} "
+        f"({export['size']} bytes) in {time.perf_counter() - start:.2f}s"
+    )
+    metrics.add_metric(name="ExportSize", unit=MetricUnit.Bytes, value=export["size"])
+
+
+def is_last_attempt(record: SQSRecord) -> bool:
+    """Whether SQS moves the record to the dead-letter queue if it fails again."""
+    return int(record.attributes.approximate_receive_count) >= Config.MAX_RECEIVE_COUNT
+
+
+@tracer.capture_method
+def handle_dead_letter(payload: Dict[str, Any]):
+    """Fail the files of a message that exhausted its deliveries.
+
+    A delivery killed by the Lambda timeout runs no error handling, the job
+    would otherwise stay PROCESSING forever.
+    """
+    if "export" in payload:
+        # The API sends the request again once it is stale
+        logger.error(f"Export could not be built: {payload['export']}")
+        return
+    job_id = payload.get("job_id")
+    user_id = payload.get("user_id")
+    if not job_id or not user_id:
+        logger.error(f"Dead-lettered message without a job: {payload}")
+        return
+    metrics.add_metric(name="DeadLetteredRecords", unit=MetricUnit.Count, value=1)
+    error = f"Processing did not finish after {Config.MAX_RECEIVE_COUNT} attempts"
+
+    job = (
+        job_table()
+        .get_item(Key={"user_id": user_id, "job_id": job_id}, ConsistentRead=True)
+        .get("Item", {})
+    )
+    if job.get("job_status") in Config.TERMINAL_JOB_STATUSES:
+        logger.info(f"Job {job_id} already {job['job_status']}, dead letter ignored")
+        return
+    files = [payload["file"]] if "file" in payload else payload["input_files"]
+    if "total_files" not in job:
+        # The job died before its per-file counters were created
+        finalize_job(
+            user_id,
+            job_id,
+            [
+                {"file_id": file["file_id"], "status": "ERROR", "error": error}
+                for file in files
+            ],
+        )
+        return
+
+    done_file_ids = job.get("done_file_ids", set())
+    for file in files:
+        if file["file_id"] not in done_file_ids:
+            # The last failed file closes the job
+            record_file_result(
+                user_id,
+                job_id,
+                {"file_id": file["file_id"], "status": "ERROR", "error": error},
+            )
+
+
+@tracer.capture_method
+def record_handler(record: SQSRecord, lambda_context: Optional[LambdaContext] = None):
+    payload = record.json_body
+    if (
+        Config.DEAD_LETTER_QUEUE_ARN
+        and record.event_source_arn == Config.DEAD_LETTER_QUEUE_ARN
+    ):
+        handle_dead_letter(payload)
+        return
+
+    if "export" in payload:
+        handle_export_request(payload["export"])
+        return
+
+    if payload.get("source") == "aws.bedrock":
+        # Batch inference job state change forwarded by EventBridge
+        handle_batch_job_state_change(payload["detail"]["batchJobArn"])
+        return
+
+    job_id = payload.get("job_id")
+    user_id = payload.get("user_id")
+    # Transient errors are left to SQS, unless this delivery is the last one
+    retry_transient = not is_last_attempt(record)
+
+    if "file" in payload:
+        # Single file work item of a fanned out job
+        with file_slots:
+            result = process_input_file(
+                user_id,
+                job_id,
+                payload["file"],
+                payload["prompt"],
+                payload.get("total_files", 1),
+                retry_transient,
+            )
+        record_file_result(user_id, job_id, result)
+        return
+
+    job = (
+        job_table()
+        .get_item(Key={"user_id": user_id, "job_id": job_id}, ConsistentRead=True)
+        .get("Item", {})
+    )
+    if job.get("job_status") in Config.TERMINAL_JOB_STATUSES:
+        logger.info(f"Job {job_id} already {job['job_status']}, ignoring redelivery")
+        return
+
+    # Grouped jobs already share conversations, they skip batch inference and fan-out
+    mode = payload.get("mode", "separate")
+    try:
+        if not payload.get("continuation") and mode != "grouped":
+            if should_use_batch_inference(payload["input_files"]):
+                set_job_status(user_id, job_id, "PROCESSING")
+                submit_batch_inference(
+                    user_id, job_id, payload["input_files"], payload["prompt"]
+                )
+                return
+
+            if 0 < Config.FANOUT_MIN_FILES <= len(payload["input_files"]):
+                fan_out_job(user_id, job_id, payload["input_files"], payload["prompt"])
+                return
+
+        if not payload.get("continuation"):
+            start_job_checkpoints(
+                user_id,
+                job_id,
+                len(payload["input_files"]),
+                execution_mode="GROUPED" if mode == "grouped" else "DIRECT",
+            )
+
+        # Skip the files checkpointed by a previous delivery
+        done_file_ids = job.get("done_file_ids", set())
+        files = [
+            file
+            for file in payload["input_files"]
+            if file["file_id"] not in done_file_ids
+        ]
+        if not files:
+            # Every file was checkpointed but the job was not closed yet
+            job = job_table().get_item(
+                Key={"user_id": user_id, "job_id": job_id}, ConsistentRead=True
+            )["Item"]
+            close_job_if_done(user_id, job_id, job)
+            return
+
+        if mode == "grouped":
+            file_groups = pack_file_groups(files)
+            logger.info(f"Packed {len(files)} files into {len(file_groups)} groups")
+        else:
+            file_groups = [[file] for file in files]
+
+        process_job_files(
+            user_id,
+            job_id,
+            file_groups,
+            payload["prompt"],
+            payload.get("total_files", len(payload["input_files"])),
+            lambda_context.get_remaining_time_in_millis if lambda_context else None,
+            mode,
+            retry_transient,
+        )
     except Exception as e:
+        if retry_transient and is_transient_error(e):
+            # Reported as a batch item failure, the checkpoints skip finished files
+            logger.warning(
+                f"Transient error on job {job_id}, message left for retry: {e}"
+            )
+            metrics.add_metric(
+                name="TransientRecordFailures", unit=MetricUnit.Count, value=1
+            )
+            raise
         logger.error(
             f"Error processing job {job_id}: {str(e)}, stack trace: {traceback.format_exc()}"
         )
-        job_table.update_item(
-            Key={"user_id": user_id, "job_id": job_id},
-            UpdateExpression="SET job_status=:s, job_error=:e, updated_at=:u",
-            ExpressionAttributeValues={
-                ":s": "ERROR",
-                ":e": str(e),
-                ":u": int(time.time()),
-            },
-        )
+        set_job_status(user_id, job_id, "ERROR", job_error=str(e))
 
 
 @logger.inject_lambda_context
+@metrics.log_metrics
 @tracer.capture_lambda_handler
 def lambda_handler(event, context: LambdaContext):
     return process_partial_response(
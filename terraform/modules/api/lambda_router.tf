@@ -17,12 +17,13 @@ module "lambda_router" {
   s3_bucket                    = var.lambda_storage_bucket
   trigger_on_package_timestamp = false
   environment_variables = {
-    METADATA_TABLE          = var.metadata_table.name
-    INPUT_BUCKET_NAME       = var.user_files_bucket.name
-    OUTPUT_BUCKET_NAME      = var.output_bucket.name
-    POWERTOOLS_SERVICE_NAME = "${var.project_name}-${var.environment}-${local.lambda_name}"
-    INFERENCE_QUEUE_URL     = var.inference_queue.name
-    INFERENCE_JOBS_TABLE    = var.jobs_status_table.name
+    METADATA_TABLE               = var.metadata_table.name
+    INPUT_BUCKET_NAME            = var.user_files_bucket.name
+    OUTPUT_BUCKET_NAME           = var.output_bucket.name
+    POWERTOOLS_SERVICE_NAME      = "${var.project_name}-${var.environment}-${local.lambda_name}"
+    POWERTOOLS_METRICS_NAMESPACE = "${var.project_name}-${var.environment}"
+    INFERENCE_QUEUE_URL          = var.inference_queue.name
+    INFERENCE_JOBS_TABLE         = var.jobs_status_table.name
   }
 
   role_name                = "${var.project_name}-${var.environment}-${local.lambda_name}-role"
@@ -35,7 +36,9 @@ module "lambda_router" {
         "s3:GetObject",
         "s3:ListBucket",
         "s3:PutObject",
-        "s3:DeleteObject"
+        "s3:PutObjectTagging",
+        "s3:DeleteObjectTagging",
+        "s3:AbortMultipartUpload"
       ],
       resources = [
         var.user_files_bucket.arn,
@@ -46,8 +49,7 @@ module "lambda_router" {
       effect = "Allow",
       actions = [
         "s3:GetObject",
-        "s3:ListBucket",
-        "s3:PutObject"
+        "s3:ListBucket"
       ],
       resources = [
         var.output_bucket.arn,
@@ -58,7 +60,9 @@ module "lambda_router" {
       effect = "Allow",
       actions = [
         "dynamodb:GetItem",
+        "dynamodb:BatchGetItem",
         "dynamodb:PutItem",
+        "dynamodb:UpdateItem",
         "dynamodb:DeleteItem",
         "dynamodb:Query"
       ],
@@ -81,6 +85,7 @@ module "lambda_router" {
       actions = [
         "dynamodb:GetItem",
         "dynamodb:PutItem",
+        "dynamodb:UpdateItem",
         "dynamodb:DeleteItem",
         "dynamodb:Query"
       ],
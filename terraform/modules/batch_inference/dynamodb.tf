@@ -13,4 +13,42 @@
     name = "user_id"
     type = "S"
   }
+
+  attribute {
+    name = "created_at"
+    type = "N"
+  }
+
+  attribute {
+    name = "updated_at"
+    type = "N"
+  }
+
+  global_secondary_index {
+    name            = "CreatedAtIndex"
+    hash_key        = "user_id"
+    range_key       = "created_at"
+    projection_type = "ALL"
+  }
+
+  # Delta sync of the job list: jobs updated since the client's last poll.
+  # A local secondary index cannot be added to an existing table.
+  global_secondary_index {
+    name            = "UpdatedAtIndex"
+    hash_key        = "user_id"
+    range_key       = "updated_at"
+    projection_type = "ALL"
+  }
+}
+
+# Shared token bucket pacing Bedrock calls across all inference workers
+resource "aws_dynamodb_table" "bedrock_rate_limiter" {
+  name         = "${var.project_name}-bedrock-rate-limiter-${var.environment}"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "limiter_id"
+
+  attribute {
+    name = "limiter_id"
+    type = "S"
+  }
 }
@@ -19,10 +19,22 @@ module "lambda_router" {
   s3_bucket                    = var.lambda_storage_bucket
   trigger_on_package_timestamp = false
   environment_variables = {
-    INPUT_BUCKET            = var.user_files_bucket.name
-    OUTPUT_BUCKET           = var.output_bucket.name
-    POWERTOOLS_SERVICE_NAME = "${var.project_name}-${var.environment}-${local.lambda_name}"
-    INFERENCE_JOBS_TABLE    = var.jobs_status_table.name
+    INPUT_BUCKET                   = var.user_files_bucket.name
+    OUTPUT_BUCKET                  = var.output_bucket.name
+    POWERTOOLS_SERVICE_NAME        = "${var.project_name}-${var.environment}-${local.lambda_name}"
+    POWERTOOLS_METRICS_NAMESPACE   = "${var.project_name}-${var.environment}"
+    INFERENCE_JOBS_TABLE           = var.jobs_status_table.name
+    MAX_CONCURRENT_FILES           = var.max_concurrent_files
+    STREAMING_ENABLED              = var.streaming_enabled
+    BATCH_INFERENCE_ROLE_ARN       = var.batch_inference_enabled ? aws_iam_role.bedrock_batch_inference.arn : ""
+    BATCH_INFERENCE_MIN_FILES      = var.batch_inference_min_files
+    FANOUT_MIN_FILES               = var.fanout_min_files
+    INFERENCE_QUEUE_URL            = var.inference_queue.name
+    RATE_LIMITER_TABLE             = aws_dynamodb_table.bedrock_rate_limiter.name
+    RATE_LIMIT_REQUESTS_PER_MINUTE = var.rate_limit_requests_per_minute
+    RATE_LIMIT_TOKENS_PER_MINUTE   = var.rate_limit_tokens_per_minute
+    MAX_RECEIVE_COUNT              = var.inference_max_receive_count
+    DEAD_LETTER_QUEUE_ARN          = aws_sqs_queue.batch_inference_dlq.arn
   }
 
   allowed_triggers = {
@@ -34,6 +46,10 @@ module "lambda_router" {
       service    = "sqs"
       source_arn = var.inference_queue.arn
     }
+    SQSDeadLetter = {
+      service    = "sqs"
+      source_arn = aws_sqs_queue.batch_inference_dlq.arn
+    }
   }
 
   role_name                = "${var.project_name}-${var.environment}-${local.lambda_name}-role"
@@ -57,7 +73,9 @@ module "lambda_router" {
       actions = [
         "s3:GetObject",
         "s3:ListBucket",
-        "s3:PutObject"
+        "s3:PutObject",
+        "s3:DeleteObject",
+        "s3:AbortMultipartUpload"
       ],
       resources = [
         var.output_bucket.arn,
@@ -69,10 +87,12 @@ module "lambda_router" {
       actions = [
         "sqs:ReceiveMessage",
         "sqs:DeleteMessage",
-        "sqs:GetQueueAttributes"
+        "sqs:GetQueueAttributes",
+        "sqs:SendMessage"
       ],
       resources = [
-        var.inference_queue.arn
+        var.inference_queue.arn,
+        aws_sqs_queue.batch_inference_dlq.arn
       ]
     }
     dynamodb_jobs_status = {
@@ -87,20 +107,94 @@ module "lambda_router" {
         "${var.jobs_status_table.arn}/index/*"
       ]
     }
+    dynamodb_rate_limiter = {
+      effect = "Allow",
+      actions = [
+        "dynamodb:GetItem",
+        "dynamodb:PutItem",
+        "dynamodb:UpdateItem"
+      ],
+      resources = [aws_dynamodb_table.bedrock_rate_limiter.arn]
+    }
     bedrock = {
       effect    = "Allow"
-      actions   = ["bedrock:InvokeModel"]
+      actions   = ["bedrock:InvokeModel", "bedrock:InvokeModelWithResponseStream"]
+      resources = ["*"]
+    }
+    bedrock_batch_inference = {
+      effect = "Allow"
+      actions = [
+        "bedrock:CreateModelInvocationJob",
+        "bedrock:GetModelInvocationJob"
+      ]
       resources = ["*"]
     }
+    pass_bedrock_batch_role = {
+      effect    = "Allow"
+      actions   = ["iam:PassRole"]
+      resources = [aws_iam_role.bedrock_batch_inference.arn]
+    }
   }
 }
 
+# Service role assumed by Bedrock to read batch inputs and write batch outputs
+resource "aws_iam_role" "bedrock_batch_inference" {
+  name = "${var.project_name}-${var.environment}-bedrock-batch-inference-role"
+
+  assume_role_policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Action = "sts:AssumeRole"
+        Effect = "Allow"
+        Principal = {
+          Service = "bedrock.amazonaws.com"
+        }
+      }
+    ]
+  })
+}
+
+resource "aws_iam_role_policy" "bedrock_batch_inference" {
+  name = "default"
+  role = aws_iam_role.bedrock_batch_inference.id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect = "Allow"
+        Action = [
+          "s3:GetObject",
+          "s3:PutObject",
+          "s3:ListBucket"
+        ]
+        Resource = [
+          var.output_bucket.arn,
+          "${var.output_bucket.arn}/batch/*"
+        ]
+      }
+    ]
+  })
+}
+
 resource "aws_lambda_event_source_mapping" "sqs" {
   event_source_arn                   = var.inference_queue.arn
   function_name                      = module.lambda_router.lambda_function_name
-  batch_size                         = 1
+  batch_size                         = var.inference_batch_size
+  maximum_batching_window_in_seconds = 0
+
+  # Records failing with a transient error are reported and redelivered alone
+  function_response_types = ["ReportBatchItemFailures"]
+}
+
+# Messages that exhausted their deliveries, for instance by timing out each
+# time, come back to the lambda so their job is marked failed
+resource "aws_lambda_event_source_mapping" "sqs_dead_letter" {
+  event_source_arn                   = aws_sqs_queue.batch_inference_dlq.arn
+  function_name                      = module.lambda_router.lambda_function_name
+  batch_size                         = var.inference_batch_size
   maximum_batching_window_in_seconds = 0
 
-  # Add error handling configuration
   function_response_types = ["ReportBatchItemFailures"]
 }
@@ -1,5 +1,7 @@
 ﻿resource "aws_sqs_queue" "batch_inference_dlq" {
   name = "${var.project_name}-${var.environment}-batch-inference-dlq"
+  # Consumed by the inference lambda, at least its timeout
+  visibility_timeout_seconds = 900
 }
 resource "aws_sqs_queue" "batch_inference_queue" {
   name                       = "${var.project_name}-${var.environment}-batch-inference-queue"
@@ -7,6 +9,43 @@ resource "aws_sqs_queue" "batch_inference_queue" {
 
   redrive_policy = jsonencode({
     deadLetterTargetArn = aws_sqs_queue.batch_inference_dlq.arn
-    maxReceiveCount     = 1
+    maxReceiveCount     = var.inference_max_receive_count
+  })
+}
+
+# Bedrock batch inference state changes are delivered to the inference lambda
+# through the same queue as the jobs
+resource "aws_cloudwatch_event_rule" "batch_inference_state_change" {
+  name = "${var.project_name}-${var.environment}-batch-inference-state-change"
+
+  event_pattern = jsonencode({
+    source      = ["aws.bedrock"]
+    detail-type = ["Batch Inference Job State Change"]
+  })
+}
+
+resource "aws_cloudwatch_event_target" "batch_inference_state_change" {
+  rule = aws_cloudwatch_event_rule.batch_inference_state_change.name
+  arn  = aws_sqs_queue.batch_inference_queue.arn
+}
+
+resource "aws_sqs_queue_policy" "batch_inference_queue" {
+  queue_url = aws_sqs_queue.batch_inference_queue.id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect    = "Allow"
+        Principal = { Service = "events.amazonaws.com" }
+        Action    = "sqs:SendMessage"
+        Resource  = aws_sqs_queue.batch_inference_queue.arn
+        Condition = {
+          ArnEquals = {
+            "aws:SourceArn" = aws_cloudwatch_event_rule.batch_inference_state_change.arn
+          }
+        }
+      }
+    ]
   })
 }
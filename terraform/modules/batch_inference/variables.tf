@@ -46,3 +46,58 @@ variable "output_bucket" {
   })
 
 }
+
+
+variable "max_concurrent_files" {
+  description = "Maximum number of files of a job processed in parallel by the inference lambda."
+  type        = number
+  default     = 8
+}
+
+variable "inference_batch_size" {
+  description = "Maximum number of queue messages per inference lambda invocation, processed concurrently."
+  type        = number
+  default     = 10
+}
+
+variable "inference_max_receive_count" {
+  description = "Deliveries of a queue message before it goes to the dead-letter queue. Transient errors are retried until the last one."
+  type        = number
+  default     = 3
+}
+
+variable "streaming_enabled" {
+  description = "Stream Bedrock responses into the result object instead of writing it once at the end."
+  type        = bool
+  default     = false
+}
+
+variable "batch_inference_enabled" {
+  description = "Route large jobs to Bedrock batch inference."
+  type        = bool
+  default     = false
+}
+
+variable "batch_inference_min_files" {
+  description = "Minimum number of files for a job to be routed to Bedrock batch inference. Values under 100, the Bedrock minimum of records per batch job, are raised to 100."
+  type        = number
+  default     = 100
+}
+
+variable "fanout_min_files" {
+  description = "Jobs with at least this many files are split into one queue message per file. 0 disables the fan-out."
+  type        = number
+  default     = 0
+}
+
+variable "rate_limit_requests_per_minute" {
+  description = "Bedrock requests per minute shared by all inference workers."
+  type        = number
+  default     = 50
+}
+
+variable "rate_limit_tokens_per_minute" {
+  description = "Bedrock tokens per minute shared by all inference workers."
+  type        = number
+  default     = 200000
+}
@@ -34,6 +34,7 @@ class Config:
         "n'utilise aucune balise supplémentaire."
     )
     MAX_BEDROCK_CALL_AMOUNT = 7
+    CONTINUATION_TAIL_CHARS = 2000
     INPUT_BUCKET = os.environ["INPUT_BUCKET"]
     OUTPUT_BUCKET = os.environ["OUTPUT_BUCKET"]
     SNS_TOPIC_ARN = os.environ["SNS_TOPIC_ARN"]
@@ -85,15 +86,74 @@ def send_sns_notification(file_info: Dict[str, Any], presigned_url: str) -> None
         raise
 
 
+# Each Lambda is packaged from its own directory, keep in sync with the copy in
+# lambdas/inference_job_handler/index.py
+class ResponseTagScanner:
+    """Incremental scanner of the <reponse></reponse> tags of a model output.
+
+    The output is fed as it is generated, in chunks of any size. Only the few
+    characters that may start a tag split across two chunks are carried over
+    to the next one, so each character is scanned once however long the output.
+    """
+
+    TAG = re.compile(r"<(/?)reponse>", re.IGNORECASE)
+    CARRY_CHARS = len("</reponse>") - 1
+
+    def __init__(self):
+        self.chunks = []
+        # Content of every closed <reponse> block
+        self.responses = []
+        self._current = []
+        self._carry = ""
+        self._inside = False
+
+    @property
+    def complete(self) -> bool:
+        """Whether a closing tag has been seen."""
+        return bool(self.responses)
+
+    @property
+    def output(self) -> str:
+        """Everything fed so far, tags included."""
+        return "".join(self.chunks)
+
+    def feed(self, text: str) -> bool:
+        """Consume the next chunk of output, True once a closing tag was seen."""
+        self.chunks.append(text)
+        data = self._carry + text
+        position = 0
+        for match in self.TAG.finditer(data):
+            closing = bool(match.group(1))
+            if self._inside and closing:
+                self._current.append(data[position : match.start()])
+                self.responses.append("".join(self._current))
+                self._current = []
+                self._inside = False
+            elif self._inside:
+                # Nested opening tag, kept as content
+                continue
+            elif closing:
+                # Closing tag without an opening one
+                self.responses.append("")
+            else:
+                self._inside = True
+            position = match.end()
+
+        keep = max(position, len(data) - self.CARRY_CHARS)
+        if self._inside:
+            self._current.append(data[position:keep])
+        self._carry = data[keep:]
+        return self.complete
+
+
 @tracer.capture_method
-def extract_formatted_response(text: str) -> Optional[str]:
-    """Extract content between <reponse> tags."""
-    if not text:
+def extract_formatted_response(scanner: ResponseTagScanner) -> Optional[str]:
+    """Extract content between <reponse> tags from the scanned output."""
+    if not scanner.output:
         logger.warning("Empty text provided for response extraction")
         return None
 
-    matches = re.finditer(r"<reponse>([\s\S]*?)</reponse>", text, re.IGNORECASE)
-    responses = [match.group(1).strip() for match in matches]
+    responses = [response.strip() for response in scanner.responses]
 
     if not responses:
         logger.warning("No response tags found in text")
@@ -123,17 +183,28 @@ def call_bedrock(
     model_id: str = Config.DEFAULT_MODEL,
     max_tokens: int = Config.DEFAULT_MAX_TOKENS,
     temperature: float = Config.DEFAULT_TEMPERATURE,
+    assistant_prefix: Optional[str] = None,
 ) -> str:
-    """Call Bedrock API with the given parameters."""
+    """Call Bedrock API with the given parameters.
+
+    When assistant_prefix is given, the assistant turn is prefilled with it and
+    the model continues the text from there.
+    """
     try:
+        messages = [{"role": "user", "content": [{"type": "text", "text": user_input}]}]
+        if assistant_prefix:
+            messages.append(
+                {
+                    "role": "assistant",
+                    "content": [{"type": "text", "text": assistant_prefix}],
+                }
+            )
         request_body = {
             "anthropic_version": "bedrock-2023-05-31",
             "max_tokens": max_tokens,
             "temperature": temperature,
             "system": system_prompt,
-            "messages": [
-                {"role": "user", "content": [{"type": "text", "text": user_input}]}
-            ],
+            "messages": messages,
         }
 
         metrics.add_metric(name="BedrockAPICall", unit=MetricUnit.Count, value=1)
@@ -177,10 +248,13 @@ def process_file(bucket: str, key: str) -> Dict[str, Any]:
         system_prompt = user_prompt + Config.INSTRUCTIONS
 
         output = file_content
+        scanner = ResponseTagScanner()
         call_count = 0
         valid_response = False
 
-        # Loop for Bedrock API calls
+        # Loop for Bedrock API calls. Continuations resend the file with only
+        # the tail of the generated text as an assistant prefill, instead of
+        # everything generated so far.
         while call_count < Config.MAX_BEDROCK_CALL_AMOUNT and not valid_response:
             with tracer.provider.in_subsegment("bedrock_call") as subsegment:
                 logger.info(f"Bedrock API call attempt {call_count + 1}")
@@ -188,20 +262,25 @@ def process_file(bucket: str, key: str) -> Dict[str, Any]:
 
                 bedrock_response = call_bedrock(
                     system_prompt,
-                    output,
+                    file_content,
                     Config.DEFAULT_MODEL,
+                    assistant_prefix="".join(scanner.chunks[-2:])[
+                        -Config.CONTINUATION_TAIL_CHARS :
+                    ].rstrip(),
                 )
-                output += bedrock_response
                 call_count += 1
 
-                extracted_response = extract_formatted_response(output)
-                if extracted_response:
-                    valid_response = True
-                    output = extracted_response
+                # Only the new text is scanned, the loop stops at the closing tag
+                if scanner.feed(bedrock_response):
+                    extracted_response = extract_formatted_response(scanner)
+                    if extracted_response:
+                        valid_response = True
+                        output = extracted_response
 
                 logger.info(f"Bedrock API call attempt {call_count}")
 
         if not valid_response:
+            output = file_content + scanner.output
             logger.warning(
                 f"Failed to get valid response for {key} after "
                 f"{Config.MAX_BEDROCK_CALL_AMOUNT} attempts"
@@ -20,6 +20,21 @@
     type = "S"
   }
 
+  attribute {
+    name = "content_hash"
+    type = "S"
+  }
+
+  attribute {
+    name = "last_modified"
+    type = "N"
+  }
+
+  attribute {
+    name = "filename"
+    type = "S"
+  }
+
   # Optional: Point-in-time recovery
   point_in_time_recovery {
     enabled = true
@@ -32,6 +47,31 @@
     projection_type = "ALL"
   }
 
+  # File listing, most recently uploaded first
+  global_secondary_index {
+    name            = "LastModifiedIndex"
+    hash_key        = "user_id"
+    range_key       = "last_modified"
+    projection_type = "ALL"
+  }
+
+  # Finds the files sharing a stored content, to deduplicate uploads
+  global_secondary_index {
+    name               = "ContentHashIndex"
+    hash_key           = "user_id"
+    range_key          = "content_hash"
+    projection_type    = "INCLUDE"
+    non_key_attributes = ["object_key", "size", "stored_size"]
+  }
+
+  # Files are identified by their content, this finds them by name
+  global_secondary_index {
+    name            = "FilenameIndex"
+    hash_key        = "user_id"
+    range_key       = "filename"
+    projection_type = "KEYS_ONLY"
+  }
+
   tags = {
     Environment = var.environment
     Project     = var.project_name
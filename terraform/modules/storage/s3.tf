@@ -16,6 +16,32 @@ module "file_process_output" {
   block_public_policy     = true
   ignore_public_acls      = true
   restrict_public_buckets = true
+
+  # Content-addressed inference results reused across jobs
+  lifecycle_rule = [
+    {
+      id      = "result-cache-expiration"
+      enabled = true
+      filter = {
+        prefix = "cache/"
+      }
+      expiration = {
+        days = var.result_cache_ttl_days
+      }
+    },
+    # ZIP archives of job results, rebuilt on demand once expired
+    {
+      id      = "job-export-expiration"
+      enabled = true
+      filter = {
+        prefix = "exports/"
+      }
+      expiration = {
+        days = var.job_export_ttl_days
+      }
+      abort_incomplete_multipart_upload_days = 1
+    }
+  ]
 }
 
 module "user_files_storage" {
@@ -27,6 +53,36 @@ module "user_files_storage" {
     enabled = true
   }
 
+  # Deleted files release their object, jobs created earlier may still read it
+  lifecycle_rule = [
+    {
+      id      = "unreferenced-file-expiration"
+      enabled = true
+      filter = {
+        tags = {
+          unreferenced = "true"
+        }
+      }
+      expiration = {
+        days = var.unreferenced_file_ttl_days
+      }
+      noncurrent_version_expiration = {
+        days = 1
+      }
+    }
+  ]
+
+  # Browsers upload directly to the bucket with presigned URLs
+  cors_rule = [
+    {
+      allowed_methods = ["PUT"]
+      allowed_origins = ["*"]
+      allowed_headers = ["*"]
+      expose_headers  = ["ETag"]
+      max_age_seconds = 3000
+    }
+  ]
+
   block_public_acls       = true
   block_public_policy     = true
   ignore_public_acls      = true
@@ -7,3 +7,21 @@ variable "project_name" {
   type     = string
   nullable = false
 }
+
+variable "result_cache_ttl_days" {
+  description = "Number of days a cached inference result is kept before expiring."
+  type        = number
+  default     = 7
+}
+
+variable "job_export_ttl_days" {
+  description = "Number of days a ZIP export of a job is kept before expiring."
+  type        = number
+  default     = 7
+}
+
+variable "unreferenced_file_ttl_days" {
+  description = "Number of days an uploaded object no file uses anymore is kept, so queued and running jobs can still read it."
+  type        = number
+  default     = 7
+}
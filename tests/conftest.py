@@ -0,0 +1,51 @@
+"""Fixtures running the Lambdas in process against moto.
+
+The resources and API Gateway events come from the offline benchmark so that
+tests and benchmarks exercise the same setup:
+
+    pip install -r benchmarks/requirements.txt pytest
+    python -m pytest tests
+"""
+
+import argparse
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import bench  # noqa: E402
+
+bench.configure_environment(argparse.Namespace(throttle_rate=0, set=[]))
+
+
+@pytest.fixture
+def aws():
+    from moto import mock_aws
+
+    with mock_aws():
+        bench.create_resources()
+        yield
+
+
+@pytest.fixture
+def router(aws):
+    return bench.load_module(bench.ROUTER_PATH, "api_router")
+
+
+@pytest.fixture
+def worker(aws):
+    return bench.load_module(bench.WORKER_PATH, "inference_job_handler")
+
+
+@pytest.fixture
+def call_router(router):
+    """Invoke the router handler, with the same arguments as bench.api_event."""
+
+    def call(method, path, body=None, query=None):
+        return call.event(bench.api_event(method, path, body, query))
+
+    call.event = lambda event: bench.invoke(router.lambda_handler, event, "router")
+    return call
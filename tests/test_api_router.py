@@ -0,0 +1,385 @@
+import hashlib
+import io
+import json
+import os
+import time
+import zipfile
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+import bench
+
+
+def put_job(router, **attributes):
+    job = {
+        "user_id": bench.USER_ID,
+        "job_id": "job-1",
+        "job_status": "PROCESSING",
+        "created_at": int(time.time()) - 60,
+        "updated_at": int(time.time()),
+        "input_files": [{"file_id": "f1", "filename": "a.txt"}],
+        **attributes,
+    }
+    router.job_table().put_item(Item=job)
+    return job
+
+
+def test_get_job_returns_cors_headers_and_numbers(router, call_router):
+    put_job(
+        router,
+        job_status="COMPLETED",
+        started_at=int(time.time()) - 30,
+        file_count=1,
+        completed_files=1,
+        input_tokens=1200,
+        bedrock_latency_ms=850,
+    )
+
+    response = call_router("GET", "/jobs/job-1")
+
+    assert response["statusCode"] == 200
+    assert response["multiValueHeaders"]["Access-Control-Allow-Origin"] == ["*"]
+    detail = json.loads(response["body"])
+    assert detail["elapsed_seconds"] == 30
+    for field in (
+        "created_at",
+        "updated_at",
+        "started_at",
+        "elapsed_seconds",
+        "file_count",
+        "completed_files",
+        "input_tokens",
+        "bedrock_latency_ms",
+    ):
+        assert isinstance(detail[field], int), field
+
+
+def test_get_job_unknown_job(call_router):
+    response = call_router("GET", "/jobs/missing")
+
+    assert response["statusCode"] == 404
+
+
+def upload(call_router, filename, content):
+    event = bench.api_event("POST", "/files")
+    event["headers"] = {"filename": filename, "content-type": "text/plain"}
+    event["body"] = content
+    return call_router.event(event)
+
+
+def stored_keys(router):
+    response = router.s3_client().list_objects_v2(Bucket=bench.INPUT_BUCKET)
+    return [obj["Key"] for obj in response.get("Contents", [])]
+
+
+def object_tags(router, key):
+    return router.s3_client().get_object_tagging(Bucket=bench.INPUT_BUCKET, Key=key)[
+        "TagSet"
+    ]
+
+
+def test_same_content_under_two_names_shares_one_object(router, call_router):
+    first = json.loads(upload(call_router, "a.txt", "same content")["body"])
+    second = json.loads(upload(call_router, "b.txt", "same content")["body"])
+
+    assert first["file_id"] != second["file_id"]
+    assert first["object_key"] == second["object_key"]
+    files = json.loads(call_router("GET", "/files")["body"])
+    assert sorted(file["filename"] for file in files) == ["a.txt", "b.txt"]
+    assert stored_keys(router) == [first["object_key"]]
+
+    call_router("DELETE", f"/files/{first['file_id']}")
+    assert object_tags(router, first["object_key"]) == []
+    call_router("DELETE", f"/files/{second['file_id']}")
+    # Jobs may still read the object, the lifecycle rule expires it
+    assert stored_keys(router) == [first["object_key"]]
+    assert object_tags(router, first["object_key"]) == [router.UNREFERENCED_OBJECT_TAG]
+
+    third = json.loads(upload(call_router, "c.txt", "same content")["body"])
+    assert third["object_key"] == first["object_key"]
+    assert object_tags(router, first["object_key"]) == []
+
+
+def test_upload_under_same_name_keeps_both_contents(router, call_router):
+    first = json.loads(upload(call_router, "a.txt", "first")["body"])
+    second = json.loads(upload(call_router, "a.txt", "second")["body"])
+
+    assert first["file_id"] != second["file_id"]
+    files = json.loads(call_router("GET", "/files")["body"])
+    assert sorted(file["file_id"] for file in files) == sorted(
+        [first["file_id"], second["file_id"]]
+    )
+    assert sorted(stored_keys(router)) == sorted(
+        [first["object_key"], second["object_key"]]
+    )
+
+
+def test_check_files_reports_name_and_content(call_router):
+    upload(call_router, "a.txt", "same content")
+    content_hash = hashlib.sha256(b"same content").hexdigest()
+
+    response = call_router(
+        "POST",
+        "/files/check",
+        body={
+            "files": [
+                {"sha256": content_hash, "filename": "a.txt"},
+                {"sha256": content_hash, "filename": "b.txt"},
+                {"sha256": hashlib.sha256(b"new").hexdigest(), "filename": "a.txt"},
+            ]
+        },
+    )
+
+    checks = json.loads(response["body"])["files"]
+    assert [check["exists"] for check in checks] == [True, False, False]
+    assert [check["content_exists"] for check in checks] == [True, True, False]
+    assert [check["name_conflicts"] for check in checks] == [
+        [],
+        [],
+        [checks[0]["file_id"]],
+    ]
+
+
+def direct_upload(call_router, filename, content, sha256, checksum_headers=True):
+    initiation = json.loads(
+        call_router(
+            "POST",
+            "/files/uploads",
+            body={"filename": filename, "size": len(content), "sha256": sha256},
+        )["body"]
+    )
+    # The URL is signed for the default content type
+    requests.put(
+        initiation["upload_url"],
+        data=content,
+        headers={
+            "Content-Type": "application/octet-stream",
+            **(initiation["upload_headers"] if checksum_headers else {}),
+        },
+    )
+    return call_router(
+        "POST",
+        "/files/uploads/complete",
+        body={
+            "file_id": initiation["file_id"],
+            "filename": filename,
+            "sha256": sha256,
+        },
+    )
+
+
+def test_direct_upload_with_matching_sha256(router, call_router):
+    content_hash = hashlib.sha256(b"content").hexdigest()
+
+    response = direct_upload(call_router, "a.txt", b"content", content_hash)
+
+    assert response["statusCode"] == 200
+    assert json.loads(response["body"])["content_hash"] == content_hash
+
+
+def test_direct_upload_rejects_content_without_matching_checksum(router, call_router):
+    content_hash = hashlib.sha256(b"announced").hexdigest()
+
+    # S3 itself rejects a body that does not match the signed checksum, this
+    # covers an object stored without that checksum
+    response = direct_upload(
+        call_router, "a.txt", b"something else", content_hash, checksum_headers=False
+    )
+
+    assert response["statusCode"] == 400
+    assert json.loads(call_router("GET", "/files")["body"]) == []
+    (key,) = stored_keys(router)
+    assert object_tags(router, key) == [router.UNREFERENCED_OBJECT_TAG]
+
+
+def test_download_of_running_job_needs_a_result(router, call_router):
+    put_job(router)
+
+    response = call_router("GET", "/jobs/job-1/download/f1")
+    assert response["statusCode"] == 404
+
+    router.s3_client().put_object(
+        Bucket=bench.OUTPUT_BUCKET,
+        Key=f"{bench.USER_ID}/job-1/f1_result.partial.txt",
+        Body=b"partial",
+    )
+    response = call_router("GET", "/jobs/job-1/download/f1")
+    assert response["statusCode"] == 200
+    assert json.loads(response["body"])["partial"] is True
+
+
+def test_list_files_newest_first(router, call_router, monkeypatch):
+    for timestamp, filename in ((100, "old.txt"), (300, "new.txt"), (200, "mid.txt")):
+        monkeypatch.setattr(router.time, "time", lambda: timestamp)
+        upload(call_router, filename, filename)
+
+    files = json.loads(call_router("GET", "/files")["body"])
+    assert [file["filename"] for file in files] == ["new.txt", "mid.txt", "old.txt"]
+
+    page = json.loads(call_router("GET", "/files", query={"limit": "2"})["body"])
+    assert [file["filename"] for file in page["items"]] == ["new.txt", "mid.txt"]
+    page = json.loads(
+        call_router(
+            "GET", "/files", query={"limit": "2", "next_token": page["next_token"]}
+        )["body"]
+    )
+    assert [file["filename"] for file in page["items"]] == ["old.txt"]
+
+
+def test_export_is_built_by_the_worker(router, worker, call_router):
+    file = json.loads(upload(call_router, "a/b.txt", "entrée")["body"])
+    put_job(router, job_status="COMPLETED", input_files=[file])
+    router.s3_client().put_object(
+        Bucket=bench.OUTPUT_BUCKET,
+        Key=f"{bench.USER_ID}/job-1/{file['file_id']}_result.txt",
+        Body="<reponse>résultat</reponse>".encode("utf-8"),
+    )
+    query = {"include_inputs": "true"}
+
+    # Polling before the build queues it only once
+    for _ in range(2):
+        response = call_router("GET", "/jobs/job-1/export", query=query)
+        assert response["statusCode"] == 202
+        assert json.loads(response["body"])["status"] == "PENDING"
+    sqs = router.sqs_client()
+    messages = sqs.receive_message(
+        QueueUrl=os.environ["INFERENCE_QUEUE_URL"], MaxNumberOfMessages=10
+    )["Messages"]
+    assert len(messages) == 1
+
+    bench.invoke(worker.lambda_handler, bench.sqs_event(messages), "worker")
+
+    response = call_router("GET", "/jobs/job-1/export", query=query)
+    assert response["statusCode"] == 200
+    assert "download_url" in json.loads(response["body"])
+    archive = router.s3_client().get_object(
+        Bucket=bench.OUTPUT_BUCKET,
+        Key=f"exports/{bench.USER_ID}/job-1/results-inputs.zip",
+    )["Body"]
+    with zipfile.ZipFile(io.BytesIO(archive.read())) as export:
+        assert export.namelist() == [
+            f"results/{file['file_id']}_a_b.txt_result.txt",
+            f"inputs/{file['file_id']}_a_b.txt",
+        ]
+        assert export.read(export.namelist()[0]).decode() == (
+            "<reponse>résultat</reponse>"
+        )
+        assert export.read(export.namelist()[1]).decode() == "entrée"
+
+
+def put_file_items(router, count):
+    with router.metadata_table().batch_writer() as batch:
+        for index in range(count):
+            batch.put_item(Item={"user_id": bench.USER_ID, "file_id": f"f{index}"})
+
+
+def test_retrieve_files_keeps_the_requested_order_without_duplicates(router):
+    put_file_items(router, 150)
+    # More keys than one BatchGetItem call takes, with duplicates and an unknown id
+    file_ids = [f"f{index}" for index in reversed(range(150))] + ["f3", "missing"]
+
+    files = router.retrieve_files(bench.USER_ID, file_ids)
+
+    assert [file["file_id"] for file in files] == file_ids[:150]
+
+
+class UnprocessingDynamoDB:
+    """DynamoDB client answering the last keys of a request as unprocessed."""
+
+    def __init__(self, client, unprocessed_calls):
+        self.client = client
+        self.unprocessed_calls = unprocessed_calls
+        self.calls = 0
+
+    def batch_get_item(self, RequestItems):
+        self.calls += 1
+        if self.calls > self.unprocessed_calls:
+            return self.client.batch_get_item(RequestItems=RequestItems)
+        ((table_name, request),) = RequestItems.items()
+        processed, unprocessed = request["Keys"][:-1], request["Keys"][-1:]
+        response = {"Responses": {}}
+        if processed:
+            response = self.client.batch_get_item(
+                RequestItems={table_name: {"Keys": processed}}
+            )
+        response["UnprocessedKeys"] = {table_name: {"Keys": unprocessed}}
+        return response
+
+
+def test_unprocessed_keys_are_retried(router, monkeypatch):
+    put_file_items(router, 3)
+    client = UnprocessingDynamoDB(router.dynamodb().meta.client, 2)
+    monkeypatch.setattr(
+        router, "dynamodb", lambda: SimpleNamespace(meta=SimpleNamespace(client=client))
+    )
+    monkeypatch.setattr(router.time, "sleep", lambda seconds: None)
+
+    files = router.retrieve_files(bench.USER_ID, ["f0", "f1", "f2"])
+
+    assert client.calls == 3
+    assert [file["file_id"] for file in files] == ["f0", "f1", "f2"]
+
+
+def test_keys_left_unprocessed_fail_the_request(router, monkeypatch):
+    put_file_items(router, 3)
+    client = UnprocessingDynamoDB(
+        router.dynamodb().meta.client, router.BATCH_GET_MAX_ATTEMPTS
+    )
+    monkeypatch.setattr(
+        router, "dynamodb", lambda: SimpleNamespace(meta=SimpleNamespace(client=client))
+    )
+    monkeypatch.setattr(router.time, "sleep", lambda seconds: None)
+
+    with pytest.raises(router.ServiceError) as error:
+        router.retrieve_files(bench.USER_ID, ["f0", "f1", "f2"])
+    assert error.value.status_code == 503
+    assert client.calls == router.BATCH_GET_MAX_ATTEMPTS
+
+
+def test_job_pages_follow_next_token_to_the_end(router, call_router):
+    for index in range(5):
+        put_job(router, job_id=f"job-{index}", created_at=1000 + index)
+
+    job_ids = []
+    query = {"limit": "2", "view": "summary"}
+    while True:
+        response = call_router("GET", "/jobs", query=query)
+        assert response["statusCode"] == 200
+        page = json.loads(response["body"])
+        assert all(
+            set(job) <= set(router.JOB_SUMMARY_ATTRIBUTES) for job in page["items"]
+        )
+        job_ids.extend(job["job_id"] for job in page["items"])
+        if not page["next_token"]:
+            break
+        query["next_token"] = page["next_token"]
+
+    assert job_ids == [f"job-{index}" for index in reversed(range(5))]
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        {"limit": "0"},
+        {"limit": "1001"},
+        {"limit": "dix"},
+        {"next_token": "pas un jeton"},
+        {"view": "detail"},
+    ],
+)
+def test_invalid_page_parameters_are_rejected(call_router, query):
+    response = call_router("GET", "/jobs", query=query)
+
+    assert response["statusCode"] == 400
+
+
+def test_next_token_of_another_user_is_rejected(router, call_router):
+    next_token = router.encode_next_token(
+        {"user_id": "other-user", "job_id": "job-1", "created_at": 1000}
+    )
+
+    response = call_router("GET", "/files", query={"next_token": next_token})
+
+    assert response["statusCode"] == 400
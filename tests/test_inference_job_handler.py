@@ -0,0 +1,829 @@
+import ast
+import gzip
+import io
+import json
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from botocore.exceptions import ClientError
+
+import bench
+
+
+def test_partial_preview_is_cut_on_a_character_boundary(worker, monkeypatch):
+    monkeypatch.setattr(worker.Config, "PARTIAL_PREVIEW_MAX_BYTES", 5)
+    writer = worker.ResultStreamWriter(
+        bench.OUTPUT_BUCKET, "result.txt", "result.partial.txt"
+    )
+
+    writer.write("abcdé")
+    writer.write("éèà")
+    writer._flush_preview()
+
+    preview = (
+        worker.s3_client()
+        .get_object(Bucket=bench.OUTPUT_BUCKET, Key="result.partial.txt")["Body"]
+        .read()
+    )
+    assert preview.decode("utf-8") == "abcd"
+    writer.abort()
+
+
+class ScriptedBedrock:
+    """bedrock-runtime stand-in answering each call with the next reply."""
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.requests = []
+
+    def converse(self, messages, **kwargs):
+        for message in messages:
+            if message["role"] == "assistant" and not message["content"][0]["text"]:
+                # What Converse answers to an empty assistant block
+                raise ClientError(
+                    {"Error": {"Code": "ValidationException", "Message": "blank"}},
+                    "Converse",
+                )
+        self.requests.append(messages)
+        return {
+            "output": {
+                "message": {
+                    "role": "assistant",
+                    "content": [{"text": self.replies.pop(0)}],
+                }
+            },
+            "usage": {"inputTokens": 10, "outputTokens": 10, "totalTokens": 20},
+            "metrics": {"latencyMs": 1},
+            "stopReason": "max_tokens",
+        }
+
+
+def test_continuation_after_blank_replies_resumes_from_earlier_output(worker):
+    bedrock = ScriptedBedrock(["<reponse>Bonjour", " ", "\n", " le monde</reponse>"])
+    worker.bedrock_client = lambda: bedrock
+
+    output, complete = worker.run_conversation("system", "input")
+
+    assert output == "<reponse>Bonjour \n le monde</reponse>"
+    assert complete
+    assert bedrock.requests[3][-1]["content"][0]["text"] == "<reponse>Bonjour"
+
+
+def test_blank_output_stops_the_continuation(worker):
+    bedrock = ScriptedBedrock([" ", "never sent"])
+    worker.bedrock_client = lambda: bedrock
+
+    worker.run_conversation("system", "input")
+
+    assert len(bedrock.requests) == 1
+
+
+def test_continuation_stops_at_the_conversation_token_budget(worker, monkeypatch):
+    # Each scripted call uses 20 tokens
+    monkeypatch.setattr(worker.Config, "MAX_TOTAL_TOKENS", 50)
+    bedrock = ScriptedBedrock(["<reponse>un", " deux", " trois", " quatre"])
+    worker.bedrock_client = lambda: bedrock
+
+    output, complete = worker.run_conversation("system", "input")
+
+    assert len(bedrock.requests) == 2
+    assert (output, complete) == ("<reponse>un deux", False)
+
+
+def sqs_record(worker, body, queue_arn):
+    return worker.SQSRecord(
+        {
+            "messageId": "1",
+            "body": json.dumps(body),
+            "attributes": {"ApproximateReceiveCount": "1"},
+            "eventSourceARN": queue_arn,
+        }
+    )
+
+
+def test_dead_lettered_job_is_marked_failed(worker, monkeypatch):
+    dead_letter_queue = "arn:aws:sqs:us-east-1:123456789012:inference-dlq"
+    monkeypatch.setattr(worker.Config, "DEAD_LETTER_QUEUE_ARN", dead_letter_queue)
+    files = [{"file_id": "f1"}, {"file_id": "f2"}]
+    worker.job_table().put_item(
+        Item={"user_id": "u", "job_id": "j", "job_status": "PENDING"}
+    )
+    # The first delivery checkpointed f1, then every delivery timed out on f2
+    worker.start_job_checkpoints("u", "j", len(files), execution_mode="DIRECT")
+    worker.record_file_result("u", "j", {"file_id": "f1", "status": "COMPLETED"})
+
+    worker.record_handler(
+        sqs_record(
+            worker,
+            {"user_id": "u", "job_id": "j", "prompt": "p", "input_files": files},
+            dead_letter_queue,
+        )
+    )
+
+    job = worker.job_table().get_item(Key={"user_id": "u", "job_id": "j"})["Item"]
+    assert job["job_status"] == "COMPLETED"
+    assert job["completed_files"] == 1
+    assert [file["file_id"] for file in job["failed_files"]] == ["f2"]
+
+
+def test_batch_inference_needs_the_service_minimum_of_records(worker, monkeypatch):
+    monkeypatch.setattr(worker.Config, "BATCH_INFERENCE_ROLE_ARN", "arn:role")
+    # Large enough in tokens to be routed on size alone
+    monkeypatch.setattr(worker.Config, "BATCH_INFERENCE_MIN_TOKENS", 1)
+
+    def files(count):
+        return [{"file_id": f"f{i}", "size": 10_000} for i in range(count)]
+
+    assert not worker.should_use_batch_inference(files(99))
+    assert worker.should_use_batch_inference(files(100))
+
+
+def test_batch_inference_file_threshold_is_clamped(aws, monkeypatch):
+    monkeypatch.setenv("BATCH_INFERENCE_MIN_FILES", "10")
+
+    worker = bench.load_module(bench.WORKER_PATH, "inference_job_handler")
+
+    assert worker.Config.BATCH_INFERENCE_MIN_FILES == 100
+
+
+class FinishedBatchJobs:
+    """Bedrock control plane stand-in whose batch jobs have all completed."""
+
+    def __init__(self, output_uri):
+        self.output_uri = output_uri
+
+    def get_model_invocation_job(self, jobIdentifier):
+        return {
+            "status": "Completed",
+            "outputDataConfig": {"s3OutputDataConfig": {"s3Uri": self.output_uri}},
+        }
+
+
+def finish_batch_job(worker, records):
+    prefix = f"{worker.Config.BATCH_INFERENCE_PREFIX}u/j/output/"
+    worker.job_table().put_item(
+        Item={
+            "user_id": "u",
+            "job_id": "j",
+            "job_status": "PROCESSING",
+            "input_files": [{"file_id": "f1"}, {"file_id": "f2"}],
+        }
+    )
+    worker.s3_client().put_object(
+        Bucket=bench.OUTPUT_BUCKET,
+        Key=f"{prefix}job-j/input.jsonl.out",
+        Body="\n".join(json.dumps(record) for record in records).encode("utf-8"),
+    )
+    batch_client = FinishedBatchJobs(f"s3://{bench.OUTPUT_BUCKET}/{prefix}")
+    worker.bedrock_batch_client = lambda: batch_client
+
+    worker.handle_batch_job_state_change("arn:batch-job")
+    return worker.job_table().get_item(Key={"user_id": "u", "job_id": "j"})["Item"]
+
+
+def test_batch_files_without_output_record_fail(worker):
+    job = finish_batch_job(
+        worker,
+        [
+            {
+                "recordId": "f1",
+                "modelOutput": {"content": [{"text": "<reponse>ok</reponse>"}]},
+            }
+        ],
+    )
+
+    assert job["job_status"] == "COMPLETED"
+    assert [file["file_id"] for file in job["failed_files"]] == ["f2"]
+
+
+def test_batch_job_without_output_records_fails(worker):
+    job = finish_batch_job(worker, [])
+
+    assert job["job_status"] == "ERROR"
+
+
+def test_batch_jobs_of_other_applications_are_ignored(worker):
+    for output_uri in (
+        "s3://someone-elses-bucket/batch/u/j/output/",
+        f"s3://{bench.OUTPUT_BUCKET}/exports/u/j/output/",
+        f"s3://{bench.OUTPUT_BUCKET}/batch/output/",
+    ):
+        batch_client = FinishedBatchJobs(output_uri)
+        worker.bedrock_batch_client = lambda: batch_client
+
+        worker.handle_batch_job_state_change("arn:batch-job")
+
+    assert worker.job_table().scan()["Items"] == []
+
+
+class StreamingBedrock:
+    """bedrock-runtime stand-in streaming one reply in the given deltas."""
+
+    def __init__(self, deltas):
+        self.deltas = deltas
+        self.stream = None
+
+    def converse_stream(self, **kwargs):
+        self.stream = bench.SimulatedEventStream(
+            {"contentBlockDelta": {"delta": {"text": delta}}} for delta in self.deltas
+        )
+        self.stream.append(
+            {
+                "metadata": {
+                    "usage": {"inputTokens": 1, "outputTokens": 1, "totalTokens": 2},
+                    "metrics": {"latencyMs": 1},
+                }
+            }
+        )
+        return {"stream": self.stream}
+
+
+def test_stream_is_closed_after_the_closing_tag(worker):
+    bedrock = StreamingBedrock(["<reponse>Bon", "jour</rep", "onse>", " et la suite"])
+    worker.bedrock_client = lambda: bedrock
+    received = []
+
+    output, _ = worker.run_conversation("system", "input", on_text=received.append)
+
+    assert output == "<reponse>Bonjour</reponse>"
+    assert received == ["<reponse>Bon", "jour</rep", "onse>"]
+    assert bedrock.stream.closed
+
+
+def test_response_tag_scanner_copies_are_identical():
+    def scanner_source(path):
+        with open(path, encoding="utf-8-sig") as source:
+            tree = ast.parse(source.read())
+        return next(
+            ast.dump(node)
+            for node in tree.body
+            if isinstance(node, ast.ClassDef) and node.name == "ResponseTagScanner"
+        )
+
+    plan_b = os.path.join(
+        bench.ROOT, "terraform", "modules", "plan_b", "src", "index.py"
+    )
+    assert scanner_source(bench.WORKER_PATH) == scanner_source(plan_b)
+
+
+def limiter_rate(worker):
+    item = (
+        worker.dynamodb()
+        .Table(bench.RATE_LIMITER_TABLE)
+        .get_item(Key={"limiter_id": "model"})["Item"]
+    )
+    return float(item["rate"])
+
+
+def test_acquire_keeps_a_concurrent_rate_decrease(worker):
+    limiter = worker.BedrockRateLimiter(bench.RATE_LIMITER_TABLE, "model")
+    other_instance = worker.BedrockRateLimiter(bench.RATE_LIMITER_TABLE, "model")
+    limiter.acquire(1)
+    rate = limiter_rate(worker)
+    load = limiter._load
+
+    def load_then_throttle():
+        state = load()
+        other_instance.on_throttle()
+        return state
+
+    limiter._load = load_then_throttle
+    limiter.acquire(1)
+
+    assert limiter_rate(worker) == rate * worker.Config.RATE_LIMIT_DECREASE_FACTOR
+
+
+class FakeClock:
+    """Stands in for the time module, sleeping only advances the clock."""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+        self.slept = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def test_acquire_paces_requests_and_tokens(worker, monkeypatch):
+    monkeypatch.setattr(worker, "time", FakeClock())
+    monkeypatch.setattr(worker.Config, "RATE_LIMIT_REQUESTS_PER_MINUTE", 60)
+    monkeypatch.setattr(worker.Config, "RATE_LIMIT_TOKENS_PER_MINUTE", 600)
+    # No jitter, waits are exactly the refill time
+    monkeypatch.setattr(worker.random, "uniform", lambda low, high: low)
+    limiter = worker.BedrockRateLimiter(bench.RATE_LIMITER_TABLE, "model")
+
+    # A burst of 10 seconds at one request and 10 tokens per second
+    assert [limiter.acquire(10) for _ in range(10)] == [0.0] * 10
+    assert limiter.acquire(10) == pytest.approx(1)
+    assert limiter.acquire(50) == pytest.approx(5)
+
+
+def test_throttles_halve_the_rate_and_successes_raise_it(worker):
+    limiter = worker.BedrockRateLimiter(bench.RATE_LIMITER_TABLE, "model")
+    limiter.acquire(1)
+    quota = worker.Config.RATE_LIMIT_REQUESTS_PER_MINUTE
+
+    limiter.on_success()
+    assert limiter_rate(worker) == quota
+
+    limiter.on_throttle()
+    assert limiter_rate(worker) == quota / 2
+    limiter.on_success()
+    assert limiter_rate(worker) == quota / 2 + worker.Config.RATE_LIMIT_INCREASE
+
+    for _ in range(30):
+        limiter.on_throttle()
+    assert limiter_rate(worker) == worker.Config.RATE_LIMIT_MIN_REQUESTS_PER_MINUTE
+
+
+class ThrottlingBedrock:
+    """bedrock-runtime stand-in failing the first calls with the given code."""
+
+    def __init__(self, failures, error_code="ThrottlingException"):
+        self.failures = failures
+        self.error_code = error_code
+        self.calls = 0
+
+    def converse(self, **kwargs):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise ClientError(
+                {"Error": {"Code": self.error_code, "Message": "slow down"}},
+                "Converse",
+            )
+        return {"output": {"message": {"content": [{"text": "ok"}]}}}
+
+
+@pytest.fixture
+def limiter(worker, monkeypatch):
+    limiter = worker.BedrockRateLimiter(bench.RATE_LIMITER_TABLE, "model")
+    monkeypatch.setattr(worker, "rate_limiter", lambda: limiter)
+    monkeypatch.setattr(worker, "time", FakeClock())
+    return limiter
+
+
+def test_throttled_calls_are_retried(worker, limiter):
+    bedrock = ThrottlingBedrock(failures=2)
+    quota = worker.Config.RATE_LIMIT_REQUESTS_PER_MINUTE
+
+    result = worker.call_with_rate_limit(bedrock.converse, 10)
+
+    assert result["output"]["message"]["content"][0]["text"] == "ok"
+    assert bedrock.calls == 3
+    assert len(worker.time.slept) == 2
+    assert limiter_rate(worker) == quota / 4 + worker.Config.RATE_LIMIT_INCREASE
+
+
+def test_throttled_calls_give_up_after_the_retries(worker, limiter):
+    bedrock = ThrottlingBedrock(failures=100)
+
+    with pytest.raises(ClientError):
+        worker.call_with_rate_limit(bedrock.converse, 10)
+
+    assert bedrock.calls == worker.Config.MAX_THROTTLE_RETRIES + 1
+
+
+def test_other_bedrock_errors_are_not_retried(worker, limiter):
+    bedrock = ThrottlingBedrock(failures=1, error_code="ValidationException")
+
+    with pytest.raises(ClientError):
+        worker.call_with_rate_limit(bedrock.converse, 10)
+
+    assert bedrock.calls == 1
+
+
+def read_output(worker, key):
+    return (
+        worker.s3_client()
+        .get_object(Bucket=bench.OUTPUT_BUCKET, Key=key)["Body"]
+        .read()
+        .decode("utf-8")
+    )
+
+
+def test_result_cache_miss_then_hit(worker):
+    bedrock = ScriptedBedrock(["<reponse>résumé</reponse>"])
+    worker.bedrock_client = lambda: bedrock
+
+    worker.process_file("contenu", "Résume", "job-1", "f1", bench.USER_ID)
+    worker.process_file("contenu", "Résume", "job-2", "f1", bench.USER_ID)
+
+    assert len(bedrock.requests) == 1
+    for job_id in ("job-1", "job-2"):
+        result = read_output(worker, f"{bench.USER_ID}/{job_id}/f1_result.txt")
+        assert result == "<reponse>résumé</reponse>"
+
+
+def test_truncated_result_is_not_cached(worker, monkeypatch):
+    monkeypatch.setattr(worker.Config, "MAX_BEDROCK_CALL_AMOUNT", 0)
+    bedrock = ScriptedBedrock(["<reponse>tronqu", "<reponse>complet</reponse>"])
+    worker.bedrock_client = lambda: bedrock
+
+    worker.process_file("contenu", "Résume", "job-1", "f1", bench.USER_ID)
+    worker.process_file("contenu", "Résume", "job-2", "f1", bench.USER_ID)
+
+    assert len(bedrock.requests) == 2
+    result = read_output(worker, f"{bench.USER_ID}/job-2/f1_result.txt")
+    assert result == "<reponse>complet</reponse>"
+    cache_key = worker.result_cache_key("contenu", "Résume")
+    assert read_output(worker, cache_key) == result
+
+
+def test_metrics_added_from_threads_are_all_flushed(worker, capsys):
+    def add_metrics(_):
+        for _ in range(250):
+            worker.metrics.add_metric(
+                name="ThreadedMetric", unit=worker.MetricUnit.Count, value=1
+            )
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(add_metrics, range(8)))
+    worker.metrics.flush_metrics()
+
+    values = []
+    for line in capsys.readouterr().out.splitlines():
+        # A metric with a single value is not written as a list
+        value = json.loads(line).get("ThreadedMetric", [])
+        values.extend(value if isinstance(value, list) else [value])
+    assert len(values) == 2000
+
+
+class EchoBedrock:
+    """bedrock-runtime stand-in answering with its input, safe across threads."""
+
+    def __init__(self):
+        self.requests = []
+
+    def converse(self, system, messages, **kwargs):
+        text = messages[0]["content"][0]["text"]
+        self.requests.append((system[0]["text"], text))
+        return {
+            "output": {
+                "message": {
+                    "role": "assistant",
+                    "content": [{"text": f"<reponse>{text}</reponse>"}],
+                }
+            },
+            "usage": {"inputTokens": 10, "outputTokens": 10, "totalTokens": 20},
+            "metrics": {"latencyMs": 1},
+            "stopReason": "end_turn",
+        }
+
+
+def test_text_within_the_window_is_a_single_chunk(worker):
+    text = "# Titre\n\nUn paragraphe."
+
+    assert worker.split_into_chunks(text, 100) == [text]
+
+
+def test_chunks_keep_sections_and_paragraphs_whole(worker):
+    sections = [f"## Section {index}\n" + "mot " * 20 for index in range(10)]
+    max_chars = int(70 * worker.Config.CHARS_PER_TOKEN)
+
+    chunks = worker.split_into_chunks("\n".join(sections), 70)
+
+    # Two sections fit in each window
+    assert len(chunks) == 5
+    assert all(len(chunk) <= max_chars for chunk in chunks)
+    assert [block for chunk in chunks for block in chunk.split("\n\n")] == sections
+
+
+def test_oversized_paragraph_falls_back_to_lines_then_characters(worker):
+    chunks = worker.split_into_chunks("court\n" + "x" * 100, 10)
+
+    # 10 tokens are 35 characters
+    assert chunks == ["court", "x" * 35, "x" * 35, "x" * 30]
+
+
+def test_chunk_outputs_are_reduced_into_one_response(worker):
+    bedrock = EchoBedrock()
+    worker.bedrock_client = lambda: bedrock
+
+    output, complete = worker.process_chunks("Résume", ["un", "deux"])
+
+    assert complete
+    assert len(bedrock.requests) == 3
+    reduce_system, reduce_input = bedrock.requests[-1]
+    assert worker.Config.REDUCE_INSTRUCTIONS in reduce_system
+    assert reduce_input == (
+        '<partie numero="1">\n<reponse>un</reponse>\n</partie>\n'
+        '<partie numero="2">\n<reponse>deux</reponse>\n</partie>'
+    )
+    assert output == f"<reponse>{reduce_input}</reponse>"
+
+
+def test_partial_outputs_too_large_to_reduce_are_concatenated(worker, monkeypatch):
+    monkeypatch.setattr(worker.Config, "CHUNK_MAX_TOKENS", 20)
+    bedrock = EchoBedrock()
+    worker.bedrock_client = lambda: bedrock
+    chunks = ["a" * 40, "b" * 40]
+
+    output, complete = worker.process_chunks("Résume", chunks)
+
+    assert complete
+    assert len(bedrock.requests) == 2
+    assert output == "\n\n".join(f"<reponse>{chunk}</reponse>" for chunk in chunks)
+
+
+def get_job(worker):
+    return worker.job_table().get_item(Key={"user_id": "u", "job_id": "j"})["Item"]
+
+
+def test_redelivered_file_results_are_counted_once(worker):
+    worker.start_job_checkpoints("u", "j", 2, execution_mode="FANOUT")
+    failure = {"file_id": "f2", "status": "ERROR", "error": "boom"}
+
+    for _ in range(2):
+        worker.record_file_result("u", "j", {"file_id": "f1", "status": "COMPLETED"})
+    job = get_job(worker)
+    assert (job["job_status"], job["completed_files"]) == ("PROCESSING", 1)
+
+    for _ in range(2):
+        worker.record_file_result("u", "j", failure)
+    job = get_job(worker)
+    assert job["job_status"] == "COMPLETED"
+    assert (job["completed_files"], job["failed_file_count"]) == (1, 1)
+    assert job["failed_files"] == [{"file_id": "f2", "error": "boom"}]
+    assert job["job_error"] == "f2: boom"
+
+
+def test_job_whose_files_all_failed_is_closed_in_error(worker):
+    worker.start_job_checkpoints("u", "j", 2, execution_mode="FANOUT")
+
+    for file_id in ("f1", "f2"):
+        worker.record_file_result(
+            "u", "j", {"file_id": file_id, "status": "ERROR", "error": "boom"}
+        )
+
+    assert get_job(worker)["job_status"] == "ERROR"
+
+
+def process_groups_in(worker, monkeypatch, duration):
+    def process_file_group(user_id, job_id, files, *args):
+        return [
+            {"file_id": file["file_id"], "status": "COMPLETED", "duration": duration}
+            for file in files
+        ]
+
+    monkeypatch.setattr(worker, "process_file_group", process_file_group)
+
+
+def continuation_messages(worker):
+    response = worker.sqs_client().receive_message(
+        QueueUrl=os.environ["INFERENCE_QUEUE_URL"], MaxNumberOfMessages=10
+    )
+    return [json.loads(message["Body"]) for message in response.get("Messages", [])]
+
+
+def test_files_not_started_before_the_timeout_are_continued(worker, monkeypatch):
+    process_groups_in(worker, monkeypatch, 1.0)
+    worker.start_job_checkpoints("u", "j", 4)
+    groups = [[{"file_id": f"f{index}"}] for index in range(4)]
+    # Enough time for two files, then less than the safety margin
+    remaining = iter([600_000, 600_000, 60_000])
+
+    results = worker.process_job_files(
+        "u", "j", groups, "p", 4, remaining_time=lambda: next(remaining)
+    )
+
+    assert sorted(result["file_id"] for result in results) == ["f0", "f1"]
+    (message,) = continuation_messages(worker)
+    assert [file["file_id"] for file in message["input_files"]] == ["f2", "f3"]
+    assert (message["total_files"], message["continuation"]) == (4, True)
+    assert get_job(worker)["completed_files"] == 2
+
+
+def test_time_reserve_grows_with_the_longest_file(worker, monkeypatch):
+    monkeypatch.setattr(worker.Config, "MAX_CONCURRENT_FILES", 1)
+    # Longer than the remaining time, which is above the safety margin
+    process_groups_in(worker, monkeypatch, 200.0)
+    worker.start_job_checkpoints("u", "j", 3)
+    groups = [[{"file_id": f"f{index}"}] for index in range(3)]
+
+    results = worker.process_job_files(
+        "u", "j", groups, "p", 3, remaining_time=lambda: 150_000
+    )
+
+    assert [result["file_id"] for result in results] == ["f0"]
+    (message,) = continuation_messages(worker)
+    assert [file["file_id"] for file in message["input_files"]] == ["f1", "f2"]
+
+
+def put_object(worker, bucket, key, body, **kwargs):
+    worker.s3_client().put_object(Bucket=bucket, Key=key, Body=body, **kwargs)
+
+
+def read_object_bytes(worker, key):
+    return (
+        worker.s3_client()
+        .get_object(Bucket=bench.OUTPUT_BUCKET, Key=key)["Body"]
+        .read()
+    )
+
+
+def test_job_export_archives_results_and_inputs(worker, monkeypatch):
+    # Results over 16 bytes are streamed instead of prefetched
+    monkeypatch.setattr(worker.Config, "EXPORT_PREFETCH_MAX_SIZE", 16)
+    # Incompressible and larger than a part, the archive is uploaded in two parts
+    large = os.urandom(6 * 1024 * 1024)
+    job = {
+        "job_id": "j",
+        "input_files": [
+            {"file_id": "f1", "filename": "dossier/a.txt", "object_key": "u/shared"},
+            {"file_id": "f2", "filename": "a.txt"},
+            {"file_id": "f3", "filename": "absent.txt"},
+        ],
+    }
+    put_object(
+        worker,
+        bench.OUTPUT_BUCKET,
+        "u/j/f1_result.txt",
+        gzip.compress("<reponse>compressé</reponse>".encode()),
+        ContentEncoding="gzip",
+    )
+    put_object(worker, bench.OUTPUT_BUCKET, "u/j/f2_result.txt", large)
+    put_object(worker, bench.OUTPUT_BUCKET, "u/j/f2_result.partial.txt", b"partiel")
+    put_object(worker, bench.INPUT_BUCKET, "u/shared", b"entree 1")
+    put_object(worker, bench.INPUT_BUCKET, "u/f2", b"entree 2")
+
+    export = worker.build_job_export("u", job, True, "exports/j.zip", "1")
+
+    archive = read_object_bytes(worker, "exports/j.zip")
+    assert export == {"file_count": 4, "size": len(archive)}
+    with zipfile.ZipFile(io.BytesIO(archive)) as export_zip:
+        # The input of f3 is missing and skipped
+        assert export_zip.namelist() == [
+            "results/f1_dossier_a.txt_result.txt",
+            "results/f2_a.txt_result.txt",
+            "inputs/f1_dossier_a.txt",
+            "inputs/f2_a.txt",
+        ]
+        contents = [export_zip.read(name) for name in export_zip.namelist()]
+    assert contents == [
+        "<reponse>compressé</reponse>".encode(),
+        large,
+        b"entree 1",
+        b"entree 2",
+    ]
+
+
+def test_export_is_not_rebuilt_for_the_same_job_version(worker, monkeypatch):
+    worker.job_table().put_item(
+        Item={"user_id": "u", "job_id": "j", "updated_at": 1, "input_files": []}
+    )
+    put_object(worker, bench.OUTPUT_BUCKET, "u/j/f1_result.txt", b"resultat")
+    request = {"user_id": "u", "job_id": "j", "include_inputs": False, "key": "e.zip"}
+    worker.handle_export_request(request)
+    builds = []
+
+    def build_job_export(*args):
+        builds.append(args)
+        return {"file_count": 1, "size": 1}
+
+    monkeypatch.setattr(worker, "build_job_export", build_job_export)
+
+    worker.handle_export_request(request)
+    assert builds == []
+
+    worker.set_job_status("u", "j", "COMPLETED")
+    worker.handle_export_request(request)
+    assert len(builds) == 1
+
+
+def test_file_groups_are_packed_first_fit_decreasing(worker, monkeypatch):
+    monkeypatch.setattr(worker.Config, "GROUP_MAX_TOKENS", 100)
+    # 60, 20, 110, 30 and 20 tokens with the per-file overhead
+    sizes = {"a": 175, "b": 35, "c": 350, "d": 70, "e": 35}
+    files = [{"file_id": file_id, "size": size} for file_id, size in sizes.items()]
+
+    groups = worker.pack_file_groups(files)
+
+    # c is over the budget and alone, groups keep the order of the job
+    assert [[file["file_id"] for file in group] for group in groups] == [
+        ["a", "d"],
+        ["b", "e"],
+        ["c"],
+    ]
+
+
+def test_file_groups_are_bounded_in_files(worker, monkeypatch):
+    monkeypatch.setattr(worker.Config, "GROUP_MAX_FILES", 2)
+    files = [{"file_id": f"f{index}", "size": 10} for index in range(3)]
+
+    groups = worker.pack_file_groups(files)
+
+    assert [len(group) for group in groups] == [2, 1]
+
+
+def test_group_response_is_split_by_file_number(worker):
+    response = (
+        "<reponse>Voici :\n"
+        '<fichier numero="2">\n deux\nlignes \n</fichier>\n'
+        '<fichier numero="1">un</fichier>\n'
+        '<fichier numero="1">doublon</fichier>\n'
+        '<fichier numero="3">coupé'
+    )
+
+    assert worker.split_group_response(response) == {1: "un", 2: "deux\nlignes"}
+
+
+def test_files_missing_from_a_group_answer_are_processed_alone(worker):
+    for file_id in ("f1", "f2"):
+        put_object(worker, bench.INPUT_BUCKET, f"u/{file_id}", file_id.encode())
+    bedrock = ScriptedBedrock(
+        [
+            '<reponse><fichier numero="1">réponse 1</fichier></reponse>',
+            "<reponse>réponse 2</reponse>",
+        ]
+    )
+    worker.bedrock_client = lambda: bedrock
+    files = [{"file_id": "f1"}, {"file_id": "f2"}]
+
+    results = worker.process_file_group("u", "j", files, "Résume", 2)
+
+    assert [(result["file_id"], result["status"]) for result in results] == [
+        ("f1", "COMPLETED"),
+        ("f2", "COMPLETED"),
+    ]
+    assert bedrock.requests[1][0]["content"][0]["text"] == "f2"
+    assert read_output(worker, "u/j/f1_result.txt") == "<reponse>réponse 1</reponse>"
+    assert read_output(worker, "u/j/f2_result.txt") == "<reponse>réponse 2</reponse>"
+
+
+class FailingBedrock:
+    """bedrock-runtime stand-in failing every call with the given error code."""
+
+    def __init__(self, code):
+        self.code = code
+
+    def converse(self, **kwargs):
+        raise ClientError(
+            {"Error": {"Code": self.code, "Message": "échec"}}, "Converse"
+        )
+
+
+def run_job_delivery(worker, receive_count):
+    put_object(worker, bench.INPUT_BUCKET, "u/f1", b"contenu")
+    worker.job_table().put_item(
+        Item={"user_id": "u", "job_id": "j", "job_status": "PENDING"}
+    )
+    # Powertools raises when every record of a batch fails, a redelivery of a
+    # finished job keeps one record successful
+    worker.job_table().put_item(
+        Item={"user_id": "u", "job_id": "done", "job_status": "COMPLETED"}
+    )
+    messages = [
+        {
+            "MessageId": job_id,
+            "ReceiptHandle": job_id,
+            "Body": json.dumps(
+                {
+                    "user_id": "u",
+                    "job_id": job_id,
+                    "prompt": "p",
+                    "input_files": [{"file_id": "f1"}],
+                }
+            ),
+            "MD5OfBody": "",
+            "Attributes": {"ApproximateReceiveCount": str(receive_count)},
+        }
+        for job_id in ("j", "done")
+    ]
+    return bench.invoke(worker.lambda_handler, bench.sqs_event(messages), "worker")
+
+
+def test_transient_failures_are_left_to_sqs(worker):
+    worker.bedrock_client = lambda: FailingBedrock("ModelTimeoutException")
+
+    response = run_job_delivery(worker, 1)
+
+    assert response["batchItemFailures"] == [{"itemIdentifier": "j"}]
+    job = get_job(worker)
+    assert job["job_status"] == "PROCESSING"
+    assert "done_file_ids" not in job
+
+
+def test_transient_failures_on_the_last_attempt_fail_the_file(worker):
+    worker.bedrock_client = lambda: FailingBedrock("ModelTimeoutException")
+
+    response = run_job_delivery(worker, worker.Config.MAX_RECEIVE_COUNT)
+
+    assert response["batchItemFailures"] == []
+    job = get_job(worker)
+    assert job["job_status"] == "ERROR"
+    assert job["failed_files"][0]["file_id"] == "f1"
+
+
+def test_permanent_failures_fail_the_file_at_once(worker):
+    worker.bedrock_client = lambda: FailingBedrock("ValidationException")
+
+    response = run_job_delivery(worker, 1)
+
+    assert response["batchItemFailures"] == []
+    assert get_job(worker)["job_status"] == "ERROR"